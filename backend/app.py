@@ -1,20 +1,29 @@
 # backend/app.py
 import os, asyncio
-from fastapi import FastAPI
-from fastapi.responses import JSONResponse, HTMLResponse
+from datetime import datetime, date
+from typing import Optional
+from fastapi import FastAPI, Query, Request
+from fastapi.responses import JSONResponse, HTMLResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
-from db import init_db, list_versions
+import cache, events, http_cache, polling
+from db import init_db, list_versions, latest_version_id
+from settings import GROUP_CODE, GROUPS, POLL_TICK_SECONDS, TIMEZONE, SCRAPE_LEASES, SCRAPE_LEASE_SECONDS
 try:
-    from diff import check_and_store
+    from engine import scrape_all, shutdown as engine_shutdown
+    from diff import format_changes
 except ImportError as e:
-    print(f"Warning: diff module import failed: {e}")
-    # Fallback функция
-    async def check_and_store(group_code: str, url: str):
-        print(f"DIFF CHECK: {group_code} - {url}")
-        return None
+    print(f"Warning: engine module import failed: {e}")
+    # Fallback функции
+    async def scrape_all(groups=None, concurrency=None):
+        print(f"DIFF CHECK: {', '.join(groups or GROUPS)}")
+        return {}
+    def engine_shutdown():
+        pass
+    def format_changes(changes, limit=15):
+        return ""
 try:
     from notifier import notify_admin, close as bot_close
 except ImportError:
@@ -24,9 +33,6 @@ except ImportError:
     async def bot_close():
         pass
 
-GROUP_CODE = os.getenv("GROUP_CODE", "cg389")
-GROUP_URL  = os.getenv("GROUP_PAGE_URL", "https://biik.ru/rasp/cg389.htm")
-
 app = FastAPI(title="BIiK Timetable Scraper")
 
 # Монтируем статические файлы
@@ -44,9 +50,38 @@ async def on_startup():
     except Exception as e:
         print(f"⚠️ Telegram бот не запущен: {e}")
     
+    if SCRAPE_LEASES:
+        # Несколько реплик: очередь опроса общая, в БД. Группы без версий в ней сразу
+        # к проверке — первичный парсинг сделает та реплика, что их возьмёт
+        await asyncio.to_thread(polling.setup_shared, GROUPS)
+        print(f"✅ Общая очередь опроса, реплика {polling.WORKER}")
+    else:
+        await _setup_local()
+
+    # Запускаем планировщик
+    sched = AsyncIOScheduler(timezone=TIMEZONE)
+    
+    # Каждой группе — свой интервал по истории изменений; тик только выбирает, кому пора
+    sched.add_job(poll_tick, 'interval', seconds=POLL_TICK_SECONDS, id='poll_tick')
+    
+    # Обязательные проверки всех групп (по умолчанию 06:30 и 18:30), вразброс
+    for h, m in polling.parse_checkpoints():
+        sched.add_job(poll_checkpoint, CronTrigger(hour=h, minute=m), id=f'poll_checkpoint_{h:02}{m:02}')
+
+    sched.start()
+    print(f"✅ Планировщик запущен: адаптивный опрос {len(GROUPS)} групп + {polling.POLL_CHECKPOINTS}")
+
+async def _setup_local():
+    # История изменений групп — основа интервалов опроса
+    try:
+        await asyncio.to_thread(polling.setup, GROUPS)
+    except Exception as e:
+        print(f"⚠️ Не удалось загрузить историю версий для опроса: {e}")
+        polling.setup(GROUPS, history={})
+
     # Первичный парсинг при запуске, если БД пустая
     try:
-        items = list_versions(GROUP_CODE, 1)
+        items = await asyncio.to_thread(list_versions, GROUP_CODE, 1)
         if not items:
             print("🔄 База данных пустая, запускаем первичный парсинг...")
             await run_job()
@@ -56,65 +91,300 @@ async def on_startup():
         print(f"⚠️ Ошибка при проверке БД: {e}")
         print("🔄 Запускаем первичный парсинг...")
         await run_job()
-    
-    # Запускаем планировщик
-    sched = AsyncIOScheduler(timezone=os.getenv("TZ","Asia/Irkutsk"))
-    
-    # Парсинг каждые 20 минут
-    sched.add_job(run_job, 'interval', minutes=20, id='schedule_check')
-    
-    # Дополнительно два раза в день: 06:30 и 18:30
-    for h in (6, 18):
-        sched.add_job(run_job, CronTrigger(hour=h, minute=30), id=f'schedule_daily_{h}')
-    
-    sched.start()
-    print("✅ Планировщик запущен: каждые 20 минут + 06:30 и 18:30")
 
-async def run_job():
+async def poll_checkpoint(spread_minutes: Optional[float] = None):
+    if SCRAPE_LEASES:
+        await asyncio.to_thread(polling.mark_all_due_shared, GROUPS, spread_minutes)
+    else:
+        polling.mark_all_due(spread_minutes)
+
+# Текущий прогон проверки и счётчики для /api/status
+_current_run: Optional[asyncio.Task] = None
+_current_groups: Optional[dict] = None
+RUN_STATS = {"runs": 0, "coalesced": 0, "waiting": 0, "last_started": None, "last_finished": None}
+
+async def run_job(groups: Optional[dict] = None):
+    """
+    Единственный прогон за раз: тик опроса, cron и /api/force-update, пришедшие во
+    время проверки, не запускают вторую, а дожидаются текущей. groups=None — все группы;
+    если идёт проверка только части групп, а нужны другие — ждём её и запускаем свою.
+    """
+    global _current_run, _current_groups
+    while _current_run is not None and not _current_run.done():
+        if _current_groups is None or (groups is not None and groups.keys() <= _current_groups.keys()):
+            RUN_STATS["coalesced"] += 1
+            RUN_STATS["waiting"] += 1
+            print("ℹ️ Проверка уже идёт — ждём её завершения")
+            try:
+                # shield: отмена одного ожидающего не должна прерывать общий прогон
+                return await asyncio.shield(_current_run)
+            finally:
+                RUN_STATS["waiting"] -= 1
+        await asyncio.wait({_current_run})
+    _current_groups = groups
+    _current_run = asyncio.create_task(_run_job(groups))
+    return await asyncio.shield(_current_run)
+
+async def poll_tick():
+    """Проверяет группы, которым подошёл срок; пока идёт прогон — ждут следующего тика."""
+    if SCRAPE_LEASES:
+        try:
+            await relay_versions()
+        except Exception as e:
+            print(f"⚠️ Не удалось переслать события о версиях: {e}")
+    if _current_run is not None and not _current_run.done():
+        return
+    if not SCRAPE_LEASES:
+        due = polling.due()
+        if due:
+            await run_job(due)
+        return
+    # Общая очередь: проверяем только то, что досталось этой реплике, и продлеваем
+    # аренду, пока идёт проверка
+    due = await asyncio.to_thread(polling.claim)
+    if not due:
+        return
+    keeper = asyncio.create_task(_keep_leases(list(due)))
     try:
-        print(f"🔄 Запуск проверки расписания {GROUP_CODE}...")
-        diff = check_and_store(GROUP_CODE, GROUP_URL)
-        
-        if diff:
-            print(f"✅ Обнаружены изменения: неделя {diff.get('week', 'N/A')}, записей: {diff.get('count', 0)}")
-            await notify_admin(f"🗓 Обновилось расписание {GROUP_CODE} (неделя {diff.get('week', 'N/A')}), записей: {diff.get('count', 0)}\n{GROUP_URL}")
+        await run_job(due)
+    finally:
+        keeper.cancel()
+
+async def relay_versions():
+    """
+    SSE при нескольких репликах: группу проверяет одна из них, а подписчики есть у
+    всех. Раз в тик сверяем последнюю версию каждой группы с подписчиками с тем, что
+    им уже отправлено, и рассылаем новую сами — задержка не больше POLL_TICK_SECONDS.
+    """
+    for code in events.groups():
+        seen = events.last_id(code)
+        if seen is None:
+            # Подписка ещё не отсчитана (catch_up в api_group_events) — на следующем тике
+            continue
+        items = await asyncio.to_thread(list_versions, code, 1)
+        if not items or items[0].id <= seen:
+            continue
+        # Версию записала другая реплика: свою запись в кэше не ждём до LATEST_CACHE_TTL
+        cache.invalidate(code)
+        frame = await asyncio.to_thread(_latest_event, code)
+        if frame is not None:
+            events.publish_frame(code, *frame)
+
+async def _keep_leases(codes: list):
+    while True:
+        await asyncio.sleep(SCRAPE_LEASE_SECONDS / 3)
+        try:
+            await asyncio.to_thread(polling.heartbeat, codes)
+        except Exception as e:
+            print(f"⚠️ Не удалось продлить аренду групп: {e}")
+
+def run_stats() -> dict:
+    return {**RUN_STATS, "in_progress": _current_run is not None and not _current_run.done()}
+
+async def _run_job(groups: Optional[dict] = None):
+    RUN_STATS["runs"] += 1
+    RUN_STATS["last_started"] = datetime.utcnow().isoformat()
+    try:
+        await _check_groups(groups)
+    finally:
+        RUN_STATS["last_finished"] = datetime.utcnow().isoformat()
+
+async def _check_groups(groups: Optional[dict] = None):
+    # Загрузка, разбор и SQLite — в пуле потоков движка, event loop не блокируется
+    print(f"🔄 Запуск проверки расписания: {', '.join(groups or GROUPS)}...")
+    results = await scrape_all(groups)
+    for code, diff in results.items():
+        url = GROUPS.get(code, "")
+        # Ошибка загрузки — тоже проверка: следующая по обычному интервалу
+        if SCRAPE_LEASES:
+            try:
+                if not await asyncio.to_thread(polling.finish, code):
+                    print(f"⚠️ {code}: аренду забрала другая реплика")
+            except Exception as e:
+                print(f"⚠️ {code}: не удалось завершить задачу опроса: {e}")
         else:
-            print("ℹ️ Изменений в расписании не обнаружено")
-            
-    except Exception as e:
-        error_msg = f"❌ Ошибка при проверке расписания: {e}"
-        print(error_msg)
+            polling.record(code, bool(diff) and not isinstance(diff, Exception))
         try:
-            await notify_admin(error_msg)
-        except Exception as notify_error:
-            print(f"⚠️ Не удалось отправить уведомление: {notify_error}")
+            if isinstance(diff, Exception):
+                raise diff
+            if diff:
+                print(f"✅ {code}: обнаружены изменения: неделя {diff.get('week', 'N/A')}, записей: {diff.get('count', 0)}")
+                text = f"🗓 Обновилось расписание {code} (неделя {diff.get('week', 'N/A')}), записей: {diff.get('count', 0)}"
+                if diff.get("changes"):
+                    text += "\n\n" + format_changes(diff["changes"])
+                # Открытые мини-приложения узнают о версии сразу, без опроса
+                if diff.get("version_id"):
+                    events.publish_frame(code, _version_event(code, diff["version_id"], diff.get("week"),
+                                                              diff.get("count", 0), diff.get("changes")),
+                                         diff["version_id"])
+                await notify_admin(f"{text}\n{url}")
+            else:
+                print(f"ℹ️ {code}: изменений в расписании не обнаружено")
+        except Exception as e:
+            error_msg = f"❌ Ошибка при проверке расписания {code}: {e}"
+            print(error_msg)
+            try:
+                await notify_admin(error_msg)
+            except Exception as notify_error:
+                print(f"⚠️ Не удалось отправить уведомление: {notify_error}")
+
+# Не больше стольких версий на странице истории
+VERSIONS_PAGE_MAX = 100
+
+def _versions_page(request: Request, group_code: str, before: Optional[int], limit: int):
+    """
+    Страница истории от новых к старым. Курсор — id последней показанной версии:
+    следующая страница — ?before=<X-Next-Before>. Заголовка нет — дальше пусто.
+    """
+    limit = max(1, min(limit, VERSIONS_PAGE_MAX))
+    if before is None:
+        # Первая страница меняется только с новой версией группы — ETag по id последней
+        # (один поиск по индексу, без загрузки самой версии)
+        etag = f'"versions-{group_code}-{latest_version_id(group_code) or 0}-{limit}"'
+    else:
+        # Версии старше before уже не появятся — страница неизменна
+        etag = f'"versions-{group_code}-b{before}-{limit}"'
+
+    def build():
+        items = list_versions(group_code, limit + 1, before)
+        headers = {"X-Next-Before": str(items[limit - 1].id)} if len(items) > limit else {}
+        return http_cache.Payload([{
+            "id": v.id, "week": v.week_start, "created_at": v.created_at.isoformat()
+        } for v in items[:limit]], headers)
+    return http_cache.json_response(request, build, etag=etag)
 
 @app.get("/api/versions")
-def api_versions():
-    return JSONResponse([{
-        "id": v.id, "week": v.week_start, "created_at": v.created_at.isoformat()
-    } for v in list_versions(GROUP_CODE, 20)])
+def api_versions(request: Request, before: Optional[int] = None, limit: int = 20):
+    return _versions_page(request, GROUP_CODE, before, limit)
+
+@app.get("/api/groups/{code}/versions")
+def api_group_versions(request: Request, code: str, before: Optional[int] = None, limit: int = 20):
+    return _versions_page(request, code, before, limit)
+
+def _date_range(date_from: Optional[str], date_to: Optional[str]):
+    """?from=&to= (yyyy-mm-dd) -> (начало, конец, суффикс ETag); ValueError — неверная дата."""
+    start = date.fromisoformat(date_from) if date_from else date.min
+    end = date.fromisoformat(date_to) if date_to else date.max
+    return start, end, f"-{date_from or ''}-{date_to or ''}" if date_from or date_to else ""
 
 @app.get("/api/schedule/{version_id}")
-def api_schedule(version_id: int):
+def api_schedule(request: Request, version_id: int, date_from: Optional[str] = Query(None, alias="from"),
+                 date_to: Optional[str] = Query(None, alias="to"), fmt: str = Query("v1", alias="format")):
+    """
+    Занятия любой версии по id; ?from=&to= (yyyy-mm-dd) — только за эти дни.
+    По умолчанию — словари v1, как и раньше (дата в начале subject; raw не хранится
+    с payload v2); ?format=v2 — явные поля date, weekday, start, end...
+    """
     try:
-        from db import list_versions
-        items = list_versions(GROUP_CODE, 1)
-        if items and items[0].id == version_id:
-            from json import loads
-            schedule_data = loads(items[0].payload)
-            return JSONResponse(schedule_data)
+        start, end, span = _date_range(date_from, date_to)
+    except ValueError:
+        return JSONResponse({"error": "Даты ожидаются в формате yyyy-mm-dd"}, status_code=400)
+    try:
+        # Последняя и недавние версии — из памяти. Диапазон дат прочих версий — индексной
+        # выборкой из LessonRow, без разбора всей версии; целиком — по первичному ключу
+        entry, lessons = cache.peek(version_id), None
+        if entry is None and span:
+            from db import get_version, lessons_in_range
+            ver = get_version(version_id)
+            if ver:
+                lessons = lambda start, end: lessons_in_range(ver.group_code, start, end, version_id)
+        elif entry is None:
+            entry = cache.version(version_id)
+        if entry:
+            lessons = entry.in_range if span else lambda *_: entry.lessons
+        if lessons:
+            v2 = fmt == "v2"
+            # Версия неизменна: ETag по id, диапазону и формату, клиент кэширует навсегда
+            return http_cache.json_response(
+                request, lambda: [l.to_dict() if v2 else l.to_legacy() for l in lessons(start, end)],
+                etag=f'"schedule-{version_id}{span}{"-v2" if v2 else ""}"', cache_control=http_cache.IMMUTABLE)
         else:
             return JSONResponse({"error": "Версия не найдена"}, status_code=404)
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=500)
 
+@app.get("/api/groups/{code}/latest")
+def api_group_latest(request: Request, code: str, date_from: Optional[str] = Query(None, alias="from"),
+                     date_to: Optional[str] = Query(None, alias="to")):
+    """
+    Всё для первого экрана одним запросом: метаданные последней версии и занятия,
+    сгруппированные по дням (от ранних к поздним). Из кэша версий; ETag по id версии.
+    """
+    try:
+        start, end, span = _date_range(date_from, date_to)
+    except ValueError:
+        return JSONResponse({"error": "Даты ожидаются в формате yyyy-mm-dd"}, status_code=400)
+    try:
+        entry = cache.latest(code)
+        if not entry:
+            return JSONResponse({"error": "Данных о расписании пока нет"}, status_code=404)
+
+        def build():
+            ver = entry.version
+            return {
+                "id": ver.id, "group": code, "week": ver.week_start, "hash": ver.hash,
+                "created_at": ver.created_at.isoformat(),
+                "days": [{"date": d.isoformat(), "lessons": [l.to_dict() for l in entry.by_date[d]]}
+                         for d in entry.days(start, end)],
+            }
+        return http_cache.json_response(request, build, etag=f'"latest-{code}-{entry.id}{span}"')
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+def _version_event(code: str, version_id: int, week: Optional[str], count: int, changes: Optional[dict]) -> str:
+    # id события — id версии: по Last-Event-ID переподключившийся клиент получит пропущенное
+    return events.format_event("version", {"group": code, "version_id": version_id, "week": week,
+                                           "count": count, "changes": changes}, version_id)
+
+def _entry_event(code: str, entry) -> tuple[str, int]:
+    from db import version_changes
+    return _version_event(code, entry.id, entry.version.week_start, len(entry.lessons),
+                          version_changes(entry.version)), entry.id
+
+def _latest_event(code: str) -> Optional[tuple[str, int]]:
+    # Блокирующий: загрузка версии и набора изменений из БД
+    entry = cache.latest(code)
+    return _entry_event(code, entry) if entry is not None else None
+
+@app.get("/api/groups/{code}/events")
+async def api_group_events(request: Request, code: str, after: Optional[int] = None):
+    """
+    SSE: событие version при каждой новой версии группы (id, неделя, набор изменений).
+    Одно простаивающее соединение на клиента вместо опроса /api/versions.
+    ?after= — id версии, которую клиент уже показал (Last-Event-ID важнее).
+    """
+    if events.full():
+        return JSONResponse({"error": "Слишком много подключений"}, status_code=503,
+                            headers={"Retry-After": "30"})
+    try:
+        last_seen = int(request.headers.get("last-event-id", ""))
+    except ValueError:
+        last_seen = after
+
+    async def catch_up():
+        entry = await cache.latest_async(code)
+        # Отсчёт для relay_versions: версию, которую другая реплика запишет после этой,
+        # клиент получит на ближайшем тике. Если он видел более старую — догонит ниже
+        events.seed(code, entry.id if entry else 0)
+        if entry is None or last_seen is None or entry.id <= last_seen:
+            return None
+        frame, _ = _entry_event(code, entry)
+        return frame
+
+    return StreamingResponse(events.stream(code, catch_up), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @app.post("/api/force-update")
 async def force_update():
     """Принудительный запуск обновления расписания"""
     try:
         print("🔄 Принудительный запуск обновления расписания...")
-        await run_job()
+        if SCRAPE_LEASES:
+            # Не в обход очереди: иначе группы проверит каждая реплика, получившая запрос
+            await poll_checkpoint(0)
+            await poll_tick()
+        else:
+            await run_job()
         return JSONResponse({"status": "success", "message": "Обновление запущено"})
     except Exception as e:
         error_msg = f"Ошибка при принудительном обновлении: {e}"
@@ -122,28 +392,37 @@ async def force_update():
         return JSONResponse({"status": "error", "message": error_msg}, status_code=500)
 
 @app.get("/api/status")
-def api_status():
+def api_status(request: Request):
     """Статус системы"""
     try:
-        from db import list_versions
-        items = list_versions(GROUP_CODE, 1)
+        entry = cache.latest(GROUP_CODE)
         
-        if items:
-            latest = items[0]
-            from json import loads
-            schedule_data = loads(latest.payload)
-            return JSONResponse({
+        if entry:
+            latest = entry.version
+            from scraper import encoding_stats
+            return http_cache.json_response(request, lambda: {
                 "status": "running",
                 "last_update": latest.created_at.isoformat(),
                 "week": latest.week_start,
-                "records_count": len(schedule_data),
-                "group": GROUP_CODE
+                "records_count": len(entry.lessons),
+                "group": GROUP_CODE,
+                "encoding": encoding_stats(),
+                "scrape": run_stats(),
+                "cache": cache.stats(),
+                "http": http_cache.stats(),
+                "events": events.stats(),
+                "polling": polling.stats()
             })
         else:
-            return JSONResponse({
+            return http_cache.json_response(request, lambda: {
                 "status": "no_data",
                 "message": "База данных пустая",
-                "group": GROUP_CODE
+                "group": GROUP_CODE,
+                "scrape": run_stats(),
+                "cache": cache.stats(),
+                "http": http_cache.stats(),
+                "events": events.stats(),
+                "polling": polling.stats()
             })
     except Exception as e:
         return JSONResponse({
@@ -154,7 +433,7 @@ def api_status():
 
 @app.get("/")
 def web_home():
-    html = """
+    html = f"""
     <!DOCTYPE html>
     <html lang="ru">
     <head>
@@ -171,7 +450,7 @@ def web_home():
         <meta name="msapplication-TileColor" content="#2481cc">
         <meta name="theme-color" content="#2481cc">
     </head>
-    <body>
+    <body data-group="{GROUP_CODE}">
         <div class="header">
             <h1>📅 Расписание BIiK</h1>
             <div class="subtitle">Группа CG389</div>
@@ -195,4 +474,13 @@ def web_home():
 
 @app.on_event("shutdown")
 async def on_shutdown():
+    if SCRAPE_LEASES:
+        # Аренды отдаём сразу, не дожидаясь истечения
+        try:
+            await asyncio.to_thread(polling.release)
+        except Exception as e:
+            print(f"⚠️ Не удалось освободить аренды: {e}")
+    engine_shutdown()
+    from db import dispose_async_engine
+    await dispose_async_engine()
     await bot_close()
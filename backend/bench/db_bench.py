@@ -0,0 +1,69 @@
+# backend/bench/db_bench.py
+"""
+Задержка запросов к истории версий на большой таблице: с индексами и без.
+Запуск из backend/: python bench/db_bench.py [версий] [групп]
+"""
+import os, sys, time, random, tempfile
+from datetime import datetime, timedelta
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Отдельный файл БД: engine создаётся при импорте db
+DB_PATH = os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+
+from sqlalchemy import insert, text
+import db
+
+def fill(versions: int, groups: int):
+    started = datetime(2024, 1, 1)
+    rows = [{
+        "group_code": f"g{n % groups}",
+        "week_start": (started + timedelta(weeks=n * 52 // versions)).strftime('%Y-%m-%d'),
+        "hash": f"{n:064x}",
+        "payload": '{"v":2,"fields":[],"lessons":[]}',
+        "created_at": started + timedelta(minutes=n),
+    } for n in range(versions)]
+    with db.engine.begin() as conn:
+        conn.execute(insert(db.ScheduleVersion), rows)
+        conn.execute(insert(db.UserDailyUsage), [{
+            "chat_id": -100 - n % 50, "user_id": n, "date_ymd": "2025-09-29", "count": 1,
+            "updated_at": started} for n in range(versions // 10)])
+
+def measure(groups: int, repeat: int = 200):
+    rnd = random.Random(1)
+    weeks = [r[0] for r in db.engine.connect().execute(text("SELECT DISTINCT week_start FROM scheduleversion"))]
+    top = db.engine.connect().execute(text("SELECT max(id) FROM scheduleversion")).scalar()
+    cases = {
+        "last_version": lambda: db.last_version(f"g{rnd.randrange(groups)}", rnd.choice(weeks)),
+        "list_versions": lambda: db.list_versions(f"g{rnd.randrange(groups)}", 20),
+        # страница из глубины истории: курсор before вместо OFFSET
+        "list_versions_before": lambda: db.list_versions(f"g{rnd.randrange(groups)}", 20, rnd.randrange(top)),
+        "get_user_daily_count": lambda: db.get_user_daily_count(-100 - rnd.randrange(50), rnd.randrange(1000), "2025-09-29"),
+    }
+    result = {}
+    for name, call in cases.items():
+        call()
+        started = time.perf_counter()
+        for _ in range(repeat):
+            call()
+        result[name] = (time.perf_counter() - started) / repeat * 1000
+    return result
+
+def main():
+    versions = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    groups = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    db.init_db()
+    fill(versions, groups)
+    indexed = measure(groups)
+    with db.engine.begin() as conn:
+        for table in (db.ScheduleVersion.__table__, db.UserDailyUsage.__table__):
+            for index in table.indexes:
+                conn.execute(text(f"DROP INDEX {index.name}"))
+    plain = measure(groups, repeat=20)
+    print(f"{versions} версий, {groups} групп, {versions // 10} счётчиков лимита")
+    for name in indexed:
+        print(f"{name:22} без индексов {plain[name]:8.2f} мс   с индексами {indexed[name]:6.2f} мс")
+    os.remove(DB_PATH)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+# backend/bench/pages.py
+from datetime import date, timedelta
+
+SUBJECTS = [
+    "ОС (Лек) 301 <a href='t1.htm'>Белоусова М.В.</a>",
+    "ФЛП (Практич.) 319 <a href='t2.htm'>Елтунова И.Б.</a>",
+    "ТСВПС (Практич.) 308 <a href='t3.htm'>Извеков Я.О.</a>",
+    "ОС (Лаб) 308 Семёнов В.А.",
+    "МДК 01.01 (Пр) ЦМИТ Протасов А.Е.",
+    "Физ-ра (Сем) сз2 Убеев А.А.",
+    "Право (Зач) 214 Жамбаев Б.Ц.",
+]
+WEEKDAYS = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб"]
+
+def make_page(weeks: int = 1, start: date = date(2025, 9, 1)) -> str:
+    """
+    Синтетическая страница в вёрстке «Экспресс-расписания»: первая пара — в строке
+    с датой (rowspan), остальные — отдельными строками, плюс пустые пары.
+    """
+    rows = []
+    for w in range(weeks):
+        for d, wd in enumerate(WEEKDAYS):
+            day = start + timedelta(weeks=w, days=d)
+            label = f"{day:%d.%m.%Y} {wd}-{w % 2 + 1}"
+            for pair in range(1, 8):
+                subj = SUBJECTS[(w + d + pair) % len(SUBJECTS)] if (d + pair) % 4 else "&nbsp;"
+                if pair == 1:
+                    rows.append(f"<tr><td rowspan='7' class='hd'>{label}</td>"
+                                f"<td class='hd'>{pair}</td><td class='ur'>{subj}</td></tr>")
+                else:
+                    rows.append(f"<tr><td class='hd'>{pair}</td><td class='ur'>{subj}</td></tr>")
+    return ("<html><head><meta http-equiv='Content-Type' content='text/html; charset=windows-1251'>"
+            "<title>cg389</title></head><body><h1>Группа cg389</h1>"
+            "<table border='1'>" + "\n".join(rows) + "</table></body></html>")
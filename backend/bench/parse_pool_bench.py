@@ -0,0 +1,47 @@
+# backend/bench/parse_pool_bench.py
+"""
+Обход многих групп: разбор в потоках против разбора в пуле процессов.
+Показывает общее время и наибольшую задержку event loop во время обхода.
+Запуск из backend/: python bench/parse_pool_bench.py [групп] [воркеров]
+"""
+import os, sys, time, asyncio
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import parse_pool
+from scraper import parse_schedule
+from pages import make_page
+
+async def sweep(pages, parse):
+    lag = 0.0
+    done = False
+
+    async def ticker():
+        # Так event loop видят обработчики бота и API
+        nonlocal lag
+        while not done:
+            started = time.perf_counter()
+            await asyncio.sleep(0.01)
+            lag = max(lag, time.perf_counter() - started - 0.01)
+
+    tick = asyncio.create_task(ticker())
+    started = time.perf_counter()
+    await asyncio.gather(*(asyncio.to_thread(parse, html) for html in pages))
+    elapsed = time.perf_counter() - started
+    done = True
+    await tick
+    return elapsed, lag
+
+def main():
+    groups = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else (os.cpu_count() or 2)
+    pages = [make_page(8) for _ in range(groups)]
+    parse_pool.PARSE_WORKERS = workers
+    parse_pool.parse(pages[0])  # прогрев процессов
+    for label, parse in (("потоки", parse_schedule), (f"пул x{workers}", parse_pool.parse)):
+        elapsed, lag = asyncio.run(sweep(pages, parse))
+        print(f"{label:10} {groups} страниц за {elapsed * 1000:7.0f} мс, макс. задержка loop {lag * 1000:6.1f} мс")
+    parse_pool.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+# backend/bench/parsers_bench.py
+"""
+Сравнение бэкендов разбора: строк таблицы в секунду на многонедельной странице.
+Запуск из backend/: python bench/parsers_bench.py [недель] [повторов]
+"""
+import os, sys, time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import parsers
+from scraper import normalize_schedule
+from pages import make_page
+
+def main():
+    weeks = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    html = make_page(weeks)
+    rows = sum(1 for _ in parsers.load(html, "html.parser").rows())
+    print(f"Страница: {len(html) // 1024} КБ, {rows} строк, {weeks} недель")
+
+    reference = None
+    for name in parsers.BACKENDS:
+        items = normalize_schedule(html, name)
+        if reference is None:
+            reference = items
+        same = "совпадает" if items == reference else "ОТЛИЧАЕТСЯ"
+        started = time.perf_counter()
+        for _ in range(repeat):
+            normalize_schedule(html, name)
+        elapsed = (time.perf_counter() - started) / repeat
+        print(f"{name:12} {rows / elapsed:10.0f} строк/с  {elapsed * 1000:8.1f} мс/страница  вывод {same}")
+
+if __name__ == "__main__":
+    main()
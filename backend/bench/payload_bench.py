@@ -0,0 +1,68 @@
+# backend/bench/payload_bench.py
+"""
+Размер БД, запись и чтение версий: payload прямо в строке (inline), сжатые блобы
+и дельты к предыдущей версии. История — мелкие правки вперемешку с откатами.
+Запуск из backend/: python bench/payload_bench.py [версий] [недель на странице]
+"""
+import os, sys, time, random, tempfile
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+DB_DIR = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_DIR}/bench.db"
+
+from sqlalchemy import text
+import cache, db
+from lessons import Lesson
+from scraper import parse_schedule, schedule_hash
+from pages import make_page
+
+def history(versions: int, weeks: int):
+    # Каждая версия правит одну пару предыдущей; иногда колледж возвращает прежний вариант
+    rnd = random.Random(1)
+    seq = [parse_schedule(make_page(weeks))]
+    while len(seq) < versions:
+        if rnd.random() < 0.2:
+            seq.append(rnd.choice(seq))
+            continue
+        lessons = [Lesson.from_row(l.to_row()) for l in seq[-1]]
+        rnd.choice(lessons).room = str(rnd.randrange(100, 400))
+        seq.append(lessons)
+    return seq
+
+def run(mode: str, seq):
+    db.engine.dispose()
+    for name in os.listdir(DB_DIR):
+        os.remove(os.path.join(DB_DIR, name))
+    db.PAYLOAD_STORAGE = mode
+    db.init_db()
+    started = time.perf_counter()
+    for lessons in seq:
+        db.save_version("bench", "2025-09-29", schedule_hash(lessons), lessons)
+    elapsed = time.perf_counter() - started
+    # Чтение случайных версий с холодным кэшем
+    ids = [v.id for v in db.list_versions("bench", len(seq))]
+    cache.clear()
+    picks = random.Random(2).sample(ids, min(50, len(ids)))
+    read_started = time.perf_counter()
+    for vid in picks:
+        db.version_lessons_by_id(vid)
+    read = (time.perf_counter() - read_started) / len(picks)
+    with db.engine.connect() as conn:
+        conn.execute(text("PRAGMA wal_checkpoint(TRUNCATE)"))
+        pages = conn.execute(text("PRAGMA page_count")).scalar() - conn.execute(text("PRAGMA freelist_count")).scalar()
+        page_size = conn.execute(text("PRAGMA page_size")).scalar()
+    return pages * page_size, elapsed, read
+
+def main():
+    versions = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    weeks = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    seq = history(versions, weeks)
+    print(f"{versions} версий, {weeks} нед. на странице, вариантов {len({schedule_hash(s) for s in seq})}")
+    for mode in ("inline", "blob", "delta"):
+        size, elapsed, read = run(mode, seq)
+        print(f"{mode:7} БД {size / 1024:8.0f} КиБ   запись {elapsed / versions * 1000:6.2f} мс/версия"
+              f"   чтение (холодный кэш) {read * 1000:6.2f} мс/версия")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+# backend/bench/poll_sim.py
+"""
+Симуляция опроса за несколько недель: прежний фиксированный (все группы раз в 20 минут
+плюс 06:30 и 18:30) против адаптивного (polling.py). Изменения страниц синтетические:
+расписание следующей недели (чт–сб) у всех, у части групп — ещё серии правок; всё в рабочие часы.
+Считает число загрузок, задержку обнаружения изменения и пик загрузок за минуту.
+Запуск из backend/: python bench/poll_sim.py [групп] [недель]
+"""
+import os, sys, random
+from bisect import bisect_left
+from collections import Counter
+from datetime import datetime, timedelta
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import polling
+
+START = datetime(2025, 9, 7, 16, 0)   # понедельник 00:00 по Иркутску (UTC+8)
+TICK = timedelta(seconds=30)
+
+def changes_for(rnd: random.Random, weeks: int) -> list:
+    """Времена изменений страницы группы (UTC), включая месяц истории до START."""
+    busy = rnd.random() < 0.3
+    times = []
+    for w in range(-4, weeks):
+        monday = START + timedelta(weeks=w)
+        # Расписание на следующую неделю выкладывают в чт–сб, правки — в любой рабочий день;
+        # всё в 09:00–18:00 местного времени, в серии 1–3 правки за пару часов
+        days = [rnd.randrange(3, 6)] + [rnd.randrange(6) for _ in range(rnd.randint(2, 5) if busy else rnd.choice((0, 0, 0, 1)))]
+        for d in days:
+            at = monday + timedelta(days=d, hours=9 + rnd.uniform(0, 9))
+            for _ in range(rnd.randint(1, 3)):
+                times.append(at)
+                at += timedelta(minutes=rnd.uniform(10, 90))
+    return sorted(times)
+
+def detect(changes: list, fetches: list):
+    """Задержки (мин) от изменения до первой загрузки после него."""
+    delays = []
+    for c in changes:
+        i = bisect_left(fetches, c)
+        if i < len(fetches):
+            delays.append((fetches[i] - c).total_seconds() / 60)
+    return delays
+
+def fixed(groups: dict, end: datetime) -> dict:
+    times, t = [], START
+    while t < end:
+        times.append(t)
+        t += timedelta(minutes=20)
+    day = START
+    while day < end:
+        # 06:30 и 18:30 по Иркутску
+        times += [day + timedelta(hours=6, minutes=30), day + timedelta(hours=18, minutes=30)]
+        day += timedelta(days=1)
+    times = sorted(times)
+    return {code: times for code in groups}
+
+def adaptive(groups: dict, history: dict, end: datetime) -> dict:
+    polling._random.seed(2)
+    polling.setup({code: "" for code in groups}, history=history, now=START)
+    seen = {code: START for code in groups}
+    fetched = {code: [] for code in groups}
+    checkpoints = {(h, m) for h, m in polling.parse_checkpoints()}
+    now = START
+    while now < end:
+        local = now + timedelta(hours=8)
+        if now.second == 0 and (local.hour, local.minute) in checkpoints:
+            polling.mark_all_due(now=now)
+        for code in polling.due(now):
+            changes = groups[code]
+            changed = bisect_left(changes, now) > bisect_left(changes, seen[code])
+            seen[code] = now
+            fetched[code].append(now)
+            polling.record(code, changed, now)
+        now += TICK
+    return fetched
+
+def report(name: str, groups: dict, fetched: dict):
+    delays = sorted(d for code in groups for d in detect([c for c in groups[code] if c >= START], fetched[code]))
+    per_minute = Counter(t.replace(second=0) for times in fetched.values() for t in times)
+    total = sum(len(t) for t in fetched.values())
+    print(f"{name:12} загрузок {total:7}   задержка: средняя {sum(delays) / len(delays):5.1f} мин, "
+          f"p95 {delays[int(len(delays) * 0.95)]:5.1f} мин   пик {max(per_minute.values()):4} загрузок/мин")
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    weeks = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    rnd = random.Random(1)
+    groups = {f"g{n}": changes_for(rnd, weeks) for n in range(count)}
+    history = {code: [c for c in times if c < START] for code, times in groups.items()}
+    end = START + timedelta(weeks=weeks)
+    print(f"{count} групп, {weeks} нед., изменений: {sum(len([c for c in t if c >= START]) for t in groups.values())}")
+    report("фиксированный", groups, fixed(groups, end))
+    report("адаптивный", groups, adaptive(groups, history, end))
+
+if __name__ == "__main__":
+    main()
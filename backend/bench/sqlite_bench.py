@@ -0,0 +1,101 @@
+# backend/bench/sqlite_bench.py
+"""
+Одновременные чтения и записи: SQLite по умолчанию против профиля (WAL, прагмы, пул)
+и асинхронного engine. Писатели сохраняют версии, читатели выбирают день.
+Запуск из backend/: python bench/sqlite_bench.py [секунд] [читателей] [писателей]
+"""
+import os, sys, time, asyncio, tempfile, threading
+from datetime import date
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+DB_DIR = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_DIR}/bench.db"
+
+import db
+from scraper import parse_schedule
+from pages import make_page
+
+LESSONS = parse_schedule(make_page(1))
+DAY = next(l.date for l in LESSONS if l.date)
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] * 1000 if values else 0.0
+
+def run_threads(seconds: int, readers: int, writers: int, read=None):
+    latencies, errors, writes = [], [0], [0]
+    stop = time.monotonic() + seconds
+
+    def reader():
+        while time.monotonic() < stop:
+            started = time.perf_counter()
+            try:
+                (read or db.lessons_on_date)("bench", DAY)
+                latencies.append(time.perf_counter() - started)
+            except Exception:
+                errors[0] += 1
+
+    def writer():
+        while time.monotonic() < stop:
+            try:
+                db.save_version("bench", "2025-09-29", "h", LESSONS)
+                writes[0] += 1
+            except Exception:
+                errors[0] += 1
+
+    threads = [threading.Thread(target=reader) for _ in range(readers)] + \
+              [threading.Thread(target=writer) for _ in range(writers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies, writes[0], errors[0]
+
+def run_async(seconds: int, readers: int, writers: int):
+    # Читатели — корутины на одном loop (как обработчики бота), писатели — потоки
+    latencies, errors = [], [0]
+    result = {}
+
+    async def main():
+        stop = time.monotonic() + seconds
+
+        async def reader():
+            while time.monotonic() < stop:
+                started = time.perf_counter()
+                try:
+                    await db.lessons_on_date_async("bench", DAY)
+                    latencies.append(time.perf_counter() - started)
+                except Exception:
+                    errors[0] += 1
+
+        write = asyncio.to_thread(run_threads, seconds, 0, writers)
+        _, result["writes"], result["errors"] = (await asyncio.gather(write, *(reader() for _ in range(readers))))[0]
+        await db.dispose_async_engine()
+
+    asyncio.run(main())
+    return latencies, result["writes"], errors[0] + result["errors"]
+
+def reset(tuned: bool):
+    db.engine.dispose()
+    for name in os.listdir(DB_DIR):
+        os.remove(os.path.join(DB_DIR, name))
+    db.engine = db.make_engine(db.DATABASE_URL, tuned=tuned)
+    db.init_db()
+    db.save_version("bench", "2025-09-29", "h", LESSONS)
+
+def main():
+    seconds = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    readers = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    writers = int(sys.argv[3]) if len(sys.argv) > 3 else 2
+    print(f"{seconds} с, читателей {readers}, писателей {writers}")
+    for label, tuned, runner in (("по умолчанию", False, run_threads),
+                                 ("профиль", True, run_threads),
+                                 ("профиль+async", True, run_async)):
+        reset(tuned)
+        latencies, writes, errors = runner(seconds, readers, writers)
+        print(f"{label:14} чтений {len(latencies) / seconds:7.0f}/с  p50 {percentile(latencies, 0.5):6.2f} мс  "
+              f"p95 {percentile(latencies, 0.95):6.2f} мс  записей {writes / seconds:5.0f}/с  ошибок {errors}")
+
+if __name__ == "__main__":
+    main()
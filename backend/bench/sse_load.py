@@ -0,0 +1,87 @@
+# backend/bench/sse_load.py
+"""
+Нагрузка на SSE: тысячи простаивающих подписчиков одной группы. Меряет память на
+соединение, CPU в простое и задержку доставки события всем подписчикам.
+Сервер (uvicorn, без lifespan — без бота и планировщика) и клиенты — в одном процессе.
+Запуск из backend/: python bench/sse_load.py [подписчиков] [секунд простоя]
+"""
+import os, sys, time, asyncio, resource, tempfile
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/bench.db"
+os.environ.setdefault("SSE_PING_SECONDS", "2")
+os.environ.setdefault("SSE_MAX_CLIENTS", "100000")
+
+import uvicorn
+import app, events
+
+PORT = 8765
+GROUP = "bench"
+
+def rss_kb() -> int:
+    with open("/proc/self/status") as f:
+        return next(int(line.split()[1]) for line in f if line.startswith("VmRSS"))
+
+def cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+async def connect():
+    reader, writer = await asyncio.open_connection("127.0.0.1", PORT)
+    writer.write(f"GET /api/groups/{GROUP}/events HTTP/1.1\r\nHost: bench\r\n"
+                 "Accept: text/event-stream\r\n\r\n".encode())
+    await reader.readuntil(b"retry: 5000")
+    return reader, writer
+
+async def wait_event(reader) -> float:
+    await reader.readuntil(b"event: version")
+    return time.perf_counter()
+
+async def main(clients: int, idle: float):
+    server = uvicorn.Server(uvicorn.Config(app.app, port=PORT, lifespan="off", log_level="warning",
+                                           backlog=clients, limit_concurrency=None))
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    rss0 = rss_kb()
+    started = time.perf_counter()
+    conns = []
+    # Подключаемся пачками, чтобы не упереться в backlog
+    for i in range(0, clients, 500):
+        conns += await asyncio.gather(*(connect() for _ in range(min(500, clients - i))))
+    connected = time.perf_counter() - started
+    assert events.subscribers(GROUP) == clients, events.subscribers(GROUP)
+    rss1 = rss_kb()
+
+    cpu0 = cpu_seconds()
+    await asyncio.sleep(idle)
+    idle_cpu = cpu_seconds() - cpu0
+
+    waiters = [asyncio.create_task(wait_event(r)) for r, _ in conns]
+    await asyncio.sleep(0.1)
+    sent = time.perf_counter()
+    delivered = events.publish_frame(GROUP, app._version_event(GROUP, 1, "2025-09-29", 42, None))
+    latencies = sorted((t - sent) * 1000 for t in await asyncio.gather(*waiters))
+
+    for _, w in conns:
+        w.close()
+    # Отключения сервер замечает на ближайшей записи — не позже пинга
+    deadline = time.perf_counter() + events.SSE_PING_SECONDS * 3
+    while events.subscribers() and time.perf_counter() < deadline:
+        await asyncio.sleep(0.2)
+    left = events.subscribers()
+    server.should_exit = True
+    await serving
+
+    print(f"{clients} подписчиков: подключение {connected:.2f} c, "
+          f"память {(rss1 - rss0) / clients:.1f} КиБ/соединение (сервер и клиент вместе)")
+    print(f"простой {idle:.0f} c: CPU {idle_cpu * 1000:.0f} мс (пинг раз в {events.SSE_PING_SECONDS:g} c)")
+    print(f"событие доставлено {delivered}: p50 {latencies[len(latencies) // 2]:.1f} мс, "
+          f"p99 {latencies[int(len(latencies) * 0.99) - 1]:.1f} мс, макс {latencies[-1]:.1f} мс")
+    print(f"после отключения клиентов подписок осталось: {left}")
+
+if __name__ == "__main__":
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    idle = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+    asyncio.run(main(clients, idle))
@@ -0,0 +1,43 @@
+# backend/bench/stream_bench.py
+"""
+Пиковая память разбора: parse_schedule (DOM целиком) против iter_schedule (поток).
+tracemalloc видит только память Python: дерево libxml2 у lxml в DOM-режиме не учитывается.
+Запуск из backend/: python bench/stream_bench.py
+"""
+import os, sys, time, tracemalloc
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import parsers
+from scraper import parse_schedule, iter_schedule
+from pages import make_page
+
+CHUNK = 64 * 1024
+
+def measure(fn):
+    tracemalloc.start()
+    started = time.perf_counter()
+    count = fn()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return count, peak, elapsed
+
+def chunks_of(html):
+    # Страница «приходит из сети» кусками; целиком в памяти она есть только у DOM-варианта
+    for i in range(0, len(html), CHUNK):
+        yield html[i:i + CHUNK]
+
+def main():
+    for weeks in (4, 16, 64):
+        html = make_page(weeks)
+        print(f"{weeks:3} недель, {len(html) // 1024} КБ")
+        for name in parsers.BACKENDS:
+            dom = measure(lambda: len(parse_schedule(html, name)))
+            # Учитываем только сами записи: потребитель может писать их дальше по одной
+            stream = measure(lambda: sum(1 for _ in iter_schedule(chunks_of(html), name)))
+            for label, (count, peak, elapsed) in (("DOM", dom), ("поток", stream)):
+                print(f"    {name:12} {label:6} {count:5} записей  пик {peak / 1024:8.0f} КБ  {elapsed * 1000:7.1f} мс")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,23 @@
+# backend/blobs.py
+import hashlib, zlib
+
+# Кодеки блобов по имени (PayloadBlob.codec). Новый формат сжатия — новое имя,
+# прежние остаются для чтения уже записанного.
+CODECS = {
+    "zlib": (lambda: zlib.compressobj(9), lambda: zlib.decompressobj()),
+}
+DEFAULT_CODEC = "zlib"
+
+def content_hash(payload: str) -> str:
+    """Адрес блоба — sha256 несжатого payload: одинаковые версии хранятся один раз."""
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def compress(payload: str, codec: str = DEFAULT_CODEC) -> bytes:
+    c = CODECS[codec][0]()
+    return c.compress(payload.encode('utf-8')) + c.flush()
+
+def decompress(data: bytes, codec: str) -> str:
+    if codec not in CODECS:
+        raise LookupError(f"неизвестный кодек блоба: {codec}")
+    d = CODECS[codec][1]()
+    return (d.decompress(data) + d.flush()).decode('utf-8')
@@ -0,0 +1,240 @@
+# backend/cache.py
+import asyncio, threading, time
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, defaultdict
+from datetime import date
+from typing import Optional
+import messages
+from settings import VERSION_CACHE_SIZE, LATEST_CACHE_TTL
+
+class CachedVersion:
+    """
+    Разобранная версия: метаданные, занятия, индекс по датам и тексты дней для бота.
+    Тексты нужны только последней версии: её render() строит их заранее (при
+    сохранении или загрузке), у версий из истории — при первом обращении, если оно будет.
+    """
+    __slots__ = ("version", "lessons", "by_date", "dates", "_day_texts", "_dates_text", "loaded_at")
+
+    def __init__(self, version, lessons):
+        self.version = version
+        self.lessons = tuple(lessons)
+        by_date = defaultdict(list)
+        for l in self.lessons:
+            if l.date:
+                by_date[l.date].append(l)
+        for items in by_date.values():
+            items.sort(key=lambda l: l.pair or 0)
+        self.by_date = dict(by_date)
+        self.dates = sorted(by_date)
+        self._day_texts = None
+        self._dates_text = None
+        self.loaded_at = time.monotonic()
+
+    def render(self) -> "CachedVersion":
+        if self._day_texts is None:
+            # Гонка двух потоков безвредна: оба построят одинаковые тексты
+            self._dates_text = ", ".join(d.strftime('%d.%m.%Y') for d in self.dates)
+            self._day_texts = {d: messages.render_lessons(items) for d, items in self.by_date.items()}
+        return self
+
+    @property
+    def day_texts(self) -> dict:
+        return self.render()._day_texts
+
+    @property
+    def dates_text(self) -> str:
+        return self.render()._dates_text
+
+    @property
+    def id(self) -> int:
+        return self.version.id
+
+    def on_date(self, day: date) -> list:
+        return self.by_date.get(day, [])
+
+    def days(self, start: date = date.min, end: date = date.max) -> list:
+        """Дни с занятиями в [start, end] по порядку."""
+        lo, hi = bisect_left(self.dates, start), bisect_right(self.dates, end)
+        return self.dates[lo:hi]
+
+    def in_range(self, start: date, end: date) -> list:
+        return [l for d in self.days(start, end) for l in self.by_date[d]]
+
+class DayView:
+    """
+    Последняя версия, пока её нет в памяти: все даты и занятия только запрошенного
+    дня, выбранные из LessonRow. Для messages — те же поля, что у CachedVersion.
+    """
+    __slots__ = ("dates", "day_texts", "dates_text")
+
+    def __init__(self, dates: list, by_date: dict):
+        self.dates = dates
+        self.dates_text = ", ".join(d.strftime('%d.%m.%Y') for d in dates)
+        self.day_texts = {d: messages.render_lessons(items) for d, items in by_date.items()}
+
+# Последняя версия каждой группы и LRU прочих версий по id.
+# Записи общие для всех читателей — не изменять.
+_lock = threading.Lock()
+_latest: dict[str, CachedVersion] = {}
+_generation: dict[str, int] = defaultdict(int)
+_history: "OrderedDict[int, CachedVersion]" = OrderedDict()
+# Группы, чья последняя версия сейчас догружается в фоне (day_async)
+_warming: set = set()
+# Меняются только под _lock: читают кэш и поток обхода, и пул API
+CACHE_STATS = {"hits": 0, "misses": 0, "invalidations": 0, "evictions": 0}
+
+def _load_latest(group_code: str) -> Optional[CachedVersion]:
+    from db import list_versions, version_lessons
+    items = list_versions(group_code, 1)
+    return CachedVersion(items[0], version_lessons(items[0])).render() if items else None
+
+def _remember(entry: CachedVersion):
+    # под _lock
+    _history[entry.id] = entry
+    _history.move_to_end(entry.id)
+    while len(_history) > VERSION_CACHE_SIZE:
+        _history.popitem(last=False)
+        CACHE_STATS["evictions"] += 1
+
+def _fresh(entry: Optional[CachedVersion]) -> bool:
+    return entry is not None and (LATEST_CACHE_TTL <= 0 or time.monotonic() - entry.loaded_at < LATEST_CACHE_TTL)
+
+def _count(name: str):
+    with _lock:
+        CACHE_STATS[name] += 1
+
+def latest(group_code: str) -> Optional[CachedVersion]:
+    """
+    Последняя версия группы из памяти. Раз в LATEST_CACHE_TTL секунд сверяемся с БД
+    одним запросом — на случай записи другим процессом.
+    """
+    with _lock:
+        entry = _latest.get(group_code)
+        gen = _generation[group_code]
+        if _fresh(entry):
+            CACHE_STATS["hits"] += 1
+            return entry
+    if entry is not None:
+        from db import list_versions
+        items = list_versions(group_code, 1)
+        if items and items[0].id == entry.id:
+            entry.loaded_at = time.monotonic()
+            _count("hits")
+            return entry
+    _count("misses")
+    entry = _load_latest(group_code)
+    with _lock:
+        # Пока грузили, могла сохраниться новая версия — тогда не кэшируем устаревшую
+        if entry is not None and _generation[group_code] == gen:
+            _latest[group_code] = entry
+            _remember(entry)
+    return entry
+
+async def latest_async(group_code: str) -> Optional[CachedVersion]:
+    """Для обработчиков бота: попадание — без ожиданий, промах грузится в потоке."""
+    with _lock:
+        entry = _latest.get(group_code)
+        if _fresh(entry):
+            CACHE_STATS["hits"] += 1
+            return entry
+    return await asyncio.to_thread(latest, group_code)
+
+async def day_async(group_code: str, day: date, nearest: bool = False):
+    """
+    Для /date и /schedule: запись из памяти, если она есть. Холодный кэш (после
+    перезапуска) не ждёт разбора всей версии — даты и нужный день (nearest: или
+    ближайший следующий) берутся индексной выборкой из LessonRow, а версия
+    догружается в кэш в фоне. None — версий у группы нет.
+    """
+    with _lock:
+        entry = _latest.get(group_code)
+        if _fresh(entry):
+            CACHE_STATS["hits"] += 1
+            return entry
+    if entry is not None:
+        # Устаревшая по TTL запись сверяется с БД одним запросом
+        return await asyncio.to_thread(latest, group_code)
+    from db import lesson_dates_async, lessons_on_date_async
+    dates = await lesson_dates_async(group_code)
+    if not dates:
+        return None
+    _warm(group_code)
+    i = bisect_left(dates, day)
+    pick = dates[i] if i < len(dates) and (nearest or dates[i] == day) else None
+    return DayView(dates, {pick: await lessons_on_date_async(group_code, pick)} if pick else {})
+
+def _warm(group_code: str):
+    with _lock:
+        if group_code in _warming:
+            return
+        _warming.add(group_code)
+
+    def load():
+        try:
+            latest(group_code)
+        except Exception as e:
+            print(f"⚠️ Кэш {group_code}: не удалось загрузить последнюю версию: {e}")
+        finally:
+            with _lock:
+                _warming.discard(group_code)
+    asyncio.get_running_loop().run_in_executor(None, load)
+
+def peek(version_id: int) -> Optional[CachedVersion]:
+    """Версия по id, только если она уже в памяти; в БД не ходит."""
+    with _lock:
+        entry = _history.get(version_id)
+        if entry is not None:
+            _history.move_to_end(version_id)
+            CACHE_STATS["hits"] += 1
+        return entry
+
+def version(version_id: int) -> Optional[CachedVersion]:
+    """Любая версия по id: сначала из LRU, иначе из БД."""
+    entry = peek(version_id)
+    if entry is not None:
+        return entry
+    _count("misses")
+    from db import get_version, version_lessons
+    ver = get_version(version_id)
+    if ver is None:
+        return None
+    entry = CachedVersion(ver, version_lessons(ver))
+    with _lock:
+        _remember(entry)
+    return entry
+
+def invalidate(group_code: str):
+    """У группы появилась новая версия: запись сбрасывается, следующее чтение загрузит её."""
+    with _lock:
+        _generation[group_code] += 1
+        if _latest.pop(group_code, None) is not None:
+            CACHE_STATS["invalidations"] += 1
+
+def store(group_code: str, ver, lessons) -> CachedVersion:
+    """
+    Вызывается из save_version: сбрасывает прежнюю запись и сразу кладёт новую
+    версию — тексты дней рендерятся здесь, в потоке обхода, а не в обработчике бота.
+    """
+    entry = CachedVersion(ver, lessons).render()
+    with _lock:
+        _generation[group_code] += 1
+        current = _latest.get(group_code)
+        if current is not None:
+            CACHE_STATS["invalidations"] += 1
+        # Параллельное сохранение более новой версии не затираем
+        if current is None or current.id < entry.id:
+            _latest[group_code] = entry
+        _remember(entry)
+    return entry
+
+def clear():
+    with _lock:
+        for code in list(_latest):
+            _generation[code] += 1
+        _latest.clear()
+        _history.clear()
+
+def stats() -> dict:
+    total = CACHE_STATS["hits"] + CACHE_STATS["misses"]
+    return {**CACHE_STATS, "groups": len(_latest), "versions": len(_history),
+            "hit_ratio": round(CACHE_STATS["hits"] / total, 3) if total else None}
@@ -1,21 +1,150 @@
 # backend/db.py
 from sqlmodel import SQLModel, Field, create_engine, Session, select
-from datetime import datetime
+from sqlalchemy import Index, LargeBinary, Column, func, delete, insert, update, event, inspect, text, or_
+from sqlalchemy.dialects import sqlite, postgresql
+from datetime import datetime, date, timedelta
 from typing import Optional, List
-import json, os
+import json, os, asyncio
+import blobs, cache
+from lessons import Lesson, dump_payload, load_payload, dump_delta, apply_delta
+from settings import (SQLITE_TUNED, SQLITE_CACHE_MB, SQLITE_MMAP_MB, SQLITE_BUSY_TIMEOUT_MS,
+                      DB_POOL_SIZE, DB_MAX_OVERFLOW, PAYLOAD_STORAGE, DELTA_SNAPSHOT_EVERY)
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./data/schedule.db")
-engine = create_engine(DATABASE_URL, echo=False)
+
+# Выполняются на каждом новом соединении SQLite
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",        # читатели не ждут писателя и наоборот
+    "PRAGMA synchronous=NORMAL",      # в WAL fsync только на checkpoint, целостность сохраняется
+    f"PRAGMA cache_size=-{SQLITE_CACHE_MB * 1024}",   # отрицательное значение — в KiB
+    f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}",
+    f"PRAGMA mmap_size={SQLITE_MMAP_MB * 1024 * 1024}",
+)
+
+def _sqlite_pragmas(dbapi_conn, _record):
+    cur = dbapi_conn.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cur.execute(pragma)
+    cur.close()
+
+def _is_memory(url: str) -> bool:
+    return ":memory:" in url or url.split("?")[0].rstrip("/").endswith(":")
+
+def make_engine(url: str, tuned: bool = SQLITE_TUNED):
+    """Синхронный engine; tuned=False — настройки SQLAlchemy по умолчанию, как было раньше."""
+    if not tuned:
+        return create_engine(url, echo=False)
+    kwargs = {} if _is_memory(url) else {"pool_size": DB_POOL_SIZE, "max_overflow": DB_MAX_OVERFLOW}
+    if not url.startswith("sqlite"):
+        return create_engine(url, echo=False, pool_pre_ping=True, **kwargs)
+    eng = create_engine(url, echo=False, **kwargs,
+                        connect_args={"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000})
+    event.listen(eng, "connect", _sqlite_pragmas)
+    return eng
+
+engine = make_engine(DATABASE_URL)
+
+# Асинхронный engine для обработчиков бота: sqlite -> sqlite+aiosqlite
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or (
+    "sqlite+aiosqlite:" + DATABASE_URL[len("sqlite:"):] if DATABASE_URL.startswith("sqlite:") else "")
+_async_engine = None
+
+def get_async_engine():
+    """Создаётся при первом обращении; None — драйвер не установлен (вызовы уходят в поток)."""
+    global _async_engine
+    if _async_engine is None and ASYNC_DATABASE_URL:
+        try:
+            from sqlalchemy.ext.asyncio import create_async_engine
+            from sqlalchemy.pool import AsyncAdaptedQueuePool
+            kwargs = {} if _is_memory(ASYNC_DATABASE_URL) else {
+                "poolclass": AsyncAdaptedQueuePool, "pool_size": DB_POOL_SIZE, "max_overflow": DB_MAX_OVERFLOW}
+            _async_engine = create_async_engine(ASYNC_DATABASE_URL, echo=False, **kwargs)
+        except ImportError as e:
+            print(f"⚠️ Асинхронный доступ к БД недоступен ({e}), запросы идут через пул потоков")
+            return None
+        if SQLITE_TUNED and ASYNC_DATABASE_URL.startswith("sqlite"):
+            event.listen(_async_engine.sync_engine, "connect", _sqlite_pragmas)
+    return _async_engine
+
+async def dispose_async_engine():
+    global _async_engine
+    if _async_engine is not None:
+        await _async_engine.dispose()
+        _async_engine = None
+
+# Версия, чей payload ещё лежит прямо в строке, а не в блобе
+INLINE_PAYLOAD = "blob_hash IS NULL AND payload != ''"
 
 class ScheduleVersion(SQLModel, table=True):
+    __table_args__ = (
+        # last_version: группа + неделя, самая свежая
+        Index("ix_scheduleversion_group_week_created", "group_code", "week_start", "created_at"),
+        # последняя версия группы по времени создания
+        Index("ix_scheduleversion_group_created", "group_code", "created_at"),
+        # list_versions: постраничная история группы по id (keyset, от новых к старым)
+        Index("ix_scheduleversion_group_id", "group_code", "id"),
+        # Частичный: только версии с payload в строке — проверка при старте, есть ли что
+        # переносить в блобы, не читает всю таблицу
+        Index("ix_scheduleversion_inline", "id", sqlite_where=text(INLINE_PAYLOAD),
+              postgresql_where=text(INLINE_PAYLOAD)),
+    )
     id: Optional[int] = Field(default=None, primary_key=True)
     group_code: str
     week_start: str                   # ISO monday (yyyy-mm-dd)
     hash: str                         # хэш нормализованных пар
-    payload: str                      # JSON нормализованных данных
+    payload: str = ""                 # JSON нормализованных данных (lessons.py: v1 или v2); пусто, если в блобе
+    blob_hash: Optional[str] = None   # PayloadBlob.hash — payload хранится сжатым отдельно
+    parent_id: Optional[int] = None   # режим delta: в блобе дельта к этой версии, а не полный payload
+    changes: Optional[str] = None     # JSON набора изменений к предыдущей версии недели (diff.diff_lessons)
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
+class PayloadBlob(SQLModel, table=True):
+    """Сжатый payload версии; адрес — sha256 несжатого JSON, общий для одинаковых версий."""
+    hash: str = Field(primary_key=True)
+    codec: str                        # blobs.CODECS
+    data: bytes = Field(sa_column=Column(LargeBinary, nullable=False))
+    size: int                         # длина несжатого payload, байт
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class LessonRow(SQLModel, table=True):
+    """
+    Занятие версии отдельной строкой — для выборок по дате без разбора payload.
+    save_version пишет строки каждой версии в той же транзакции.
+    """
+    __table_args__ = (Index("ix_lessonrow_group_date_pair", "group_code", "date", "pair"),)
+    id: Optional[int] = Field(default=None, primary_key=True)
+    version_id: int = Field(foreign_key="scheduleversion.id", index=True)
+    group_code: str
+    date: Optional[str] = None        # ISO yyyy-mm-dd; None — запись без даты
+    weekday: str = ""
+    week_no: Optional[int] = None
+    pair: Optional[int] = None
+    start: str = ""
+    end: str = ""
+    subject: str = ""
+    kind: str = ""
+    room: str = ""
+    teacher: str = ""
+
+    @staticmethod
+    def values(version_id: int, group_code: str, l: Lesson) -> dict:
+        return dict(version_id=version_id, group_code=group_code,
+                    date=l.date.isoformat() if l.date else None, weekday=l.weekday,
+                    week_no=l.week_no, pair=l.pair, start=l.start, end=l.end,
+                    subject=l.subject, kind=l.kind, room=l.room, teacher=l.teacher)
+
+    @classmethod
+    def from_lesson(cls, version_id: int, group_code: str, l: Lesson) -> "LessonRow":
+        return cls(**cls.values(version_id, group_code, l))
+
+    def to_lesson(self) -> Lesson:
+        return Lesson(date.fromisoformat(self.date) if self.date else None, self.weekday,
+                      self.week_no, self.pair, self.start, self.end, self.subject,
+                      self.kind, self.room, self.teacher)
+
 class UserDailyUsage(SQLModel, table=True):
+    # Один счётчик на пользователя в чате за день
+    __table_args__ = (Index("ux_userdailyusage_chat_user_date", "chat_id", "user_id", "date_ymd", unique=True),)
     id: Optional[int] = Field(default=None, primary_key=True)
     chat_id: int
     user_id: int
@@ -23,29 +152,342 @@ class UserDailyUsage(SQLModel, table=True):
     count: int = Field(default=0)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
+class PageState(SQLModel, table=True):
+    # Ключ — группа и адрес: у групп может быть общая страница, но своя история версий
+    group_code: str = Field(primary_key=True)
+    url: str = Field(primary_key=True)
+    etag: Optional[str] = None            # ETag последнего ответа 200
+    last_modified: Optional[str] = None   # Last-Modified последнего ответа 200
+    raw_hash: Optional[str] = None        # sha256 сырого тела страницы
+    week_start: Optional[str] = None      # неделя, для которой сохранено состояние
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+class ScrapeJob(SQLModel, table=True):
+    """
+    Общая для реплик очередь опроса (SCRAPE_LEASES=1): строка на группу. Проверяет группу
+    тот, кто взял аренду (owner до lease_until); истёкшую аренду забирает любой другой.
+    """
+    __table_args__ = (Index("ix_scrapejob_due", "next_due_at"),)
+    group_code: str = Field(primary_key=True)
+    url: str = ""
+    next_due_at: datetime             # UTC, когда группе пора на проверку
+    interval_min: float = 0           # последний интервал опроса (polling.interval_for)
+    owner: Optional[str] = None       # id реплики, держащей аренду
+    lease_until: Optional[datetime] = None
+    heartbeat_at: Optional[datetime] = None
+    last_run_at: Optional[datetime] = None
+    runs: int = 0
+
 def init_db():
     SQLModel.metadata.create_all(engine)
+    migrate_page_state()
+    migrate_columns()
+    migrate_indexes()
+    backfill_lesson_rows()
+    if PAYLOAD_STORAGE != "inline":
+        migrate_payloads_to_blobs()
+
+def migrate_columns():
+    """
+    create_all не добавляет колонки в существующие таблицы. Новые колонки моделей
+    допускают NULL, поэтому хватает ALTER TABLE ... ADD COLUMN.
+    """
+    insp = inspect(engine)
+    with engine.begin() as conn:
+        for table in SQLModel.metadata.sorted_tables:
+            existing = {c["name"] for c in insp.get_columns(table.name)}
+            for col in table.columns:
+                if col.name not in existing:
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {col.name} '
+                                      f'{col.type.compile(engine.dialect)}'))
+                    print(f"🔄 {table.name}: добавлена колонка {col.name}")
+
+def migrate_page_state():
+    """
+    Старая PageState с ключом только по url: первичный ключ через ALTER TABLE не поменять,
+    а в таблице лишь валидаторы условного GET — пересоздаём её, страницы один раз скачаются целиком.
+    """
+    columns = {c["name"] for c in inspect(engine).get_columns(PageState.__tablename__)}
+    if "group_code" in columns:
+        return
+    PageState.__table__.drop(engine)
+    PageState.__table__.create(engine)
+    print("🔄 pagestate: ключ (group_code, url), состояние страниц сброшено")
+
+def migrate_indexes():
+    """
+    create_all не добавляет индексы в уже существующие таблицы — доводим старые
+    файлы БД до схемы. Перед уникальным индексом сливаем задвоенные счётчики.
+    """
+    merge_duplicate_usage()
+    for table in (ScheduleVersion.__table__, UserDailyUsage.__table__, LessonRow.__table__,
+                  ScrapeJob.__table__):
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+
+def merge_duplicate_usage():
+    key = (UserDailyUsage.chat_id, UserDailyUsage.user_id, UserDailyUsage.date_ymd)
+    with Session(engine) as s:
+        dups = s.exec(select(*key, func.min(UserDailyUsage.id), func.sum(UserDailyUsage.count))
+                      .group_by(*key).having(func.count() > 1)).all()
+        for chat_id, user_id, date_ymd, keep_id, total in dups:
+            keep = s.get(UserDailyUsage, keep_id)
+            keep.count = total
+            s.add(keep)
+            s.exec(delete(UserDailyUsage).where(
+                (UserDailyUsage.chat_id == chat_id) &
+                (UserDailyUsage.user_id == user_id) &
+                (UserDailyUsage.date_ymd == date_ymd) &
+                (UserDailyUsage.id != keep_id)
+            ))
+        if dups:
+            print(f"🔄 Слиты задвоенные счётчики лимита: {len(dups)}")
+        s.commit()
+
+def backfill_lesson_rows(batch: int = 200):
+    """
+    Версии без строк LessonRow (сохранённые до появления таблицы) раскладываем по
+    строкам. Проверка — по индексу version_id; версии без занятий просто пропускаются.
+    """
+    has_rows = select(LessonRow.id).where(LessonRow.version_id == ScheduleVersion.id).exists()
+    last_id, written = 0, 0
+    while True:
+        with Session(engine) as s:
+            vers = s.exec(select(ScheduleVersion).where((ScheduleVersion.id > last_id) & ~has_rows)
+                          .order_by(ScheduleVersion.id).limit(batch)).all()
+            rows = [LessonRow.values(v.id, v.group_code, l) for v in vers for l in version_lessons(v)]
+            if rows:
+                s.connection().execute(insert(LessonRow.__table__), rows)
+            s.commit()
+        written += len(rows)
+        if len(vers) < batch:
+            break
+        last_id = vers[-1].id
+    if written:
+        print(f"🔄 Версии разложены по строкам LessonRow: {written} занятий")
+
+def migrate_payloads_to_blobs(batch: int = 500):
+    """
+    Переносит payload, записанные прямо в ScheduleVersion, в блобы. Вызывается на
+    каждом старте; когда переносить нечего (обычный случай) — одна выборка по
+    частичному индексу ix_scheduleversion_inline, без VACUUM.
+    """
+    pending = select(ScheduleVersion).where(text(INLINE_PAYLOAD))
+    with Session(engine) as s:
+        if s.exec(pending.limit(1)).first() is None:
+            return
+    moved = 0
+    while True:
+        with Session(engine) as s:
+            rows = s.exec(pending.limit(batch)).all()
+            for ver in rows:
+                # v1 перекладываем в v2: одинаковые версии получают один адрес
+                ver.blob_hash = _store_blob(s, dump_payload(load_payload(ver.payload)))
+                ver.payload = ""
+                s.add(ver)
+            s.commit()
+        moved += len(rows)
+        if len(rows) < batch:
+            break
+    if moved:
+        print(f"🔄 Payload {moved} версий перенесены в сжатые блобы")
+        if engine.dialect.name == "sqlite":
+            # Освобождённые страницы возвращаем файлу
+            with engine.connect() as conn:
+                conn.execution_options(isolation_level="AUTOCOMMIT").execute(text("VACUUM"))
+
+def _store_blob(s: Session, payload: str) -> str:
+    """Кладёт payload в блоб, если такого ещё нет; возвращает адрес."""
+    h = blobs.content_hash(payload)
+    if s.get(PayloadBlob, h) is not None:
+        return h
+    values = dict(hash=h, codec=blobs.DEFAULT_CODEC, data=blobs.compress(payload),
+                  size=len(payload.encode('utf-8')), created_at=datetime.utcnow())
+    make_insert = _UPSERT_INSERT.get(engine.dialect.name)
+    if make_insert is not None:
+        # Тот же payload мог записать параллельный обход
+        s.exec(make_insert(PayloadBlob.__table__).values(**values).on_conflict_do_nothing(index_elements=["hash"]))
+    else:
+        s.add(PayloadBlob(**values)); s.flush()
+    return h
+
+def _blob_text(blob_hash: str) -> str:
+    with Session(engine) as s:
+        blob = s.get(PayloadBlob, blob_hash)
+    if blob is None:
+        raise LookupError(f"payload {blob_hash} не найден")
+    return blobs.decompress(blob.data, blob.codec)
+
+def _delta_lessons(ver: ScheduleVersion) -> List[Lesson]:
+    # Родитель — из LRU версий cache.py (при промахе грузится тем же путём), так что
+    # соседние версии цепочки восстанавливаются по одной дельте
+    parent = cache.version(ver.parent_id)
+    if parent is None:
+        raise LookupError(f"родительская версия {ver.parent_id} для {ver.id} не найдена")
+    return apply_delta(list(parent.lessons), _blob_text(ver.blob_hash))
+
+def _store_delta(s: Session, group_code: str, data: List[Lesson], payload: str) -> tuple:
+    """
+    Режим delta: (адрес блоба, parent_id, длина цепочки). Полная копия — для первой
+    версии группы, для каждой DELTA_SNAPSHOT_EVERY-й, для уже известного payload
+    (откат правки) и когда дельта выходит не сильно меньше самого payload.
+    """
+    prev = s.exec(select(ScheduleVersion).where(ScheduleVersion.group_code == group_code)
+                  .order_by(ScheduleVersion.created_at.desc()).limit(1)).first()
+    if prev is None or s.get(PayloadBlob, blobs.content_hash(payload)) is not None:
+        return _store_blob(s, payload), None, 0
+    head = _delta_heads.get(group_code)
+    if head is not None and head[0] == prev.id:
+        _, depth, parent = head
+    else:
+        depth, ver = 0, prev
+        while ver.parent_id is not None:
+            depth += 1
+            ver = s.get(ScheduleVersion, ver.parent_id)
+        parent = version_lessons(prev)
+    if depth + 1 >= DELTA_SNAPSHOT_EVERY:
+        return _store_blob(s, payload), None, 0
+    delta = dump_delta(parent, data)
+    if len(delta) * 2 >= len(payload):
+        return _store_blob(s, payload), None, 0
+    return _store_blob(s, delta), prev.id, depth + 1
+
+# Режим delta: последняя сохранённая версия группы — (id, длина цепочки, занятия),
+# чтобы следующая дельта не восстанавливала родителя из БД
+_delta_heads: dict[str, tuple] = {}
+
+def save_version(group_code: str, week_start: str, hash_: str, data: List[Lesson],
+                 changes: Optional[dict] = None):
+    with Session(engine) as s:
+        payload = dump_payload(data)
+        if PAYLOAD_STORAGE == "inline":
+            ver = ScheduleVersion(group_code=group_code, week_start=week_start, hash=hash_, payload=payload)
+        elif PAYLOAD_STORAGE == "delta":
+            blob_hash, parent_id, depth = _store_delta(s, group_code, data, payload)
+            ver = ScheduleVersion(group_code=group_code, week_start=week_start, hash=hash_,
+                                  blob_hash=blob_hash, parent_id=parent_id)
+        else:
+            ver = ScheduleVersion(group_code=group_code, week_start=week_start, hash=hash_,
+                                  blob_hash=_store_blob(s, payload))
+        if changes is not None:
+            ver.changes = json.dumps(changes, ensure_ascii=False, separators=(",", ":"))
+        s.add(ver); s.flush()
+        # Строки занятий версии — в той же транзакции, что и она сама
+        if data:
+            # Пакетная вставка без ORM-объектов: одна executemany на всю версию
+            s.connection().execute(insert(LessonRow.__table__),
+                                   [LessonRow.values(ver.id, group_code, l) for l in data])
+        s.commit(); s.refresh(ver)
+        if PAYLOAD_STORAGE == "delta":
+            _delta_heads[group_code] = (ver.id, depth, list(data))
+    cache.store(group_code, ver, data)
+    return ver
 
-def save_version(group_code: str, week_start: str, hash_: str, data: List[dict]):
+def version_lessons(ver: ScheduleVersion) -> List[Lesson]:
+    """
+    Занятия версии; старые версии (payload v1) читаются так же. Разобранные версии
+    держит cache.py — здесь только распаковка. Дельты восстанавливаются от ближайшей
+    полной копии; занятия родителя общие с записью кэша — не изменять.
+    """
+    if ver.parent_id is not None:
+        return _delta_lessons(ver)
+    if ver.blob_hash:
+        return load_payload(_blob_text(ver.blob_hash))
+    return load_payload(ver.payload)
+
+def version_changes(ver: ScheduleVersion) -> Optional[dict]:
+    """Что изменилось по сравнению с предыдущей версией недели; None — сравнивать было не с чем."""
+    return json.loads(ver.changes) if ver.changes else None
+
+def get_version(version_id: int) -> Optional[ScheduleVersion]:
     with Session(engine) as s:
-        ver = ScheduleVersion(group_code=group_code, week_start=week_start,
-                              hash=hash_, payload=json.dumps(data, ensure_ascii=False))
-        s.add(ver); s.commit(); s.refresh(ver)
-        return ver
+        return s.get(ScheduleVersion, version_id)
+
+def version_lessons_by_id(version_id: int) -> Optional[List[Lesson]]:
+    """Занятия любой версии по id (в любом режиме хранения); None — версии нет."""
+    ver = get_version(version_id)
+    return version_lessons(ver) if ver is not None else None
 
 def last_version(group_code: str, week_start: str) -> Optional[ScheduleVersion]:
     with Session(engine) as s:
         stmt = select(ScheduleVersion).where(
             (ScheduleVersion.group_code == group_code) &
             (ScheduleVersion.week_start == week_start)
-        ).order_by(ScheduleVersion.created_at.desc())
+        ).order_by(ScheduleVersion.created_at.desc()).limit(1)
         return s.exec(stmt).first()
 
-def list_versions(group_code: str, limit:int=10):
+def _list_versions_stmt(group_code: str, limit: int, before: Optional[int] = None):
+    # id растёт вместе с created_at; курсор по id — одна выборка по индексу на страницу,
+    # сколько бы версий ни было до неё
+    stmt = select(ScheduleVersion).where(ScheduleVersion.group_code==group_code)
+    if before is not None:
+        stmt = stmt.where(ScheduleVersion.id < before)
+    return stmt.order_by(ScheduleVersion.id.desc()).limit(limit)
+
+def list_versions(group_code: str, limit:int=10, before: Optional[int] = None):
+    """Версии группы от новых к старым; before — id, с которого продолжить (не включая)."""
+    with Session(engine) as s:
+        return list(s.exec(_list_versions_stmt(group_code, limit, before)))
+
+def latest_version_id(group_code: str) -> Optional[int]:
+    """id последней версии группы одним поиском по индексу (group_code, id); None — версий нет."""
     with Session(engine) as s:
-        stmt = select(ScheduleVersion).where(ScheduleVersion.group_code==group_code)\
-            .order_by(ScheduleVersion.created_at.desc()).limit(limit)
-        return list(s.exec(stmt))
+        return s.exec(select(func.max(ScheduleVersion.id)).where(ScheduleVersion.group_code == group_code)).one()
+
+# ===== Выборки занятий по дате =====
+def _latest_version_id(group_code: str):
+    return select(ScheduleVersion.id).where(ScheduleVersion.group_code == group_code)\
+        .order_by(ScheduleVersion.created_at.desc()).limit(1).scalar_subquery()
+
+def _lessons_stmt(group_code: str, start: date, end: date, version_id: Optional[int]):
+    vid = _latest_version_id(group_code) if version_id is None else version_id
+    return select(LessonRow).where(
+        (LessonRow.group_code == group_code) &
+        (LessonRow.date >= start.isoformat()) &
+        (LessonRow.date <= end.isoformat()) &
+        (LessonRow.version_id == vid)
+    ).order_by(LessonRow.date, LessonRow.pair)
+
+def _dates_stmt(group_code: str, version_id: Optional[int]):
+    vid = _latest_version_id(group_code) if version_id is None else version_id
+    return select(LessonRow.date).where(
+        (LessonRow.group_code == group_code) &
+        (LessonRow.version_id == vid) &
+        (LessonRow.date.is_not(None))
+    ).distinct().order_by(LessonRow.date)
+
+def lessons_in_range(group_code: str, start: date, end: date,
+                     version_id: Optional[int] = None) -> List[Lesson]:
+    """
+    Занятия с start по end включительно, по дате и номеру пары. По умолчанию —
+    из последней версии группы, как и раньше показывал бот; version_id — из любой другой.
+    """
+    with Session(engine) as s:
+        return [row.to_lesson() for row in s.exec(_lessons_stmt(group_code, start, end, version_id))]
+
+def lessons_on_date(group_code: str, day: date, version_id: Optional[int] = None) -> List[Lesson]:
+    return lessons_in_range(group_code, day, day, version_id)
+
+def lesson_dates(group_code: str, version_id: Optional[int] = None) -> List[date]:
+    """Даты, на которые в версии есть занятия, по возрастанию."""
+    with Session(engine) as s:
+        return [date.fromisoformat(d) for d in s.exec(_dates_stmt(group_code, version_id))]
+
+# ===== Conditional GET helpers =====
+def get_page_state(group_code: str, url: str) -> Optional[PageState]:
+    with Session(engine) as s:
+        return s.get(PageState, (group_code, url))
+
+def save_page_state(group_code: str, url: str, etag: Optional[str], last_modified: Optional[str],
+                    raw_hash: Optional[str], week_start: str):
+    with Session(engine) as s:
+        rec = s.get(PageState, (group_code, url)) or PageState(group_code=group_code, url=url)
+        rec.etag = etag
+        rec.last_modified = last_modified
+        rec.raw_hash = raw_hash
+        rec.week_start = week_start
+        rec.updated_at = datetime.utcnow()
+        s.add(rec); s.commit()
 
 # ===== Rate Limit helpers =====
 def get_user_daily_count(chat_id: int, user_id: int, date_ymd: str) -> int:
@@ -74,3 +516,152 @@ def increment_user_daily_count(chat_id: int, user_id: int, date_ymd: str) -> int
             s.add(rec)
         s.commit(); s.refresh(rec)
         return rec.count
+
+# Диалекты с INSERT ... ON CONFLICT DO UPDATE ... RETURNING
+_UPSERT_INSERT = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+def consume_user_daily_limit(chat_id: int, user_id: int, date_ymd: str, limit: int) -> Optional[int]:
+    """
+    Атомарно засчитывает запрос, если лимит ещё не исчерпан: один оператор
+    INSERT ... ON CONFLICT DO UPDATE SET count = count + 1 WHERE count < limit RETURNING count.
+    Возвращает новое значение счётчика или None, если лимит уже выбран.
+    """
+    stmt = _limit_stmt(engine.dialect.name, chat_id, user_id, date_ymd, limit)
+    if stmt is None:
+        # Прочие БД — прежний путь в два шага (не атомарный)
+        if get_user_daily_count(chat_id, user_id, date_ymd) >= limit:
+            return None
+        return increment_user_daily_count(chat_id, user_id, date_ymd)
+    with engine.begin() as conn:
+        return conn.execute(stmt).scalar()
+
+def _limit_stmt(dialect: str, chat_id: int, user_id: int, date_ymd: str, limit: int):
+    make_insert = _UPSERT_INSERT.get(dialect)
+    if make_insert is None:
+        return None
+    table = UserDailyUsage.__table__
+    stmt = make_insert(table).values(chat_id=chat_id, user_id=user_id, date_ymd=date_ymd,
+                                     count=1, updated_at=datetime.utcnow())
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.chat_id, table.c.user_id, table.c.date_ymd],
+        set_={"count": table.c.count + 1, "updated_at": stmt.excluded.updated_at},
+        where=table.c.count < limit,
+    ).returning(table.c.count)
+    return stmt
+
+# ===== Очередь опроса с арендой (несколько реплик) =====
+# Все переходы — условные UPDATE: из двух реплик строку меняет только одна
+# (SQLite сериализует записи, PostgreSQL перепроверяет WHERE на заблокированной строке).
+
+def sync_jobs(groups: dict[str, str], first_due: dict[str, datetime]):
+    """Строки для новых групп реестра; у существующих меняется только адрес."""
+    table = ScrapeJob.__table__
+    rows = [{"group_code": code, "url": url, "next_due_at": first_due[code], "interval_min": 0, "runs": 0}
+            for code, url in groups.items()]
+    with engine.begin() as conn:
+        make_insert = _UPSERT_INSERT.get(engine.dialect.name)
+        if make_insert is not None:
+            # Без предварительного чтения: реплики стартуют одновременно, строку соседа пропускаем
+            if rows:
+                conn.execute(make_insert(table).on_conflict_do_nothing(index_elements=[table.c.group_code]), rows)
+        else:
+            known = set(conn.execute(select(table.c.group_code)).scalars())
+            fresh = [r for r in rows if r["group_code"] not in known]
+            if fresh:
+                conn.execute(insert(table), fresh)
+        for code, url in groups.items():
+            conn.execute(update(table).where(table.c.group_code == code, table.c.url != url).values(url=url))
+
+def claim_jobs(worker: str, now: datetime, lease_seconds: float, limit: int) -> dict[str, str]:
+    """
+    Берёт в аренду до limit групп, которым пора и которые свободны (аренды нет или
+    она истекла). Возвращает {код: адрес} — только то, что досталось этой реплике.
+    """
+    table = ScrapeJob.__table__
+    free = or_(table.c.lease_until.is_(None), table.c.lease_until < now)
+    candidates = select(table.c.group_code).where(table.c.next_due_at <= now, free)\
+        .order_by(table.c.next_due_at).limit(limit)
+    # Условие повторяется во внешнем UPDATE: строку, которую успел взять сосед, пропускаем
+    stmt = update(table).where(table.c.group_code.in_(candidates.scalar_subquery()), table.c.next_due_at <= now, free)\
+        .values(owner=worker, lease_until=now + timedelta(seconds=lease_seconds), heartbeat_at=now)
+    with engine.begin() as conn:
+        if engine.dialect.update_returning:
+            return dict(conn.execute(stmt.returning(table.c.group_code, table.c.url)).all())
+        # Без RETURNING (старый SQLite): взятое узнаём по владельцу и метке времени захвата
+        conn.execute(stmt)
+        return dict(conn.execute(select(table.c.group_code, table.c.url)
+                                 .where(table.c.owner == worker, table.c.heartbeat_at == now)).all())
+
+def heartbeat_jobs(worker: str, codes: list, now: datetime, lease_seconds: float) -> int:
+    """Продлевает аренду идущих проверок; возвращает, сколько групп ещё за этой репликой."""
+    table = ScrapeJob.__table__
+    with engine.begin() as conn:
+        return conn.execute(update(table).where(table.c.owner == worker, table.c.group_code.in_(codes))
+                            .values(lease_until=now + timedelta(seconds=lease_seconds), heartbeat_at=now)).rowcount
+
+def complete_job(worker: str, code: str, next_due_at: datetime, interval_min: float, now: datetime) -> bool:
+    """Снимает аренду и назначает следующую проверку. False — аренду уже забрали."""
+    table = ScrapeJob.__table__
+    with engine.begin() as conn:
+        return conn.execute(update(table).where(table.c.group_code == code, table.c.owner == worker)
+                            .values(owner=None, lease_until=None, next_due_at=next_due_at,
+                                    interval_min=interval_min, last_run_at=now,
+                                    runs=table.c.runs + 1)).rowcount == 1
+
+def release_jobs(worker: str) -> int:
+    """Отдаёт аренды реплики (при остановке) — группы сразу может взять другая."""
+    table = ScrapeJob.__table__
+    with engine.begin() as conn:
+        return conn.execute(update(table).where(table.c.owner == worker)
+                            .values(owner=None, lease_until=None)).rowcount
+
+def advance_jobs(due: dict[str, datetime]):
+    """Переносит проверки групп на более ранний срок (позже уже назначенного — не сдвигает)."""
+    table = ScrapeJob.__table__
+    with engine.begin() as conn:
+        for code, at in due.items():
+            conn.execute(update(table).where(table.c.group_code == code, table.c.next_due_at > at)
+                         .values(next_due_at=at))
+
+def list_jobs() -> List[ScrapeJob]:
+    with Session(engine) as s:
+        return list(s.exec(select(ScrapeJob).order_by(ScrapeJob.next_due_at)))
+
+# ===== Асинхронные варианты для обработчиков бота =====
+# Те же запросы через async engine; без драйвера — синхронная версия в пуле потоков.
+
+async def list_versions_async(group_code: str, limit: int = 10, before: Optional[int] = None):
+    eng = get_async_engine()
+    if eng is None:
+        return await asyncio.to_thread(list_versions, group_code, limit, before)
+    from sqlmodel.ext.asyncio.session import AsyncSession
+    async with AsyncSession(eng) as s:
+        return list(await s.exec(_list_versions_stmt(group_code, limit, before)))
+
+async def lessons_in_range_async(group_code: str, start: date, end: date,
+                                 version_id: Optional[int] = None) -> List[Lesson]:
+    eng = get_async_engine()
+    if eng is None:
+        return await asyncio.to_thread(lessons_in_range, group_code, start, end, version_id)
+    from sqlmodel.ext.asyncio.session import AsyncSession
+    async with AsyncSession(eng) as s:
+        return [row.to_lesson() for row in await s.exec(_lessons_stmt(group_code, start, end, version_id))]
+
+async def lessons_on_date_async(group_code: str, day: date, version_id: Optional[int] = None) -> List[Lesson]:
+    return await lessons_in_range_async(group_code, day, day, version_id)
+
+async def lesson_dates_async(group_code: str, version_id: Optional[int] = None) -> List[date]:
+    eng = get_async_engine()
+    if eng is None:
+        return await asyncio.to_thread(lesson_dates, group_code, version_id)
+    from sqlmodel.ext.asyncio.session import AsyncSession
+    async with AsyncSession(eng) as s:
+        return [date.fromisoformat(d) for d in await s.exec(_dates_stmt(group_code, version_id))]
+
+async def consume_user_daily_limit_async(chat_id: int, user_id: int, date_ymd: str, limit: int) -> Optional[int]:
+    eng = get_async_engine()
+    stmt = _limit_stmt(eng.dialect.name, chat_id, user_id, date_ymd, limit) if eng is not None else None
+    if stmt is None:
+        return await asyncio.to_thread(consume_user_daily_limit, chat_id, user_id, date_ymd, limit)
+    async with eng.begin() as conn:
+        return (await conn.execute(stmt)).scalar()
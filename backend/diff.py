@@ -1,15 +1,141 @@
 # backend/diff.py
 from datetime import date
-from db import last_version, save_version
-from scraper import scrape_group, get_monday
+from collections import defaultdict
+from db import last_version, save_version, version_lessons, get_page_state, save_page_state
+from lessons import Lesson
+from scraper import fetch_page, fetch_page_stream, parse_page, get_monday
+from settings import SCRAPE_STREAMING
 from typing import Optional
 
+# Поля, изменение которых при той же паре считается правкой занятия
+CHANGE_FIELDS = ("subject", "kind", "room", "teacher", "start", "end")
+
+def _slot(l: Lesson) -> tuple:
+    return (l.date.isoformat() if l.date else None, l.pair)
+
+def _brief(l: Lesson) -> dict:
+    date_iso, pair = _slot(l)
+    return {"date": date_iso, "pair": pair, "subject": l.subject, "kind": l.kind,
+            "room": l.room, "teacher": l.teacher}
+
+def diff_lessons(old: list, new: list) -> dict:
+    """
+    Сравнивает две версии по ключу (дата, пара) за линейное время. Занятие:
+      changed — на той же паре поменялись аудитория, преподаватель, тип и т. п.;
+      moved   — то же занятие (предмет, тип, преподаватель) ушло на другую пару;
+      added / removed — всё остальное.
+    """
+    old_slots, new_slots = defaultdict(list), defaultdict(list)
+    for l in old:
+        old_slots[_slot(l)].append(l)
+    for l in new:
+        new_slots[_slot(l)].append(l)
+
+    changed, gone, came = [], [], []
+    for slot in old_slots.keys() | new_slots.keys():
+        was, now = old_slots.get(slot, []), new_slots.get(slot, [])
+        # Одинаковые записи (подгруппы бывают на одной паре) снимаем сразу
+        rest = list(now)
+        left = []
+        for l in was:
+            if l in rest:
+                rest.remove(l)
+            else:
+                left.append(l)
+        # Оставшиеся на той же паре — правки по порядку, лишние — удалены/добавлены
+        for a, b in zip(left, rest):
+            fields = {f: [getattr(a, f), getattr(b, f)] for f in CHANGE_FIELDS if getattr(a, f) != getattr(b, f)}
+            changed.append({"date": slot[0], "pair": slot[1], "subject": b.subject, "fields": fields})
+        gone.extend(left[len(rest):])
+        came.extend(rest[len(left):])
+
+    # Переносы: удалённое и добавленное занятие с тем же предметом, типом и преподавателем
+    identity = lambda l: (l.subject, l.kind, l.teacher)
+    pending = defaultdict(list)
+    for l in gone:
+        pending[identity(l)].append(l)
+    moved, added = [], []
+    for l in came:
+        candidates = pending.get(identity(l))
+        if candidates:
+            src = candidates.pop(0)
+            moved.append({"from": {"date": _slot(src)[0], "pair": src.pair},
+                          "to": {"date": _slot(l)[0], "pair": l.pair}, **_brief(l)})
+        else:
+            added.append(_brief(l))
+    removed = [_brief(l) for ls in pending.values() for l in ls]
+
+    order = lambda item: ((item.get("to") or item)["date"] or "", (item.get("to") or item)["pair"] or 0)
+    return {"added": sorted(added, key=order), "removed": sorted(removed, key=order),
+            "moved": sorted(moved, key=order), "changed": sorted(changed, key=order)}
+
+def count_changes(changes: dict) -> int:
+    return sum(len(changes.get(k, ())) for k in ("added", "removed", "moved", "changed"))
+
+FIELD_NAMES = {"subject": "предмет", "kind": "тип", "room": "ауд.", "teacher": "преп.",
+               "start": "начало", "end": "конец"}
+
+def _when(date_iso: Optional[str], pair) -> str:
+    day = f"{date_iso[8:10]}.{date_iso[5:7]}" if date_iso else "без даты"
+    return f"{day} {pair} пара"
+
+def _what(item: dict) -> str:
+    return " ".join(x for x in (item["subject"], item.get("room"), item.get("teacher")) if x)
+
+def format_changes(changes: dict, limit: int = 15) -> str:
+    """Набор изменений построчно для уведомления; после limit строк — «… и ещё N»."""
+    lines = []
+    for item in changes.get("changed", []):
+        fields = "; ".join(f"{FIELD_NAMES.get(f, f)} {a or '—'} → {b or '—'}" for f, (a, b) in item["fields"].items())
+        lines.append(f"✏️ {_when(item['date'], item['pair'])} {item['subject']}: {fields}")
+    for item in changes.get("moved", []):
+        lines.append(f"🔀 {_what(item)}: {_when(item['from']['date'], item['from']['pair'])} → "
+                     f"{_when(item['to']['date'], item['to']['pair'])}")
+    for item in changes.get("added", []):
+        lines.append(f"➕ {_when(item['date'], item['pair'])}: {_what(item)}")
+    for item in changes.get("removed", []):
+        lines.append(f"➖ {_when(item['date'], item['pair'])}: {_what(item)}")
+    if len(lines) > limit:
+        lines = lines[:limit] + [f"… и ещё {len(lines) - limit}"]
+    return "\n".join(lines)
+
+def _same_page(group_code: str, url: str, page: dict, state, fresh: bool, week: str) -> bool:
+    """Тело совпало с прошлым байт-в-байт; заодно обновляем валидаторы, если сервер выдал новые."""
+    if not fresh or page["raw_hash"] != state.raw_hash:
+        return False
+    if (page["etag"], page["last_modified"]) != (state.etag, state.last_modified):
+        save_page_state(group_code, url, page["etag"], page["last_modified"], page["raw_hash"], week)
+    return True
+
 def check_and_store(group_code: str, url: str) -> Optional[dict]:
-    items, h = scrape_group(url)
     week = get_monday(date.today()).isoformat()
+    # Состояние страницы годится только в пределах той же недели:
+    # на новой неделе версию нужно сохранить, даже если страница не менялась
+    state = get_page_state(group_code, url)
+    fresh = state is not None and state.week_start == week
+    fetch = fetch_page_stream if SCRAPE_STREAMING else fetch_page
+    if fresh:
+        page = fetch(url, state.etag, state.last_modified)
+    else:
+        page = fetch(url)
+    # 304 или байт-в-байт та же страница — не разбираем и не лезем в историю версий
+    if page["not_modified"]:
+        return None
+    streaming = "chunks" in page
+    if not streaming and _same_page(group_code, url, page, state, fresh, week):
+        return None
+
+    items, h = parse_page(page)
+    # При потоковой загрузке хэш тела известен только после чтения: разбор уже
+    # сделан, но сравнение с историей версий всё равно пропускаем
+    if streaming and _same_page(group_code, url, page, state, fresh, week):
+        return None
+    diff = None
     prev = last_version(group_code, week)
     if not prev or prev.hash != h:
-        ver = save_version(group_code, week, h, items)
-        diff = {"changed": True, "count": len(items), "week": week}
-        return diff
-    return None
+        # Первой версии недели сравнивать не с чем
+        changes = diff_lessons(version_lessons(prev), items) if prev else None
+        ver = save_version(group_code, week, h, items, changes)
+        diff = {"changed": True, "count": len(items), "week": week, "version_id": ver.id, "changes": changes}
+    save_page_state(group_code, url, page["etag"], page["last_modified"], page["raw_hash"], week)
+    return diff
@@ -0,0 +1,56 @@
+# backend/engine.py
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+import http_client
+import parse_pool
+from diff import check_and_store
+from settings import GROUPS, SCRAPE_CONCURRENCY
+
+# Пул потоков под блокирующие загрузки. Его размер не меньше запрошенной параллельности:
+# обход с большим concurrency, чем уже есть потоков, заменяет пул на больший
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_size = 0
+
+def _get_executor(workers: int) -> ThreadPoolExecutor:
+    # Вызывается из event loop — без блокировки
+    global _executor, _executor_size
+    if _executor is None or _executor_size < workers:
+        old = _executor
+        _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scrape")
+        _executor_size = workers
+        if old is not None:
+            # Начатые загрузки старый пул доделает сам
+            old.shutdown(wait=False)
+    return _executor
+
+async def scrape_all(groups: Optional[dict[str, str]] = None,
+                     concurrency: Optional[int] = None) -> dict[str, object]:
+    """
+    Проверяет страницы всех групп параллельно (не более concurrency одновременно).
+    Возвращает {код группы: diff | None | Exception} — ошибка одной группы
+    не прерывает обход остальных.
+    """
+    groups = GROUPS if groups is None else groups
+    limit = max(1, concurrency or SCRAPE_CONCURRENCY)
+    sem = asyncio.Semaphore(limit)
+    executor = _get_executor(limit)
+    loop = asyncio.get_running_loop()
+
+    async def one(code: str, url: str):
+        async with sem:
+            try:
+                return await loop.run_in_executor(executor, check_and_store, code, url)
+            except Exception as e:
+                return e
+
+    results = await asyncio.gather(*(one(code, url) for code, url in groups.items()))
+    return dict(zip(groups, results))
+
+def shutdown():
+    global _executor, _executor_size
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor, _executor_size = None, 0
+    http_client.close()
+    parse_pool.shutdown()
@@ -0,0 +1,114 @@
+# backend/events.py
+import asyncio, json
+from collections import defaultdict
+from typing import AsyncIterator, Awaitable, Callable, Optional
+from settings import SSE_PING_SECONDS, SSE_QUEUE_SIZE, SSE_MAX_CLIENTS
+
+# Подписчики по группам: у каждого клиента своя короткая очередь готовых кадров.
+# Всё живёт в event loop — ни потоков, ни опроса на клиента.
+_subscribers: dict[str, set[asyncio.Queue]] = defaultdict(set)
+_heartbeat: Optional[asyncio.Task] = None
+# id последнего разосланного события по группам: повтор (та же версия от сканера
+# и от пересылки между репликами) не рассылается дважды
+_last_ids: dict[str, int] = {}
+EVENT_STATS = {"published": 0, "delivered": 0, "dropped": 0}
+
+# Комментарий SSE: держит соединение живым через прокси и выявляет отключившихся
+PING = ": ping\n\n"
+
+def format_event(event: str, data: dict, event_id: Optional[int] = None) -> str:
+    """Кадр text/event-stream; data — одной строкой JSON."""
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{head}event: {event}\ndata: {json.dumps(data, ensure_ascii=False, separators=(',', ':'))}\n\n"
+
+def subscribers(group_code: Optional[str] = None) -> int:
+    if group_code is not None:
+        return len(_subscribers.get(group_code, ()))
+    return sum(len(qs) for qs in _subscribers.values())
+
+def _offer(q: asyncio.Queue, frame: str) -> bool:
+    try:
+        q.put_nowait(frame)
+        return True
+    except asyncio.QueueFull:
+        # Клиент не читает: кадр ему пропускаем, соединение не держит остальных
+        EVENT_STATS["dropped"] += 1
+        return False
+
+def groups() -> list:
+    """Группы, у которых есть подписчики."""
+    return [code for code, qs in _subscribers.items() if qs]
+
+def last_id(group_code: str) -> Optional[int]:
+    return _last_ids.get(group_code)
+
+def seed(group_code: str, event_id: int):
+    """
+    Точка отсчёта для первого подписчика группы — версия, которую он уже видел;
+    всё новее неё ещё не разослано. Если группа уже отслеживается, не меняется.
+    """
+    _last_ids.setdefault(group_code, event_id)
+
+def publish_frame(group_code: str, frame: str, event_id: Optional[int] = None) -> int:
+    """Раздаёт готовый кадр всем подписчикам группы; вызывать из event loop."""
+    if event_id is not None:
+        seen = _last_ids.get(group_code)
+        if seen is not None and event_id <= seen:
+            return 0
+        _last_ids[group_code] = event_id
+    EVENT_STATS["published"] += 1
+    delivered = sum(_offer(q, frame) for q in list(_subscribers.get(group_code, ())))
+    EVENT_STATS["delivered"] += delivered
+    return delivered
+
+def publish(group_code: str, event: str, data: dict, event_id: Optional[int] = None) -> int:
+    # Сериализуем один раз на всех подписчиков
+    return publish_frame(group_code, format_event(event, data, event_id), event_id)
+
+async def _ping_all():
+    # Один таймер на процесс вместо таймера на каждое соединение
+    while any(_subscribers.values()):
+        await asyncio.sleep(SSE_PING_SECONDS)
+        for qs in list(_subscribers.values()):
+            for q in list(qs):
+                _offer(q, PING)
+
+def subscribe(group_code: str) -> asyncio.Queue:
+    global _heartbeat
+    q = asyncio.Queue(maxsize=SSE_QUEUE_SIZE)
+    _subscribers[group_code].add(q)
+    if _heartbeat is None or _heartbeat.done():
+        _heartbeat = asyncio.create_task(_ping_all())
+    return q
+
+def unsubscribe(group_code: str, q: asyncio.Queue):
+    qs = _subscribers.get(group_code)
+    if qs is not None:
+        qs.discard(q)
+        if not qs:
+            del _subscribers[group_code]
+            _last_ids.pop(group_code, None)
+
+def full() -> bool:
+    return subscribers() >= SSE_MAX_CLIENTS
+
+async def stream(group_code: str,
+                 catch_up: Optional[Callable[[], Awaitable[Optional[str]]]] = None) -> AsyncIterator[str]:
+    """
+    Тело ответа SSE. catch_up вызывается уже после подписки (ничего не теряется
+    между ними) и может вернуть кадр, пропущенный клиентом за время обрыва.
+    Отключение клиента видно на ближайшей записи (не позже пинга): сервер
+    отменяет генератор, и подписка снимается в finally.
+    """
+    q = subscribe(group_code)
+    try:
+        first = await catch_up() if catch_up else None
+        # retry — через сколько мс браузер переподключится после обрыва
+        yield f"retry: 5000\n\n{first or ''}"
+        while True:
+            yield await q.get()
+    finally:
+        unsubscribe(group_code, q)
+
+def stats() -> dict:
+    return {**EVENT_STATS, "subscribers": subscribers(), "groups": len(_subscribers)}
@@ -0,0 +1,160 @@
+# backend/http_cache.py
+import gzip, hashlib, json, threading
+from collections import OrderedDict
+from typing import Callable, Optional
+from fastapi import Request
+from fastapi.responses import Response
+from settings import HTTP_BODY_CACHE_SIZE, HTTP_COMPRESS_MIN
+try:
+    import brotli
+except ImportError:
+    # brotli необязателен: без него отдаём gzip
+    brotli = None
+
+# Версия по id не меняется никогда — клиент может не переспрашивать
+IMMUTABLE = "public, max-age=31536000, immutable"
+# Меняющиеся ответы: клиент хранит тело, но каждый раз сверяет ETag (дешёвый 304)
+REVALIDATE = "no-cache"
+
+ENCODERS = {"gzip": lambda body: gzip.compress(body, 6, mtime=0)}
+if brotli is not None:
+    ENCODERS["br"] = lambda body: brotli.compress(body, quality=5)
+# Порядок предпочтения, если клиент принимает несколько кодировок
+PREFERENCE = ("br", "gzip")
+
+# Готовые тела по (etag, кодировка): повторная отдача не сериализует и не сжимает заново.
+# Несжатое хранится вместе со своими заголовками: (тело, заголовки)
+_lock = threading.Lock()
+_bodies: "OrderedDict[tuple[str, str], object]" = OrderedDict()
+# Меняются только под _lock: обработчики API выполняются в пуле потоков
+HTTP_STATS = {"not_modified": 0, "built": 0, "compressed": 0, "body_hits": 0}
+
+def _count(name: str):
+    with _lock:
+        HTTP_STATS[name] += 1
+
+def _dumps(content) -> bytes:
+    # Как JSONResponse, только без пробелов
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def _variant(etag: str, encoding: str) -> str:
+    # У сжатого представления свой сильный ETag: "abc" -> "abc-gzip"
+    return etag if encoding == "identity" else f'{etag[:-1]}-{encoding}"'
+
+def etag_matches(request: Request, etag: str) -> Optional[str]:
+    """
+    If-None-Match: слабое сравнение с любым из представлений (прокси дописывают W/).
+    Возвращает совпавший ETag представления — его и отдаём в 304.
+    """
+    header = request.headers.get("if-none-match")
+    if not header:
+        return None
+    if header.strip() == "*":
+        return etag
+    variants = {_variant(etag, enc) for enc in ("identity", *ENCODERS)}
+    for tag in header.split(","):
+        tag = tag.strip().removeprefix("W/")
+        if tag in variants:
+            return tag
+    return None
+
+def _not_modified(tag: str, cache_control: str) -> Response:
+    _count("not_modified")
+    return Response(status_code=304, headers={"ETag": tag, "Cache-Control": cache_control,
+                                              "Vary": "Accept-Encoding"})
+
+def negotiate(request: Request) -> str:
+    """Лучшая кодировка из Accept-Encoding среди доступных; identity — если ни одной."""
+    accepted = {}
+    for part in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            accepted[name.strip().lower()] = q
+    for enc in PREFERENCE:
+        if enc in ENCODERS and accepted.get(enc, accepted.get("*", 0)) > 0:
+            return enc
+    return "identity"
+
+def _get(key):
+    with _lock:
+        body = _bodies.get(key)
+        if body is not None:
+            _bodies.move_to_end(key)
+        return body
+
+def _put(key, body: bytes):
+    with _lock:
+        _bodies[key] = body
+        while len(_bodies) > HTTP_BODY_CACHE_SIZE:
+            _bodies.popitem(last=False)
+
+class Payload:
+    """Содержимое ответа и зависящие от него заголовки (например, курсор следующей страницы)."""
+    __slots__ = ("content", "headers")
+
+    def __init__(self, content, headers: Optional[dict] = None):
+        self.content = content
+        self.headers = headers or {}
+
+def _headers(etag: str, cache_control: str, encoding: str) -> dict:
+    headers = {"ETag": _variant(etag, encoding), "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return headers
+
+def json_response(request: Request, build: Callable[[], object], etag: Optional[str] = None,
+                  cache_control: str = REVALIDATE) -> Response:
+    """
+    JSON-ответ с ETag и сжатием.
+    etag задан (по id версии) — при совпадении с If-None-Match сразу 304, build не
+    вызывается; тела кэшируются по (etag, кодировка).
+    etag не задан — он считается по телу: экономит трафик, но не работу сервера.
+    build может вернуть Payload, если к телу прилагаются свои заголовки.
+    """
+    matched = etag_matches(request, etag) if etag is not None else None
+    if matched:
+        return _not_modified(matched, cache_control)
+    encoding = negotiate(request)
+    # Тела с ETag по содержимому (статус) не кэшируем — они разовые
+    keep = etag is not None
+    cached = _get((etag, "identity")) if keep else None
+    if cached is not None:
+        body, extra = cached
+        _count("body_hits")
+    else:
+        content = build()
+        extra = content.headers if isinstance(content, Payload) else {}
+        body = _dumps(content.content if isinstance(content, Payload) else content)
+        _count("built")
+        if etag is None:
+            etag = f'"{hashlib.sha1(body).hexdigest()}"'
+            matched = etag_matches(request, etag)
+            if matched:
+                return _not_modified(matched, cache_control)
+        else:
+            _put((etag, "identity"), (body, extra))
+    if len(body) < HTTP_COMPRESS_MIN:
+        encoding = "identity"
+    if encoding != "identity":
+        packed = _get((etag, encoding)) if keep else None
+        if packed is None:
+            packed = ENCODERS[encoding](body)
+            _count("compressed")
+            if keep:
+                _put((etag, encoding), packed)
+        body = packed
+    return Response(body, media_type="application/json",
+                    headers={**extra, **_headers(etag, cache_control, encoding)})
+
+def clear():
+    with _lock:
+        _bodies.clear()
+
+def stats() -> dict:
+    return {**HTTP_STATS, "bodies": len(_bodies), "encodings": ["identity", *ENCODERS]}
@@ -0,0 +1,84 @@
+# backend/http_client.py
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import EmptyPoolError
+from urllib3.util.retry import Retry
+from settings import (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_POOL_PER_HOST, HTTP_POOL_TIMEOUT,
+                      HTTP_RETRIES, HTTP_BACKOFF, HTTP_BACKOFF_JITTER, HTTP_RETRY_AFTER_MAX)
+
+_session: requests.Session | None = None
+_lock = threading.Lock()
+
+class CappedRetry(Retry):
+    """Retry-After сервера учитываем, но не дольше HTTP_RETRY_AFTER_MAX секунд."""
+
+    def parse_retry_after(self, retry_after: str) -> float:
+        return min(super().parse_retry_after(retry_after), HTTP_RETRY_AFTER_MAX)
+
+def _timed_pool(base):
+    # requests не передаёт pool_timeout: без него поток ждёт занятое соединение бесконечно
+    class Pool(base):
+        def urlopen(self, *args, **kwargs):
+            kwargs.setdefault("pool_timeout", HTTP_POOL_TIMEOUT)
+            return super().urlopen(*args, **kwargs)
+    return Pool
+
+class PoolTimeoutAdapter(HTTPAdapter):
+    """HTTPAdapter с ожиданием свободного соединения не дольше HTTP_POOL_TIMEOUT."""
+    POOLS = {"http": _timed_pool(HTTPConnectionPool), "https": _timed_pool(HTTPSConnectionPool)}
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = self.POOLS
+
+    def send(self, request, **kwargs):
+        try:
+            return super().send(request, **kwargs)
+        except EmptyPoolError as e:
+            raise requests.ConnectionError(e, request=request)
+
+def _make_session() -> requests.Session:
+    retry = CappedRetry(
+        total=HTTP_RETRIES,
+        connect=HTTP_RETRIES,
+        read=HTTP_RETRIES,
+        status=HTTP_RETRIES,
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=frozenset({"GET", "HEAD"}),
+        backoff_factor=HTTP_BACKOFF,
+        backoff_jitter=HTTP_BACKOFF_JITTER,
+        respect_retry_after_header=True,
+        # После последней попытки отдаём ответ как есть — raise_for_status решит сам
+        raise_on_status=False,
+    )
+    # pool_block: при занятом пуле ждём соединение (до HTTP_POOL_TIMEOUT), а не открываем
+    # новое сверх лимита
+    adapter = PoolTimeoutAdapter(pool_connections=10, pool_maxsize=HTTP_POOL_PER_HOST,
+                                 pool_block=True, max_retries=retry)
+    s = requests.Session()
+    s.headers["User-Agent"] = "Mozilla/5.0"
+    s.mount("http://", adapter)
+    s.mount("https://", adapter)
+    return s
+
+def get_session() -> requests.Session:
+    """Общая сессия скрапера: keep-alive соединения переживают между загрузками."""
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                _session = _make_session()
+    return _session
+
+def get(url: str, headers: dict | None = None, stream: bool = False) -> requests.Response:
+    return get_session().get(url, headers=headers, stream=stream,
+                             timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+
+def close():
+    global _session
+    with _lock:
+        if _session is not None:
+            _session.close()
+            _session = None
@@ -0,0 +1,156 @@
+# backend/lessons.py
+import re, json
+from datetime import date
+from difflib import SequenceMatcher
+from typing import Optional
+
+# Формат payload в ScheduleVersion:
+#   v1 — список словарей, дата вписана в subject: "29.09.2025 Пн-1 | ОС (Лек)"
+#   v2 — {"v": 2, "fields": [...], "lessons": [[...], ...]} — строки без ключей и без raw
+#   d1 — дельта к родительской версии: {"v": "d1", "n": строк у родителя, "ops": [[i1, i2, [строки]], ...]}
+PAYLOAD_VERSION = 2
+DELTA_VERSION = "d1"
+
+LEGACY_SUBJECT_RE = re.compile(r'^(\d{2})\.(\d{2})\.(\d{4})\s+([А-Яа-я]+)-(\d+)\s*\|\s*(.*)$', re.S)
+
+class Lesson:
+    """Одно занятие: пара в конкретный день."""
+    __slots__ = ("date", "weekday", "week_no", "pair", "start", "end",
+                 "subject", "kind", "room", "teacher")
+
+    def __init__(self, date: Optional[date], weekday: str, week_no: Optional[int],
+                 pair: Optional[int], start: str, end: str, subject: str,
+                 kind: str = "", room: str = "", teacher: str = ""):
+        self.date = date          # None — запись без даты (запасной разбор <li>)
+        self.weekday = weekday    # "Пн"
+        self.week_no = week_no    # номер недели из заголовка дня ("Пн-1" -> 1)
+        self.pair = pair
+        self.start = start        # "08:30"
+        self.end = end            # "10:00"
+        self.subject = subject    # название без даты, аудитории и преподавателя
+        self.kind = kind
+        self.room = room
+        self.teacher = teacher
+
+    @property
+    def time(self) -> str:
+        return f"{self.start}-{self.end}"
+
+    @property
+    def date_ru(self) -> str:
+        return self.date.strftime('%d.%m.%Y') if self.date else ""
+
+    @property
+    def legacy_subject(self) -> str:
+        """subject в формате v1 — с датой в начале."""
+        if self.date is None:
+            return self.subject
+        return f"{self.date_ru} {self.weekday}-{self.week_no} | {self.subject}"
+
+    def key(self) -> tuple:
+        # Ключ дедупликации — те же поля, что и у словарей v1
+        return (self.legacy_subject, self.pair, self.time, self.room, self.kind, self.teacher)
+
+    def to_row(self) -> list:
+        return [self.date.isoformat() if self.date else None, self.weekday, self.week_no,
+                self.pair, self.start, self.end, self.subject, self.kind, self.room, self.teacher]
+
+    @classmethod
+    def from_row(cls, row: list) -> "Lesson":
+        d = row[0]
+        return cls(date.fromisoformat(d) if d else None, *row[1:])
+
+    def to_dict(self) -> dict:
+        """Для JSON API: явные поля плюс time для старых клиентов."""
+        return {
+            "date": self.date.isoformat() if self.date else None,
+            "weekday": self.weekday,
+            "week_no": self.week_no,
+            "pair": self.pair,
+            "start": self.start,
+            "end": self.end,
+            "time": self.time,
+            "subject": self.subject,
+            "kind": self.kind,
+            "room": self.room,
+            "teacher": self.teacher,
+        }
+
+    def to_legacy(self, raw: Optional[list] = None) -> dict:
+        """Словарь в формате v1 (как раньше отдавал normalize_schedule)."""
+        item = {
+            "pair": self.pair,
+            "time": self.time,
+            "subject": self.legacy_subject,
+            "room": self.room,
+            "kind": self.kind,
+            "teacher": self.teacher,
+        }
+        if raw is not None:
+            item["raw"] = raw
+        return item
+
+    @classmethod
+    def from_legacy(cls, item: dict) -> "Lesson":
+        """Разбирает словарь v1: достаёт дату из начала subject."""
+        start, _, end = (item.get("time") or "").partition("-")
+        subject = item.get("subject") or ""
+        d, weekday, week_no = None, "", None
+        m = LEGACY_SUBJECT_RE.match(subject)
+        if m:
+            day, month, year, weekday, week, subject = m.groups()
+            try:
+                d, week_no = date(int(year), int(month), int(day)), int(week)
+            except ValueError:
+                d, weekday, subject = None, "", item.get("subject") or ""
+        return cls(d, weekday, week_no, item.get("pair"), start, end, subject,
+                   item.get("kind") or "", item.get("room") or "", item.get("teacher") or "")
+
+    def __eq__(self, other):
+        if not isinstance(other, Lesson):
+            return NotImplemented
+        return all(getattr(self, f) == getattr(other, f) for f in self.__slots__)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"Lesson({self.date_ru or '-'} {self.pair} {self.subject!r})"
+
+def dump_payload(lessons: list) -> str:
+    """Сериализует занятия в payload v2; словари v1 предварительно конвертируются."""
+    rows = [(l if isinstance(l, Lesson) else Lesson.from_legacy(l)).to_row() for l in lessons]
+    return json.dumps({"v": PAYLOAD_VERSION, "fields": list(Lesson.__slots__), "lessons": rows},
+                      ensure_ascii=False, separators=(",", ":"))
+
+def load_payload(payload: str) -> list[Lesson]:
+    """Читает payload любой версии (v1 — список словарей, v2 — компактные строки)."""
+    data = json.loads(payload)
+    if isinstance(data, dict) and data.get("v") == 2:
+        return [Lesson.from_row(row) for row in data["lessons"]]
+    return [Lesson.from_legacy(item) for item in data]
+
+def dump_delta(parent: list, lessons: list) -> str:
+    """
+    Дельта lessons относительно parent: для каждого изменённого отрезка строк
+    родителя [i1:i2] — строки, которыми его заменить.
+    """
+    a = [json.dumps(l.to_row(), ensure_ascii=False) for l in parent]
+    b = [json.dumps(l.to_row(), ensure_ascii=False) for l in lessons]
+    ops = [[i1, i2, [l.to_row() for l in lessons[j1:j2]]]
+           for tag, i1, i2, j1, j2 in SequenceMatcher(None, a, b, autojunk=False).get_opcodes()
+           if tag != "equal"]
+    return json.dumps({"v": DELTA_VERSION, "n": len(parent), "ops": ops},
+                      ensure_ascii=False, separators=(",", ":"))
+
+def apply_delta(parent: list, delta: str) -> list[Lesson]:
+    """Восстанавливает занятия версии по занятиям родителя и дельте."""
+    data = json.loads(delta)
+    if data.get("v") != DELTA_VERSION or data["n"] != len(parent):
+        raise ValueError("дельта не подходит к родительской версии")
+    out, pos = [], 0
+    for i1, i2, rows in data["ops"]:
+        out.extend(parent[pos:i1])
+        out.extend(Lesson.from_row(row) for row in rows)
+        pos = i2
+    out.extend(parent[pos:])
+    return out
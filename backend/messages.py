@@ -0,0 +1,100 @@
+# backend/messages.py
+import re
+from bisect import bisect_left
+from datetime import date
+
+WEEKDAYS_RU = ["ПОНЕДЕЛЬНИК", "ВТОРНИК", "СРЕДА", "ЧЕТВЕРГ", "ПЯТНИЦА", "СУББОТА", "ВОСКРЕСЕНЬЕ"]
+# Типы занятий, которые показываем как есть; остальное (и пустое) — практика
+LESSON_TYPES = {"Лекция", "Лабораторная", "Семинар", "Зачет"}
+DEFAULT_LESSON_TYPE = "Практика"
+# Если scraper не выделил преподавателя, ищем фамилию в названии предмета
+KNOWN_TEACHERS = (
+    ("Семёнов", "Семёнов В.А."),
+    ("Иванов", "Иванов И.И."),
+    ("Лумбунова", "Лумбунова Н.Б."),
+    ("Извеков", "Извеков Я.О."),
+    ("Тюрюханова", "Тюрюханова И.В."),
+    ("Елтунова", "Елтунова И.Б."),
+    ("Белоусова", "Белоусова М.В."),
+    ("Протасов", "Протасов А.Е."),
+    ("Убеев", "Убеев А.А."),
+    ("Жамбаев", "Жамбаев Б.Ц."),
+)
+SUBJECT_PUNCT_RE = re.compile(r'[|:]')
+SPACES_RE = re.compile(r'\s+')
+
+def format_lesson_output(subject_name: str, lesson_type: str, room: str, teacher: str) -> str:
+    """Форматирует вывод занятия с аудиторией и преподавателем"""
+    details = []
+    # Добавляем аудиторию (room теперь уже отфильтрован в scraper.py)
+    if room:
+        details.append(f"📍 *{room}*")
+    # Добавляем преподавателя
+    if teacher:
+        details.append(f"👨‍🏫 *{teacher}*")
+
+    if details:
+        return f"*{subject_name}* *({lesson_type})* | {' | '.join(details)}"
+    else:
+        return f"*{subject_name}* *({lesson_type})*"
+
+def subject_name(subject: str) -> str:
+    """Название предмета без типа в скобках и служебных символов."""
+    head, bracket, _ = subject.partition('(')
+    if bracket:
+        return SPACES_RE.sub(' ', SUBJECT_PUNCT_RE.sub('', head.strip()).strip()).strip()
+    return SPACES_RE.sub(' ', subject.strip()).strip()
+
+def lesson_teacher(lesson) -> str:
+    if lesson.teacher:
+        return lesson.teacher
+    for surname, full in KNOWN_TEACHERS:
+        if surname in lesson.subject:
+            return full
+    return ""
+
+def render_lessons(lessons) -> str:
+    """Блок пар одного дня; строится один раз на версию (cache.CachedVersion)."""
+    parts = []
+    for l in sorted(lessons, key=lambda l: l.pair or 0):
+        lesson_type = l.kind if l.kind in LESSON_TYPES else DEFAULT_LESSON_TYPE
+        parts.append(f"**{l.pair} пара** {l.time}\n"
+                     f"{format_lesson_output(subject_name(l.subject), lesson_type, l.room, lesson_teacher(l))}\n\n")
+    return "".join(parts)
+
+def weekday_ru(day: date) -> str:
+    return WEEKDAYS_RU[day.weekday()]
+
+def _footer(url: str) -> str:
+    return f"🔗 ПОСМОТРЕТЬ КАРТОЧКУ: {url}\n"
+
+def _no_dates(entry, what: str, url: str) -> str:
+    return (f"📭 Расписания на {what} нет.\n\n"
+            f"📅 Доступные даты: {entry.dates_text}\n"
+            f"🔗 {url}")
+
+def schedule_message(entry, target: date, date_text: str, url: str) -> str:
+    """
+    /schedule: день target («сегодня»/«завтра»), иначе ближайший следующий день
+    с занятиями, иначе список доступных дат. Только поиск и склейка готовых частей.
+    """
+    target_str = target.strftime('%d.%m.%Y')
+    body = entry.day_texts.get(target)
+    if body is not None:
+        return (f"📅 РАСПИСАНИЕ НА {date_text.upper()} ({target_str})\n"
+                f"🗓 {weekday_ru(target)}\n\n{body}{_footer(url)}")
+    i = bisect_left(entry.dates, target)
+    if i == len(entry.dates):
+        return _no_dates(entry, f"{date_text} ({target_str})", url)
+    nearest = entry.dates[i]
+    return (f"📭 Расписания на {date_text} ({target_str}) нет.\n\n"
+            f"📅 Ближайшее расписание: {nearest.strftime('%d.%m.%Y')} ({weekday_ru(nearest)})\n\n"
+            f"{entry.day_texts[nearest]}{_footer(url)}")
+
+def date_message(entry, target: date, url: str) -> str:
+    """/date: день target или список доступных дат."""
+    target_str = target.strftime('%d.%m.%Y')
+    body = entry.day_texts.get(target)
+    if body is None:
+        return _no_dates(entry, target_str, url)
+    return f"📅 РАСПИСАНИЕ НА {target_str}\n🗓 {weekday_ru(target)}\n\n{body}{_footer(url)}"
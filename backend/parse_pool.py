@@ -0,0 +1,48 @@
+# backend/parse_pool.py
+import json, threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from lessons import Lesson
+from settings import PARSE_WORKERS
+
+_pool: ProcessPoolExecutor | None = None
+_lock = threading.Lock()
+
+def _warmup():
+    # Импорт парсера (bs4/lxml, регулярки) — один раз на процесс, а не на страницу
+    import scraper  # noqa: F401
+
+def _parse_worker(html: str) -> bytes:
+    from scraper import parse_schedule
+    # Компактные записи: строки Lesson.to_row без ключей
+    rows = [lesson.to_row() for lesson in parse_schedule(html)]
+    return json.dumps(rows, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def _decode(blob: bytes) -> list[Lesson]:
+    return [Lesson.from_row(row) for row in json.loads(blob)]
+
+def enabled() -> bool:
+    return PARSE_WORKERS > 0
+
+def get_pool() -> ProcessPoolExecutor:
+    """Пул живёт между тиками планировщика; процессы создаются при первой загрузке."""
+    global _pool
+    if _pool is None:
+        with _lock:
+            if _pool is None:
+                # spawn: форк процесса с потоками бота и планировщика небезопасен
+                _pool = ProcessPoolExecutor(max_workers=PARSE_WORKERS,
+                                            mp_context=multiprocessing.get_context("spawn"),
+                                            initializer=_warmup)
+    return _pool
+
+def parse(html: str) -> list[Lesson]:
+    """parse_schedule в процессе пула; вызывающий поток ждёт, не держа GIL."""
+    return _decode(get_pool().submit(_parse_worker, html).result())
+
+def shutdown():
+    global _pool
+    with _lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
@@ -0,0 +1,202 @@
+# backend/parsers.py
+from html.parser import HTMLParser
+from typing import Iterable, Iterator
+from bs4 import BeautifulSoup
+from settings import PARSER_BACKEND
+try:
+    import lxml.html
+    import lxml.etree
+except ImportError:
+    lxml = None
+
+# Текст этих тегов BeautifulSoup не включает в get_text — повторяем это и в lxml
+_SKIP_TEXT_TAGS = {"script", "style", "template", "rt", "rp"}
+
+class SoupDocument:
+    """Документ на BeautifulSoup + html.parser (чистый Python)."""
+    def __init__(self, html: str):
+        self.soup = BeautifulSoup(html, "html.parser")
+
+    def rows(self) -> Iterator[list[str]]:
+        # Тексты ячеек каждой строки каждой таблицы, в порядке документа
+        for tbl in self.soup.find_all("table"):
+            for tr in tbl.find_all("tr"):
+                yield [td.get_text(" ", strip=True) for td in tr.find_all(["td", "th"])]
+
+    def list_items(self) -> Iterator[str]:
+        for li in self.soup.find_all("li"):
+            yield li.get_text(" ", strip=True)
+
+def _lxml_text(el) -> str:
+    # Аналог get_text(" ", strip=True): куски текста обрезаются, пустые выкидываются
+    parts = []
+    def walk(e):
+        if e.text and e.text.strip():
+            parts.append(e.text.strip())
+        for child in e:
+            # Комментарии и инструкции имеют нестроковый tag — их текст пропускаем
+            if isinstance(child.tag, str) and child.tag not in _SKIP_TEXT_TAGS:
+                walk(child)
+            if child.tail and child.tail.strip():
+                parts.append(child.tail.strip())
+    walk(el)
+    return " ".join(parts)
+
+class LxmlDocument:
+    """Документ на lxml (libxml2). На корректной разметке даёт тот же текст, что и SoupDocument."""
+    def __init__(self, html: str):
+        # Байты + явная кодировка: lxml не принимает str с <?xml encoding=...?>
+        parser = lxml.html.HTMLParser(encoding="utf-8")
+        try:
+            self.root = lxml.html.document_fromstring(html.encode("utf-8"), parser=parser)
+        except lxml.etree.ParserError:
+            self.root = None  # пустой документ
+
+    def rows(self) -> Iterator[list[str]]:
+        if self.root is None:
+            return
+        for tbl in self.root.iter("table"):
+            for tr in tbl.iter("tr"):
+                yield [_lxml_text(td) for td in tr.iter("td", "th")]
+
+    def list_items(self) -> Iterator[str]:
+        if self.root is None:
+            return
+        for li in self.root.iter("li"):
+            yield _lxml_text(li)
+
+BACKENDS = {"html.parser": SoupDocument}
+if lxml is not None:
+    BACKENDS["lxml"] = LxmlDocument
+
+# ===== Потоковый разбор =====
+# События: ("row", [тексты ячеек]) по закрытию </tr> внутри таблицы и ("li", текст) по </li>.
+# В памяти держится только текущая строка, а не весь документ. В отличие от
+# find_all по каждой таблице, строки вложенных таблиц выдаются один раз.
+
+class _RowStreamParser(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.events = []
+        self.table_depth = 0
+        self.skip_depth = 0
+        self.row = None     # ячейки текущей строки
+        self.open = []      # открытые td/th/li: [тег, куски текста]
+        self.text = []      # текущий непрерывный кусок текста (data может прийти частями)
+
+    def _flush(self):
+        # Кусок текста между тегами — аналог одной строки NavigableString в BeautifulSoup
+        if self.text:
+            piece = "".join(self.text).strip()
+            self.text = []
+            if piece and not self.skip_depth:
+                for _, parts in self.open:
+                    parts.append(piece)
+
+    def _close_row(self):
+        if self.row is not None and self.table_depth:
+            self.events.append(("row", self.row))
+        self.row = None
+
+    def handle_starttag(self, tag, attrs):
+        self._flush()
+        if tag in _SKIP_TEXT_TAGS:
+            self.skip_depth += 1
+        elif tag == "table":
+            self.table_depth += 1
+        elif tag == "tr":
+            self._close_row()
+            self.row = []
+        elif tag in ("td", "th", "li"):
+            self.open.append([tag, []])
+
+    def handle_endtag(self, tag):
+        self._flush()
+        if tag in _SKIP_TEXT_TAGS:
+            self.skip_depth = max(0, self.skip_depth - 1)
+        elif tag == "table":
+            self._close_row()
+            self.table_depth = max(0, self.table_depth - 1)
+        elif tag == "tr":
+            self._close_row()
+        elif tag in ("td", "th", "li"):
+            # Закрываем ближайший открытый элемент с этим тегом
+            for i in range(len(self.open) - 1, -1, -1):
+                if self.open[i][0] == tag:
+                    _, parts = self.open.pop(i)
+                    text = " ".join(parts)
+                    if tag == "li":
+                        self.events.append(("li", text))
+                    elif self.row is not None:
+                        self.row.append(text)
+                    break
+
+    def handle_data(self, data):
+        self.text.append(data)
+
+    def handle_comment(self, data):
+        self._flush()
+
+def _stream_soup(chunks: Iterable[str]) -> Iterator[tuple[str, object]]:
+    parser = _RowStreamParser()
+    for chunk in chunks:
+        parser.feed(chunk)
+        yield from parser.events
+        parser.events.clear()
+    parser.close()
+    parser._flush()
+    yield from parser.events
+
+def _stream_lxml(chunks: Iterable[str]) -> Iterator[tuple[str, object]]:
+    parser = lxml.etree.HTMLPullParser(events=("end",), tag=("tr", "li"))
+
+    def drain():
+        for _, el in parser.read_events():
+            in_table = in_cell = False
+            for parent in el.iterancestors():
+                if parent.tag == "table":
+                    in_table = True
+                elif parent.tag in ("td", "th", "li"):
+                    in_cell = True
+            if el.tag == "li":
+                yield "li", _lxml_text(el)
+            elif in_table:
+                yield "row", [_lxml_text(td) for td in el.iter("td", "th")]
+            # Разобранное поддерево больше не нужно; внутри ячеек не чистим —
+            # их текст ещё понадобится внешней строке
+            if not in_cell and (in_table or el.tag == "li"):
+                el.clear(keep_tail=True)
+                while el.getprevious() is not None:
+                    del el.getparent()[0]
+
+    for chunk in chunks:
+        parser.feed(chunk)
+        yield from drain()
+    try:
+        parser.close()
+    except lxml.etree.XMLSyntaxError:
+        return  # пустой поток (тело ответа без единого байта) — событий нет, как у LxmlDocument
+    yield from drain()
+
+STREAM_BACKENDS = {"html.parser": _stream_soup}
+if lxml is not None:
+    STREAM_BACKENDS["lxml"] = _stream_lxml
+
+_default_backend = PARSER_BACKEND
+if _default_backend not in BACKENDS:
+    print(f"⚠️ Бэкенд парсера {_default_backend} недоступен, используем html.parser")
+    _default_backend = "html.parser"
+
+def load(html: str, backend: str | None = None):
+    """Разбирает html выбранным бэкендом (по умолчанию — PARSER_BACKEND)."""
+    name = backend or _default_backend
+    if name not in BACKENDS:
+        raise ValueError(f"Неизвестный бэкенд парсера: {name}")
+    return BACKENDS[name](html)
+
+def stream(chunks: Iterable[str], backend: str | None = None) -> Iterator[tuple[str, object]]:
+    """Потоковый разбор кусков текста: события ("row", ячейки) и ("li", текст)."""
+    name = backend or _default_backend
+    if name not in STREAM_BACKENDS:
+        raise ValueError(f"Неизвестный бэкенд парсера: {name}")
+    return STREAM_BACKENDS[name](chunks)
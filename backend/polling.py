@@ -0,0 +1,176 @@
+# backend/polling.py
+import math, os, random, socket
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from zoneinfo import ZoneInfo
+from settings import (POLL_MIN_MINUTES, POLL_MAX_MINUTES, POLL_BASE_MINUTES, POLL_REFERENCE_GAP_HOURS,
+                      POLL_RECENT_HOURS, POLL_WORK_HOURS, POLL_OFF_HOURS_FACTOR, POLL_JITTER,
+                      POLL_CHECKPOINTS, POLL_HISTORY, TIMEZONE,
+                      SCRAPE_LEASES, SCRAPE_LEASE_SECONDS, SCRAPE_CLAIM_LIMIT, WORKER_ID)
+
+class GroupPoll:
+    """Расписание опроса одной группы. Время — naive UTC, как ScheduleVersion.created_at."""
+    __slots__ = ("code", "url", "history", "interval", "next_due", "fetches", "changes")
+
+    def __init__(self, code: str, url: str, history: list):
+        self.code = code
+        self.url = url
+        self.history = sorted(history, reverse=True)[:POLL_HISTORY]  # от новых к старым
+        self.interval = POLL_BASE_MINUTES
+        self.next_due: Optional[datetime] = None
+        self.fetches = 0
+        self.changes = 0
+
+_groups: dict[str, GroupPoll] = {}
+_random = random.Random()
+# Для общей очереди (SCRAPE_LEASES): имя реплики в аренде
+WORKER = WORKER_ID or f"{socket.gethostname()}-{os.getpid()}"
+
+def _parse_hours(raw: str) -> tuple[int, int]:
+    start, _, end = raw.partition('-')
+    return int(start), int(end or 24)
+
+def parse_checkpoints(raw: str = POLL_CHECKPOINTS) -> list[tuple[int, int]]:
+    """ "06:30,18:30" -> [(6, 30), (18, 30)] """
+    points = []
+    for part in raw.split(','):
+        if part.strip():
+            hour, _, minute = part.strip().partition(':')
+            points.append((int(hour), int(minute or 0)))
+    return points
+
+WORK_START, WORK_END = _parse_hours(POLL_WORK_HOURS)
+
+def is_working_hours(now: datetime) -> bool:
+    local = now.replace(tzinfo=timezone.utc).astimezone(ZoneInfo(TIMEZONE))
+    return WORK_START <= local.hour < WORK_END
+
+def interval_for(history: list, now: datetime, working: bool) -> float:
+    """
+    Интервал опроса, минут. Сразу после изменения — минимальный (правки идут сериями).
+    Иначе — по среднему промежутку между изменениями группы: корень из него, так
+    при том же числе загрузок средняя задержка обнаружения меньше, чем при
+    пропорциональном. Вне рабочих часов — реже. Всегда в [POLL_MIN_MINUTES, POLL_MAX_MINUTES].
+    """
+    if history and now - history[0] < timedelta(hours=POLL_RECENT_HOURS):
+        return POLL_MIN_MINUTES
+    if len(history) >= 2:
+        gap_hours = (history[0] - history[-1]).total_seconds() / 3600 / (len(history) - 1)
+        minutes = POLL_BASE_MINUTES * math.sqrt(gap_hours / POLL_REFERENCE_GAP_HOURS)
+    else:
+        minutes = POLL_BASE_MINUTES
+    if not working:
+        minutes *= POLL_OFF_HOURS_FACTOR
+    return max(POLL_MIN_MINUTES, min(POLL_MAX_MINUTES, minutes))
+
+def _schedule(g: GroupPoll, now: datetime):
+    g.interval = interval_for(g.history, now, is_working_hours(now))
+    # Разброс, чтобы группы с одинаковым интервалом не синхронизировались
+    spread = 1 + _random.uniform(-POLL_JITTER, POLL_JITTER)
+    g.next_due = now + timedelta(minutes=g.interval * spread)
+
+def load_history(groups: dict[str, str]) -> dict[str, list]:
+    """Время создания последних версий каждой группы (из БД, блокирующий вызов)."""
+    from db import list_versions
+    return {code: [v.created_at for v in list_versions(code, POLL_HISTORY)] for code in groups}
+
+def setup(groups: dict[str, str], history: Optional[dict] = None, now: Optional[datetime] = None):
+    """
+    Начальное состояние. Первые проверки размазаны по первому интервалу, чтобы
+    после рестарта все группы не запрашивались в одну секунду.
+    """
+    now = now or datetime.utcnow()
+    history = load_history(groups) if history is None else history
+    _groups.clear()
+    for code, url in groups.items():
+        g = GroupPoll(code, url, history.get(code, []))
+        g.interval = interval_for(g.history, now, is_working_hours(now))
+        g.next_due = now + timedelta(minutes=_random.uniform(0, min(g.interval, POLL_BASE_MINUTES)))
+        _groups[code] = g
+
+def due(now: Optional[datetime] = None) -> dict[str, str]:
+    """Группы, которым пора на проверку: {код: адрес}."""
+    now = now or datetime.utcnow()
+    return {g.code: g.url for g in _groups.values() if g.next_due is None or g.next_due <= now}
+
+def record(code: str, changed: bool, now: Optional[datetime] = None):
+    """Итог проверки группы: пересчитываем интервал и время следующей."""
+    g = _groups.get(code)
+    if g is None:
+        return
+    now = now or datetime.utcnow()
+    g.fetches += 1
+    if changed:
+        g.changes += 1
+        g.history = [now] + g.history[:POLL_HISTORY - 1]
+    _schedule(g, now)
+
+def mark_all_due(spread_minutes: Optional[float] = None, now: Optional[datetime] = None):
+    """
+    Обязательная проверка всех групп (POLL_CHECKPOINTS: утро и вечер, когда смотрят
+    расписание на день). Группы ставятся в очередь вразброс в пределах spread_minutes.
+    """
+    now = now or datetime.utcnow()
+    spread = POLL_MIN_MINUTES if spread_minutes is None else spread_minutes
+    for g in _groups.values():
+        g.next_due = min(g.next_due or now, now + timedelta(minutes=_random.uniform(0, spread)))
+
+# ===== Общая очередь в БД (SCRAPE_LEASES=1) =====
+# Те же интервалы, но срок следующей проверки и аренда хранятся в db.ScrapeJob:
+# реплики делят группы между собой, и каждую группу за тик проверяет одна из них.
+
+def setup_shared(groups: dict[str, str], now: Optional[datetime] = None):
+    """Заводит строки очереди для новых групп; первые проверки размазаны, как в setup."""
+    from db import sync_jobs
+    now = now or datetime.utcnow()
+    history = load_history(groups)
+    first_due = {}
+    for code in groups:
+        # Группу без единой версии проверяем сразу
+        spread = min(interval_for(history[code], now, is_working_hours(now)), POLL_BASE_MINUTES) \
+            if history[code] else 0
+        first_due[code] = now + timedelta(minutes=_random.uniform(0, spread))
+    sync_jobs(groups, first_due)
+
+def claim(now: Optional[datetime] = None) -> dict[str, str]:
+    """Группы, взятые этой репликой в аренду: {код: адрес}."""
+    from db import claim_jobs
+    return claim_jobs(WORKER, now or datetime.utcnow(), SCRAPE_LEASE_SECONDS, SCRAPE_CLAIM_LIMIT)
+
+def heartbeat(codes: list, now: Optional[datetime] = None) -> int:
+    from db import heartbeat_jobs
+    return heartbeat_jobs(WORKER, codes, now or datetime.utcnow(), SCRAPE_LEASE_SECONDS) if codes else 0
+
+def finish(code: str, now: Optional[datetime] = None) -> bool:
+    """
+    Итог проверки в общей очереди: интервал — по версиям группы в БД (их видят все
+    реплики). False — аренду за время проверки забрала другая реплика.
+    """
+    from db import complete_job
+    now = now or datetime.utcnow()
+    history = load_history({code: ""})[code]
+    interval = interval_for(history, now, is_working_hours(now))
+    next_due = now + timedelta(minutes=interval * (1 + _random.uniform(-POLL_JITTER, POLL_JITTER)))
+    return complete_job(WORKER, code, next_due, interval, now)
+
+def mark_all_due_shared(groups: dict[str, str], spread_minutes: Optional[float] = None,
+                        now: Optional[datetime] = None):
+    """mark_all_due для общей очереди."""
+    from db import advance_jobs
+    now = now or datetime.utcnow()
+    spread = POLL_MIN_MINUTES if spread_minutes is None else spread_minutes
+    advance_jobs({code: now + timedelta(minutes=_random.uniform(0, spread)) for code in groups})
+
+def release() -> int:
+    from db import release_jobs
+    return release_jobs(WORKER)
+
+def stats() -> dict:
+    if SCRAPE_LEASES:
+        from db import list_jobs
+        return {j.group_code: {"interval_min": round(j.interval_min, 1),
+                               "next_due": j.next_due_at.isoformat(), "runs": j.runs,
+                               "owner": j.owner} for j in list_jobs()}
+    return {code: {"interval_min": round(g.interval, 1),
+                   "next_due": g.next_due.isoformat() if g.next_due else None,
+                   "fetches": g.fetches, "changes": g.changes} for code, g in _groups.items()}
@@ -1,314 +1,445 @@
 # backend/scraper.py
-import os, re, hashlib
-import requests
-from bs4 import BeautifulSoup
-from datetime import date, timedelta
+import os, re, hashlib, codecs, threading
+from typing import Iterable, Iterator
+from urllib.parse import urlsplit
+from requests.compat import chardet
+import http_client
+import parsers
+import parse_pool
+from datetime import date, datetime, timedelta
+from lessons import Lesson
+from settings import STREAM_CHUNK_SIZE
 
 GROUP_PAGE_URL = os.getenv("GROUP_PAGE_URL", "https://biik.ru/rasp/cg389.htm")
 
 def get_monday(d: date) -> date:
     return d - timedelta(days=d.weekday())
 
-def fetch_html(url: str) -> str:
-    # Иногда сайт отдаёт cp1251 — requests сам определит, но подстрахуемся
-    r = requests.get(url, timeout=20, headers={"User-Agent":"Mozilla/5.0"})
+def fetch_page(url: str, etag: str | None = None, last_modified: str | None = None) -> dict:
+    """
+    Условный GET: с etag/last_modified сервер может ответить 304 без тела.
+    Возвращаем {not_modified, content, raw_hash, etag, last_modified, url, content_type};
+    content — сырые байты, декодируются только при разборе (page_html).
+    """
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    r = http_client.get(url, headers=headers)
+    if r.status_code == 304:
+        return {"not_modified": True, "content": b"", "raw_hash": None,
+                "etag": etag, "last_modified": last_modified, "url": url, "content_type": None}
     r.raise_for_status()
-    r.encoding = r.apparent_encoding or "windows-1251"
-    return r.text
+    return {
+        "not_modified": False,
+        "content": r.content,
+        "raw_hash": hashlib.sha256(r.content).hexdigest(),
+        "etag": r.headers.get("ETag"),
+        "last_modified": r.headers.get("Last-Modified"),
+        "url": url,
+        "content_type": r.headers.get("Content-Type"),
+    }
+
+HEADER_CHARSET_RE = re.compile(r'charset\s*=\s*["\']?\s*([\w.:-]+)', re.I)
+META_CHARSET_RE = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?\s*([\w.:-]+)', re.I)
+# <meta charset> ищем только в начале документа
+META_SCAN_BYTES = 4096
+
+# Кодировка, выбранная для каждого хоста, и откуда она взялась
+_host_encodings: dict[str, str] = {}
+ENCODING_STATS = {"header": 0, "meta": 0, "cache": 0, "detect": 0}
+_encoding_lock = threading.Lock()
+
+def _codec_name(name: str | None) -> str | None:
+    if not name:
+        return None
+    try:
+        return codecs.lookup(name).name
+    except LookupError:
+        return None
+
+def _decode_strict(content: bytes, encoding: str | None) -> str | None:
+    if not encoding:
+        return None
+    try:
+        return str(content, encoding)
+    except UnicodeDecodeError:
+        return None
+
+def _looks_utf8(data: bytes, cached: str, final: bool = True) -> bool:
+    """
+    Кэшированная однобайтовая кодировка (cp1251) «декодирует» любые байты без ошибок,
+    поэтому перед ней пробуем строгий UTF-8: хост мог перейти на него без объявления.
+    """
+    if _codec_name(cached) == "utf-8" or data.isascii():
+        return False
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(data, final)
+    except UnicodeDecodeError:
+        return False
+    return True
+
+def _declared_encodings(head: bytes, content_type: str | None) -> tuple[str | None, str | None]:
+    """Кодировки, объявленные в Content-Type и в <meta charset> начала документа."""
+    m_header = HEADER_CHARSET_RE.search(content_type or "")
+    m_meta = META_CHARSET_RE.search(head[:META_SCAN_BYTES])
+    header = _codec_name(m_header.group(1)) if m_header else None
+    meta = _codec_name(m_meta.group(1).decode("ascii", "replace")) if m_meta else None
+    return header, meta
+
+def _remember_encoding(host: str, encoding: str, source: str):
+    with _encoding_lock:
+        ENCODING_STATS[source] += 1
+        _host_encodings[host] = encoding
+
+def page_html(page: dict) -> str:
+    """
+    Декодирует страницу. Быстрый путь — charset из Content-Type или <meta charset>,
+    затем кодировка, уже выбранная для этого хоста. Статистическое определение
+    по всему телу — только если объявлений нет, они расходятся или не подходят.
+    """
+    content = page["content"]
+    host = urlsplit(page.get("url") or "").netloc
+    header, meta = _declared_encodings(content, page.get("content_type"))
+
+    source, encoding, text = None, None, None
+    if header and meta and header != meta:
+        pass  # объявления расходятся — не верим ни одному
+    elif header or meta:
+        encoding = header or meta
+        text = _decode_strict(content, encoding)
+        source = ("header" if header else "meta") if text is not None else None
+    if source is None and host in _host_encodings:
+        encoding = _host_encodings[host]
+        if _looks_utf8(content, encoding):
+            encoding = "utf-8"
+        text = _decode_strict(content, encoding)
+        source = "cache" if text is not None else None
+    if source is None:
+        # Иногда сайт отдаёт cp1251 без объявления — определяем по содержимому, но подстрахуемся
+        encoding = chardet.detect(content)["encoding"] or "windows-1251"
+        text = str(content, encoding, errors="replace")
+        source = "detect"
+
+    _remember_encoding(host, encoding, source)
+    return text
+
+def fetch_page_stream(url: str, etag: str | None = None, last_modified: str | None = None) -> dict:
+    """
+    Как fetch_page, но тело не читается целиком: page["chunks"] — генератор
+    декодированных кусков текста. raw_hash заполняется, когда генератор дочитан.
+    """
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    r = http_client.get(url, headers=headers, stream=True)
+    if r.status_code == 304:
+        r.close()
+        return {"not_modified": True, "content": b"", "raw_hash": None,
+                "etag": etag, "last_modified": last_modified, "url": url, "content_type": None}
+    try:
+        r.raise_for_status()
+    except Exception:
+        r.close()
+        raise
+    page = {
+        "not_modified": False,
+        "raw_hash": None,
+        "etag": r.headers.get("ETag"),
+        "last_modified": r.headers.get("Last-Modified"),
+        "url": url,
+        "content_type": r.headers.get("Content-Type"),
+    }
+    page["chunks"] = _iter_page_text(r, page)
+    return page
+
+def _iter_page_text(r, page: dict) -> Iterator[str]:
+    digest = hashlib.sha256()
+    raw = r.iter_content(STREAM_CHUNK_SIZE)
+    try:
+        # Набираем начало документа, где должен быть <meta charset>
+        head = b""
+        for chunk in raw:
+            digest.update(chunk)
+            head += chunk
+            if len(head) >= META_SCAN_BYTES:
+                break
+        host = urlsplit(page["url"]).netloc
+        header, meta = _declared_encodings(head, page["content_type"])
+        encoding, source = None, None
+        if (header or meta) and not (header and meta and header != meta):
+            encoding, source = header or meta, ("header" if header else "meta")
+        elif host in _host_encodings:
+            encoding, source = _host_encodings[host], "cache"
+            # Начало документа может оборваться посреди символа — это не ошибка UTF-8
+            if _looks_utf8(head, encoding, final=False):
+                encoding = "utf-8"
+
+        if encoding is None:
+            # Объявлений нет — кодировку можно определить только по всему телу
+            body = [head]
+            for chunk in raw:
+                digest.update(chunk)
+                body.append(chunk)
+            page["raw_hash"] = digest.hexdigest()
+            yield page_html({"content": b"".join(body), "url": page["url"],
+                             "content_type": page["content_type"]})
+            return
+
+        _remember_encoding(host, encoding, source)
+        decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        yield decoder.decode(head)
+        for chunk in raw:
+            digest.update(chunk)
+            yield decoder.decode(chunk)
+        yield decoder.decode(b"", final=True)
+        page["raw_hash"] = digest.hexdigest()
+    finally:
+        r.close()
+
+def encoding_stats() -> dict:
+    """Сколько раз какой путь выбора кодировки сработал; detect — дорогой запасной."""
+    with _encoding_lock:
+        stats = dict(ENCODING_STATS)
+    total = sum(stats.values())
+    stats["fallback_ratio"] = round(stats["detect"] / total, 3) if total else 0.0
+    return stats
+
+def fetch_html(url: str) -> str:
+    return page_html(fetch_page(url))
+
+# Предкомпилированные шаблоны разбора строк таблицы
+DATE_RE = re.compile(r'(\d{2}\.\d{2}\.\d{4})\s*([А-Яа-я]+)-(\d+)')
+PAIR_RE = re.compile(r'\b([1-7])\b')
+# Формат ячейки предмета: "ТСВПС (Практич.) 314 Извеков Я.О."
+KIND_RE = re.compile(r'\((Лек|Пр|Лаб|Сем|Зач|Практич\.?)\)', re.I)
+# Аудитория: число или текст типа "ЦМИТ", "сз2"
+ROOM_RE = re.compile(r'\b([А-ЯA-Z]?-?\d{2,4}[A-Za-zА-Я]?)\b')
+TEACHER_RE = re.compile(r'([А-Я][а-я]+ [А-Я]\.[А-Я]\.)')
+SPACES_RE = re.compile(r'\s+')
+TIME_RE = re.compile(r'\b(\d{1,2}[:.]\d{2})\s*[-–]\s*(\d{1,2}[:.]\d{2})\b')
 
-def normalize_schedule(html: str) -> list[dict]:
+# Время в HTML не указано — определяем по номеру пары
+PAIR_TIMES = {
+    1: ("08:30", "10:00"),
+    2: ("10:10", "11:40"),
+    3: ("12:20", "13:50"),
+    4: ("14:10", "15:40"),
+    5: ("15:50", "17:20"),
+    6: ("17:30", "19:00"),
+    7: ("19:10", "20:40"),
+}
+# Сокращения типа занятия; неизвестные значения остаются как есть
+KIND_NAMES = {
+    "Лек": "Лекция",
+    "Лаб": "Лабораторная",
+    "Практич": "Практика",
+    "Пр": "Практика",
+    "Сем": "Семинар",
+    "Зач": "Зачет",
+}
+DEFAULT_KIND = "Практика"
+# Проблемные номера аудиторий, которые на самом деле не аудитории
+IGNORED_ROOMS = {4, 10, 12}
+
+ROW_DATE = "date"      # строка с датой (в ней же может быть первая пара)
+ROW_LESSON = "lesson"  # строка с парой
+ROW_JUNK = "junk"      # всё остальное: пустые пары, заголовки, мусор вида ['8', '']
+
+def classify_row(tds: list[str]) -> tuple[str, re.Match | None, int | None, str | None]:
     """
-    Возвращаем структурированное расписание:
-    [{day: 'Пн', pair: 1, time: '08:30-10:00', subject: '...', kind: 'Лек', room:'122', teacher:'...'}, ...]
+    Определяет тип строки таблицы за один проход по ячейкам.
+    Возвращает (тип, совпадение даты, номер пары, ячейка предмета); номер пары
+    и предмет заданы, только если в строке есть непустая пара.
     """
-    soup = BeautifulSoup(html, "html.parser")
+    if not tds:
+        return ROW_JUNK, None, None, None
+    date_match = DATE_RE.search(tds[0])
+    if date_match:
+        # Если в строке 3 ячейки: дата, номер пары, предмет
+        row, cells = ROW_DATE, (tds[1:] if len(tds) == 3 else None)
+    elif len(tds) == 2:
+        # 2 ячейки из-за rowspan в первой: номер пары, предмет
+        row, cells = ROW_LESSON, tds
+    elif len(tds) == 3:
+        # 3 ячейки: дата (пустая), номер пары, предмет
+        row, cells = ROW_LESSON, tds[1:]
+    else:
+        return ROW_JUNK, None, None, None
+
+    if cells:
+        pair_cell, subject_cell = cells
+        m_pair = PAIR_RE.search(pair_cell)
+        # В строке с датой берём только первую пару; пустые пары (&nbsp;) пропускаем
+        if (m_pair and (row is ROW_LESSON or m_pair.group(1) == "1")
+                and len(subject_cell.strip()) >= 3):
+            return row, date_match, int(m_pair.group(1)), subject_cell
+    if row is ROW_LESSON:
+        return ROW_JUNK, None, None, None
+    return row, date_match, None, None
+
+def parse_day(date_match: re.Match) -> tuple[date | None, str, int | None, str]:
+    """(дата, день недели, номер недели, заголовок) из заголовка дня "29.09.2025 Пн-1"."""
+    date_str, weekday, week = date_match.groups()
+    label = f"{date_str} {weekday}-{week}"
+    try:
+        return datetime.strptime(date_str, '%d.%m.%Y').date(), weekday, int(week), label
+    except ValueError:
+        # Несуществующая дата (31.02): пары дня не теряем — как Lesson.from_legacy,
+        # оставляем их без даты с заголовком в subject
+        return None, "", None, label
+
+def parse_lesson(pair: int, subject_cell: str, day: tuple[date | None, str, int | None, str]) -> Lesson:
+    """Разбирает ячейку предмета: тип занятия, аудитория, преподаватель."""
+    m_kind = KIND_RE.search(subject_cell)
+    m_room = ROOM_RE.search(subject_cell)
+    m_teacher = TEACHER_RE.search(subject_cell)
+
+    # Убираем аудиторию и преподавателя, оставляем только название предмета и тип
+    clean_subject = subject_cell
+    if m_room:
+        clean_subject = clean_subject.replace(m_room.group(1), '').strip()
+    if m_teacher:
+        clean_subject = clean_subject.replace(m_teacher.group(1), '').strip()
+    clean_subject = SPACES_RE.sub(' ', clean_subject).strip()
+
+    room_val = ""
+    if m_room:
+        room_raw = m_room.group(1)
+        if not (room_raw.isdigit() and int(room_raw) in IGNORED_ROOMS):
+            room_val = room_raw
 
+    lesson_date, weekday, week_no, label = day
+    if lesson_date is None:
+        clean_subject = f"{label} | {clean_subject}"
+    start, end = PAIR_TIMES[pair]
+    return Lesson(
+        lesson_date, weekday, week_no, pair, start, end, clean_subject,
+        kind=KIND_NAMES.get(m_kind.group(1), m_kind.group(1)) if m_kind else DEFAULT_KIND,
+        room=room_val,
+        teacher=m_teacher.group(1) if m_teacher else "",
+    )
+
+def parse_list_item(txt: str) -> Lesson | None:
+    m_time = TIME_RE.search(txt)
+    if not m_time:
+        return None
+    return Lesson(None, "", None, None, m_time.group(1).replace('.', ':'),
+                  m_time.group(2).replace('.', ':'), txt)
+
+def _parse_document(doc) -> list[tuple[Lesson, list[str]]]:
     # Шаблон страниц «Экспресс-расписание» обычно таблицы/списки по дням.
     # Берём все строки, где есть номер пары/время, предмет, аудитория и препод.
     # Ниже — эвристичный парсер, который хорошо работает с табличной вёрсткой.
     data = []
-    current_date = None
-    current_weekday = None
-    current_week = None
-    
-    # Ищем все таблицы
-    tables = soup.find_all("table")
-    
-    for tbl in tables:
-        # Ищем все строки в таблице
-        rows = tbl.find_all("tr")
-        
-        for tr in rows:
-            tds = [td.get_text(" ", strip=True) for td in tr.find_all(["td","th"])]
-            
-            # Проверяем первую ячейку на наличие даты
-            if tds and len(tds) > 0:
-                first_cell = tds[0].strip()
-                date_match = re.search(r'(\d{2}\.\d{2}\.\d{4})\s*([А-Яа-я]+)-(\d+)', first_cell)
-                if date_match:
-                    current_date = date_match.group(1)
-                    current_weekday = date_match.group(2)
-                    current_week = date_match.group(3)
-                    
-                                        # Проверяем, есть ли в этой же строке первая пара
-                    # Если в строке 3 ячейки: дата, номер пары, предмет
-                    if len(tds) == 3:
-                        pair_cell = tds[1]  # Номер пары
-                        subject_cell = tds[2]  # Предмет
-                        
-                        # Ищем номер пары
-                        m_pair = re.search(r'\b([1-7])\b', pair_cell)
-                        if m_pair and m_pair.group(1) == "1":
-                            # Это первая пара! Проверяем, что предмет не пустой
-                            if not subject_cell.strip() or subject_cell.strip() == '\xa0' or len(subject_cell.strip()) < 3:
-                                continue  # Пропускаем пустые пары
-                            
-                            # Это первая пара! Обрабатываем её
-                            pair_num = 1
-                            time_start, time_end = "08:30", "10:00"
-                            
-                            # Ищем предмет, аудиторию и тип
-                            m_kind = re.search(r'\((Лек|Пр|Лаб|Сем|Зач|Практич\.?)\)', subject_cell, re.I)
-                            m_room = re.search(r'\b([А-ЯA-Z]?-?\d{2,4}[A-Za-zА-Я]?)\b', subject_cell)
-                            m_teacher = re.search(r'([А-Я][а-я]+ [А-Я]\.[А-Я]\.)', subject_cell)
-                            if not m_teacher:
-                                # Альтернативный поиск преподавателя - более гибкий
-                                m_teacher = re.search(r'([А-Я][а-я]+ [А-Я]\.[А-Я]\.)', subject_cell)
-                            if not m_teacher:
-                                # Еще более гибкий поиск - ищем любые инициалы
-                                m_teacher = re.search(r'([А-Я][а-я]+ [А-Я]\.[А-Я]\.)', subject_cell)
-                            
-                            # Очищаем название предмета
-                            clean_subject = subject_cell
-                            if m_room:
-                                clean_subject = clean_subject.replace(m_room.group(1), '').strip()
-                            if m_teacher:
-                                clean_subject = clean_subject.replace(m_teacher.group(1), '').strip()
-                            clean_subject = re.sub(r'\s+', ' ', clean_subject).strip()
-                            
-                            # Извлекаем тип занятия
-                            kind_val = "Практика"  # По умолчанию
-                            if m_kind:
-                                kind_raw = m_kind.group(1)
-                                if kind_raw == "Лек":
-                                    kind_val = "Лекция"
-                                elif kind_raw == "Лаб":
-                                    kind_val = "Лабораторная"
-                                elif kind_raw == "Практич" or kind_raw == "Пр":
-                                    kind_val = "Практика"
-                                elif kind_raw == "Сем":
-                                    kind_val = "Семинар"
-                                elif kind_raw == "Зач":
-                                    kind_val = "Зачет"
-                                else:
-                                    kind_val = kind_raw
-                            
-                            # Извлекаем аудиторию
-                            room_val = ""
-                            if m_room:
-                                room_raw = m_room.group(1)
-                                if room_raw.isdigit() and int(room_raw) in [4, 10, 12]:
-                                    room_val = ""
-                                else:
-                                    room_val = room_raw
-                            
-                            # Извлекаем преподавателя
-                            teacher_val = ""
-                            if m_teacher:
-                                teacher_val = m_teacher.group(1)
-                            
-                            # Добавляем первую пару
-                            subject_with_date = f"{current_date} {current_weekday}-{current_week} | {clean_subject}"
-                            data.append({
-                                "pair": pair_num,
-                                "time": f"{time_start}-{time_end}",
-                                "subject": subject_with_date,
-                                "room": room_val,
-                                "kind": kind_val,
-                                "teacher": teacher_val,
-                                "raw": tds
-                            })
-                    
-                    continue  # Пропускаем строку с датой
-            
-            # Ищем строки с парами
-            if len(tds) >= 2:  # Может быть 2 ячейки из-за rowspan в первой ячейке
-                # Если 2 ячейки: первая - номер пары, вторая - предмет
-                # Если 3 ячейки: первая - дата (rowspan), вторая - номер пары, третья - предмет
-                if len(tds) == 2:
-                    pair_cell = tds[0]  # Номер пары
-                    subject_cell = tds[1]  # Предмет
-                elif len(tds) == 3:
-                    pair_cell = tds[1]  # Номер пары (пропускаем дату)
-                    subject_cell = tds[2]  # Предмет
-                else:
-                    continue  # Пропускаем неподходящие строки
-                
-                # Проверяем, есть ли дата
-                if not current_date:
-                    continue  # Пропускаем, если нет даты
-                
-                # Явно фильтруем мусорные строки, которые содержат лишь одиночные цифры (напр. ['8',''])
-                if subject_cell.strip() == '' and re.fullmatch(r'\d+', pair_cell.strip() or ''):
-                    continue
-
-                # Время не указано в HTML, будем определять по номеру пары
-                # Ищем номер пары в ячейке (просто цифра 1, 2, 3, 4, 5, 6, 7)
-                m_pair = re.search(r'\b([1-7])\b', pair_cell)
-                
-                # Ищем предмет, аудиторию и тип в ячейке предмета
-                # Формат: "ТСВПС (Практич.) 314 Извеков Я.О."
-                m_kind = re.search(r'\((Лек|Пр|Лаб|Сем|Зач|Практич\.?)\)', subject_cell, re.I)
-                
-                # Ищем аудиторию (число или текст типа "ЦМИТ", "сз2")
-                m_room = re.search(r'\b([А-ЯA-Z]?-?\d{2,4}[A-Za-zА-Я]?)\b', subject_cell)
-                
-                # Ищем преподавателя (после аудитории) - учитываем HTML-ссылки
-                m_teacher = re.search(r'([А-Я][а-я]+ [А-Я]\.[А-Я]\.)', subject_cell)
-                if not m_teacher:
-                    # Альтернативный поиск преподавателя - более гибкий
-                    m_teacher = re.search(r'([А-Я][а-я]+ [А-Я]\.[А-Я]\.)', subject_cell)
-                if not m_teacher:
-                    # Еще более гибкий поиск - ищем любые инициалы
-                    m_teacher = re.search(r'([А-Я][а-я]+ [А-Я]\.[А-Я]\.)', subject_cell)
-                
-                # Если есть номер пары и дата - это строка с парой
-                if not (m_pair and current_date):
-                    continue
-
-                # Проверяем, что предмет не пустой (не только пробелы и не &nbsp;)
-                if not subject_cell.strip() or subject_cell.strip() == '\xa0' or len(subject_cell.strip()) < 3:
-                    continue  # Пропускаем пустые пары
-
-                # Определяем номер пары
-                pair_num = int(m_pair.group(1))
-                
-                # Определяем время по номеру пары
-                time_start = ""
-                time_end = ""
-                if pair_num == 1:
-                    time_start, time_end = "08:30", "10:00"
-                elif pair_num == 2:
-                    time_start, time_end = "10:10", "11:40"
-                elif pair_num == 3:
-                    time_start, time_end = "12:20", "13:50"
-                elif pair_num == 4:
-                    time_start, time_end = "14:10", "15:40"
-                elif pair_num == 5:
-                    time_start, time_end = "15:50", "17:20"
-                elif pair_num == 6:
-                    time_start, time_end = "17:30", "19:00"
-                elif pair_num == 7:
-                    time_start, time_end = "19:10", "20:40"
-                
-                # Очищаем название предмета от лишнего
-                clean_subject = subject_cell
-                
-                # Убираем аудиторию и преподавателя, оставляем только название предмета и тип
-                if m_room:
-                    clean_subject = clean_subject.replace(m_room.group(1), '').strip()
-                if m_teacher:
-                    clean_subject = clean_subject.replace(m_teacher.group(1), '').strip()
-                
-                # Убираем лишние пробелы
-                clean_subject = re.sub(r'\s+', ' ', clean_subject).strip()
-                
-                # Извлекаем тип занятия
-                kind_val = ""
-                if m_kind:
-                    kind_raw = m_kind.group(1)
-                    if kind_raw == "Лек":
-                        kind_val = "Лекция"
-                    elif kind_raw == "Лаб":
-                        kind_val = "Лабораторная"
-                    elif kind_raw == "Практич" or kind_raw == "Пр":
-                        kind_val = "Практика"
-                    elif kind_raw == "Сем":
-                        kind_val = "Семинар"
-                    elif kind_raw == "Зач":
-                        kind_val = "Зачет"
-                    else:
-                        kind_val = kind_raw
-                else:
-                    kind_val = "Практика"  # По умолчанию
-                
-                # Извлекаем аудиторию
-                room_val = ""
-                if m_room:
-                    room_raw = m_room.group(1)
-                    # Фильтруем проблемные номера аудиторий
-                    if room_raw.isdigit() and int(room_raw) in [4, 10, 12]:
-                        room_val = ""
-                    else:
-                        room_val = room_raw
-                
-                # Извлекаем преподавателя
-                teacher_val = ""
-                if m_teacher:
-                    teacher_val = m_teacher.group(1)
-                
-                # Добавляем дату в начало названия предмета для группировки по дням
-                subject_with_date = f"{current_date} {current_weekday}-{current_week} | {clean_subject}"
-                
-                data.append({
-                    "pair": pair_num,
-                    "time": f"{time_start}-{time_end}",
-                    "subject": subject_with_date,
-                    "room": room_val,
-                    "kind": kind_val,
-                    "teacher": teacher_val,
-                    "raw": tds
-                })
+    day = None  # (дата, день недели, номер недели, заголовок) последней строки с датой
+
+    for tds in doc.rows():
+        row, date_match, pair, subject_cell = classify_row(tds)
+        if row is ROW_DATE:
+            day = parse_day(date_match)
+        if pair is not None and day is not None:
+            data.append((parse_lesson(pair, subject_cell, day), tds))
 
     # если таблицы не нашли, пробуем списки:
     if not data:
-        for li in soup.find_all("li"):
-            txt = li.get_text(" ", strip=True)
-            m_time = re.search(r'\b(\d{1,2}[:.]\d{2})\s*[-–]\s*(\d{1,2}[:.]\d{2})\b', txt)
-            if m_time:
-                data.append({
-                    "pair": None,
-                    "time": f"{m_time.group(1)}-{m_time.group(2)}".replace('.',':'),
-                    "subject": txt,
-                    "room": "",
-                    "kind": "",
-                    "raw": [txt]
-                })
-    
-    # Финальная очистка и дедупликация
+        for txt in doc.list_items():
+            lesson = parse_list_item(txt)
+            if lesson:
+                data.append((lesson, [txt]))
+
+    # Дедупликация
     cleaned = []
     seen = set()
-    for item in data:
-        # Пропускаем мусорные элементы без предмета/времени или с подозрительным raw
-        if not item.get("subject") or not item.get("time"):
+    for lesson, raw in data:
+        key = lesson.key()
+        if key in seen:
             continue
-        raw_val = item.get("raw")
-        if isinstance(raw_val, list) and len(raw_val) == 2 and raw_val[0].isdigit() and raw_val[1] == "":
-            # Это как раз случай ["8", ""] из логов
+        seen.add(key)
+        cleaned.append((lesson, raw))
+    return cleaned
+
+def parse_schedule(html: str, backend: str | None = None) -> list[Lesson]:
+    """Занятия страницы в порядке документа, без дубликатов."""
+    return [lesson for lesson, _ in _parse_document(parsers.load(html, backend))]
+
+def normalize_schedule(html: str, backend: str | None = None) -> list[dict]:
+    """
+    Расписание в старом формате (payload v1) — дата вписана в subject:
+    [{pair: 1, time: '08:30-10:00', subject: '29.09.2025 Пн-1 | ...', kind: 'Лекция', room:'122', teacher:'...', raw: [...]}, ...]
+    """
+    return [lesson.to_legacy(raw) for lesson, raw in _parse_document(parsers.load(html, backend))]
+
+def _key_digest(key: tuple) -> bytes:
+    # Вместо кортежа со строками храним короткий отпечаток ключа
+    return hashlib.blake2b(repr(key).encode("utf-8"), digest_size=16).digest()
+
+def iter_schedule(chunks: Iterable[str], backend: str | None = None) -> Iterator[Lesson]:
+    """
+    Потоковый вариант parse_schedule: читает документ кусками и отдаёт занятия
+    по мере закрытия строк таблицы, дедуплицируя на лету. Пиковая память зависит
+    от размера строки, а не страницы (плюс 16-байтовый отпечаток каждого занятия).
+    """
+    day = None
+    seen = set()
+    emitted = False
+    list_items = []  # запасной вариант — нужен, только пока не нашлось ни одной пары
+
+    for event, value in parsers.stream(chunks, backend):
+        if event == "li":
+            if not emitted:
+                list_items.append(value)
             continue
-        key = (
-            item.get("subject"),
-            item.get("pair"),
-            item.get("time"),
-            item.get("room"),
-            item.get("kind"),
-            item.get("teacher"),
-        )
+        row, date_match, pair, subject_cell = classify_row(value)
+        if row is ROW_DATE:
+            day = parse_day(date_match)
+        if pair is None or day is None:
+            continue
+        lesson = parse_lesson(pair, subject_cell, day)
+        key = _key_digest(lesson.key())
         if key in seen:
             continue
         seen.add(key)
-        cleaned.append(item)
+        emitted = True
+        list_items.clear()
+        yield lesson
 
-    return cleaned
+    if not emitted:
+        for txt in list_items:
+            lesson = parse_list_item(txt)
+            if lesson is None:
+                continue
+            key = _key_digest(lesson.key())
+            if key in seen:
+                continue
+            seen.add(key)
+            yield lesson
 
-def schedule_hash(items: list[dict]) -> str:
-    # Хэшируем только существенные поля
+def schedule_hash(items: list) -> str:
+    # Хэшируем только существенные поля (как в v1: subject с датой),
+    # чтобы хэш не менялся при смене формата хранения.
     # Важно хэшировать уже очищенный и дедуплицированный список
-    norm = [(i.get("pair"), i.get("time"), i.get("subject"), i.get("room"), i.get("kind")) for i in items]
+    norm = []
+    for i in items:
+        if isinstance(i, Lesson):
+            norm.append((i.pair, i.time, i.legacy_subject, i.room, i.kind))
+        else:
+            norm.append((i.get("pair"), i.get("time"), i.get("subject"), i.get("room"), i.get("kind")))
     blob = repr(norm).encode("utf-8")
     return hashlib.sha256(blob).hexdigest()
 
-def scrape_group(url: str = GROUP_PAGE_URL) -> tuple[list[dict], str]:
-    html = fetch_html(url)
-    items = normalize_schedule(html)
+def parse_page(page: dict) -> tuple[list[Lesson], str]:
+    if "chunks" in page:
+        # Потоковая загрузка: разбираем по мере чтения, без DOM и без html целиком
+        items = list(iter_schedule(page["chunks"]))
+    elif parse_pool.enabled():
+        items = parse_pool.parse(page_html(page))
+    else:
+        items = parse_schedule(page_html(page))
     return items, schedule_hash(items)
+
+def scrape_group(url: str = GROUP_PAGE_URL, stream: bool = False) -> tuple[list[Lesson], str]:
+    return parse_page(fetch_page_stream(url) if stream else fetch_page(url))
@@ -0,0 +1,118 @@
+# backend/settings.py
+import os
+
+# Группа по умолчанию (API, бот, веб-интерфейс)
+GROUP_CODE = os.getenv("GROUP_CODE", "cg389")
+GROUP_PAGE_URL = os.getenv("GROUP_PAGE_URL", "https://biik.ru/rasp/cg389.htm")
+# Шаблон адреса для групп, перечисленных в GROUPS только кодом
+GROUP_URL_TEMPLATE = os.getenv("GROUP_URL_TEMPLATE", "https://biik.ru/rasp/{code}.htm")
+
+def parse_groups(raw: str) -> dict[str, str]:
+    """
+    Разбирает реестр групп из строки вида
+    "cg389=https://biik.ru/rasp/cg389.htm,cg390" -> {код: адрес страницы}
+    """
+    groups = {}
+    for part in raw.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        code, _, url = part.partition('=')
+        code = code.strip()
+        groups[code] = url.strip() or GROUP_URL_TEMPLATE.format(code=code)
+    return groups
+
+# Реестр отслеживаемых групп: код -> адрес страницы
+GROUPS = parse_groups(os.getenv("GROUPS", "")) or {GROUP_CODE: GROUP_PAGE_URL}
+
+# Сколько страниц скачиваем одновременно
+SCRAPE_CONCURRENCY = int(os.getenv("SCRAPE_CONCURRENCY", "8"))
+
+# HTTP-клиент скрапера
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "20"))
+# Не больше стольких соединений к одному хосту (лишние запросы ждут свободное)
+HTTP_POOL_PER_HOST = int(os.getenv("HTTP_POOL_PER_HOST", "4"))
+# Сколько секунд ждать свободное соединение пула, прежде чем считать загрузку неудачной
+HTTP_POOL_TIMEOUT = float(os.getenv("HTTP_POOL_TIMEOUT", "30"))
+# Повторы на 5xx и таймаутах: экспоненциальная пауза backoff * 2^n плюс случайный jitter
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "3"))
+HTTP_BACKOFF = float(os.getenv("HTTP_BACKOFF", "0.5"))
+HTTP_BACKOFF_JITTER = float(os.getenv("HTTP_BACKOFF_JITTER", "0.5"))
+# Retry-After сервера учитываем, но ждём не дольше стольких секунд
+HTTP_RETRY_AFTER_MAX = float(os.getenv("HTTP_RETRY_AFTER_MAX", "30"))
+
+# Бэкенд разбора HTML: html.parser (BeautifulSoup, по умолчанию) или lxml (libxml2, на C)
+PARSER_BACKEND = os.getenv("PARSER_BACKEND", "html.parser")
+
+# Потоковый разбор: страница читается кусками и разбирается без построения DOM
+SCRAPE_STREAMING = os.getenv("SCRAPE_STREAMING", "0") == "1"
+STREAM_CHUNK_SIZE = int(os.getenv("STREAM_CHUNK_SIZE", "65536"))
+
+# Разбор страниц в отдельных процессах (0 — в потоке загрузки, как раньше)
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", "0"))
+
+# Хранилище. SQLite: WAL, synchronous=NORMAL, кэш страниц, ожидание блокировки, mmap
+SQLITE_TUNED = os.getenv("SQLITE_TUNED", "1") == "1"
+SQLITE_CACHE_MB = int(os.getenv("SQLITE_CACHE_MB", "32"))
+SQLITE_MMAP_MB = int(os.getenv("SQLITE_MMAP_MB", "128"))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+# Пул соединений: потоки обхода групп плюс обработчики API и бота
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", str(SCRAPE_CONCURRENCY + 4)))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "8"))
+
+# Хранение payload версий: blob — сжатый блоб по хэшу содержимого (одинаковые версии
+# хранятся один раз), delta — только изменения к предыдущей версии группы (тоже в блобах),
+# inline — JSON прямо в ScheduleVersion, как раньше
+PAYLOAD_STORAGE = os.getenv("PAYLOAD_STORAGE", "blob")
+# В режиме delta полная копия пишется не реже чем раз в столько версий группы
+DELTA_SNAPSHOT_EVERY = int(os.getenv("DELTA_SNAPSHOT_EVERY", "20"))
+
+# Кэш разобранных версий (cache.py; через него же восстанавливаются цепочки дельт):
+# сколько версий держать в LRU и как часто сверять последнюю версию группы с БД
+# (её мог записать другой процесс), секунд
+VERSION_CACHE_SIZE = int(os.getenv("VERSION_CACHE_SIZE", "32"))
+LATEST_CACHE_TTL = float(os.getenv("LATEST_CACHE_TTL", "30"))
+
+# HTTP API (http_cache.py): сколько готовых тел ответов (по ETag и кодировке) держать
+# в памяти и с какого размера, байт, сжимать JSON
+HTTP_BODY_CACHE_SIZE = int(os.getenv("HTTP_BODY_CACHE_SIZE", "128"))
+HTTP_COMPRESS_MIN = int(os.getenv("HTTP_COMPRESS_MIN", "512"))
+
+# Уведомления веб-клиентов о новых версиях (events.py, SSE): пинг соединений, секунд;
+# очередь кадров на клиента; предел одновременных подписчиков на процесс
+SSE_PING_SECONDS = float(os.getenv("SSE_PING_SECONDS", "15"))
+SSE_QUEUE_SIZE = int(os.getenv("SSE_QUEUE_SIZE", "8"))
+SSE_MAX_CLIENTS = int(os.getenv("SSE_MAX_CLIENTS", "10000"))
+
+# Опрос страниц (polling.py): интервал каждой группы подстраивается под её историю
+# изменений (ScheduleVersion.created_at) в пределах [MIN, MAX] минут
+TIMEZONE = os.getenv("TZ", "Asia/Irkutsk")
+POLL_MIN_MINUTES = float(os.getenv("POLL_MIN_MINUTES", "5"))
+POLL_MAX_MINUTES = float(os.getenv("POLL_MAX_MINUTES", "120"))
+# Интервал группы без истории (как прежний фиксированный) и группы, которая в среднем
+# меняется раз в POLL_REFERENCE_GAP_HOURS; у прочих он растёт как корень из среднего промежутка
+POLL_BASE_MINUTES = float(os.getenv("POLL_BASE_MINUTES", "20"))
+POLL_REFERENCE_GAP_HOURS = float(os.getenv("POLL_REFERENCE_GAP_HOURS", "48"))
+# После изменения правки часто идут сериями: столько часов опрашиваем с минимальным интервалом
+POLL_RECENT_HOURS = float(os.getenv("POLL_RECENT_HOURS", "3"))
+# Рабочие часы колледжа (местное время, "с-до"); вне их интервал умножается на множитель
+POLL_WORK_HOURS = os.getenv("POLL_WORK_HOURS", "7-21")
+POLL_OFF_HOURS_FACTOR = float(os.getenv("POLL_OFF_HOURS_FACTOR", "6"))
+# Случайный разброс интервала (доля), чтобы проверки групп не совпадали по времени
+POLL_JITTER = float(os.getenv("POLL_JITTER", "0.15"))
+# Как часто планировщик ищет группы, которым пора; обязательные проверки всех групп (чч:мм)
+POLL_TICK_SECONDS = float(os.getenv("POLL_TICK_SECONDS", "30"))
+POLL_CHECKPOINTS = os.getenv("POLL_CHECKPOINTS", "06:30,18:30")
+# Сколько последних версий группы учитывать
+POLL_HISTORY = int(os.getenv("POLL_HISTORY", "20"))
+
+# Несколько реплик: очередь опроса в БД с арендой групп (db.ScrapeJob), чтобы каждую
+# группу за тик проверяла одна реплика. Аренда продлевается, пока проверка идёт;
+# реплика, пропавшая без продления, теряет её через SCRAPE_LEASE_SECONDS
+SCRAPE_LEASES = os.getenv("SCRAPE_LEASES", "0") == "1"
+SCRAPE_LEASE_SECONDS = float(os.getenv("SCRAPE_LEASE_SECONDS", "300"))
+# Сколько групп реплика берёт за один тик
+SCRAPE_CLAIM_LIMIT = int(os.getenv("SCRAPE_CLAIM_LIMIT", "32"))
+# Имя реплики в аренде; по умолчанию хост и pid
+WORKER_ID = os.getenv("WORKER_ID", "")
@@ -5,11 +5,28 @@ class ScheduleApp {
     }
 
     init() {
+        this.group = document.body.dataset.group || 'cg389';
         this.setupTelegramTheme();
         this.loadSchedule();
         this.setupEventListeners();
     }
 
+    subscribeUpdates(afterId) {
+        // Сервер сам сообщает о новой версии; EventSource переподключается после обрыва.
+        // after — показанная версия: вышедшую после неё сервер пришлёт сразу
+        if (!window.EventSource || this.source) {
+            return;
+        }
+        const query = afterId ? `?after=${afterId}` : '';
+        const source = new EventSource(`/api/groups/${encodeURIComponent(this.group)}/events${query}`);
+        this.source = source;
+        source.addEventListener('version', (event) => {
+            const update = JSON.parse(event.data);
+            console.log('Новая версия расписания:', update.version_id);
+            this.loadSchedule();
+        });
+    }
+
     setupTelegramTheme() {
         // Проверяем, запущено ли приложение в Telegram
         if (window.Telegram && window.Telegram.WebApp) {
@@ -32,106 +49,49 @@ class ScheduleApp {
         try {
             this.showLoading();
             
-            // Добавляем логирование для отладки
-            console.log('Загружаем расписание...');
-            
-            const response = await fetch('/api/versions');
+            // Одним запросом: версия и занятия, уже сгруппированные по дням
+            const response = await fetch(`/api/groups/${encodeURIComponent(this.group)}/latest`);
             console.log('Response status:', response.status);
             
+            if (response.status === 404) {
+                this.showEmptyState();
+                this.subscribeUpdates();
+                return;
+            }
             if (!response.ok) {
                 throw new Error(`HTTP error! status: ${response.status}`);
             }
             
-            const versions = await response.json();
-            console.log('Получены версии:', versions);
-            
-            if (versions.length > 0) {
-                // Ищем версию с данными (не пустую)
-                let versionToUse = null;
-                for (let i = 0; i < versions.length; i++) {
-                    const version = versions[i];
-                    console.log(`Проверяем версию ${version.id}:`, version);
-                    
-                    // Проверяем, есть ли данные в этой версии
-                    const scheduleResponse = await fetch(`/api/schedule/${version.id}`);
-                    if (scheduleResponse.ok) {
-                        const scheduleData = await scheduleResponse.json();
-                        if (scheduleData && scheduleData.length > 0) {
-                            versionToUse = version;
-                            console.log('Найдена версия с данными:', versionToUse);
-                            this.renderSchedule(scheduleData, version.week_start);
-                            break;
-                        }
-                    }
-                }
-                
-                if (!versionToUse) {
-                    this.showEmptyState();
-                }
-            } else {
-                this.showEmptyState();
-            }
+            const latest = await response.json();
+            console.log('Получена версия:', latest.id, latest.week);
+            this.renderDays(latest.days);
+            this.subscribeUpdates(latest.id);
         } catch (error) {
             console.error('Error loading schedule:', error);
             this.showError(`Ошибка загрузки расписания: ${error.message}`);
+            this.subscribeUpdates();
         }
     }
 
-    renderSchedule(scheduleData, weekStart) {
+    renderDays(days) {
         const container = document.querySelector('.schedule-container');
         container.innerHTML = '';
 
-        // Группируем занятия по дням
-        const days = this.groupByDays(scheduleData);
-        
-        if (Object.keys(days).length === 0) {
+        if (!days || days.length === 0) {
             this.showEmptyState();
             return;
         }
 
-        // Сортируем дни по дате
-        const sortedDays = Object.keys(days).sort((a, b) => {
-            const dateA = this.parseDate(a);
-            const dateB = this.parseDate(b);
-            return dateA - dateB;
-        });
-
-        sortedDays.forEach(dateStr => {
-            const dayCard = this.createDayCard(dateStr, days[dateStr]);
+        // Дни приходят по порядку, пары внутри дня — по номеру
+        days.forEach(day => {
+            const [year, month, dayNum] = day.date.split('-');
+            const dayCard = this.createDayCard(`${dayNum}.${month}.${year}`, day.lessons);
             container.appendChild(dayCard);
         });
 
         this.hideLoading();
     }
 
-        groupByDays(scheduleData) {
-        const days = {};
-        
-        scheduleData.forEach(item => {
-            const subject = item.subject || '';
-            const dateMatch = subject.match(/(\d{2}\.\d{2}\.\d{4})/);
-            
-            if (dateMatch) {
-                const dateStr = dateMatch[1];
-                if (!days[dateStr]) {
-                    days[dateStr] = [];
-                }
-                days[dateStr].push(item);
-            }
-        });
-        
-        // Сортируем пары внутри каждого дня по номеру пары
-        Object.keys(days).forEach(dateStr => {
-            days[dateStr].sort((a, b) => {
-                const pairA = a.pair || 0;
-                const pairB = b.pair || 0;
-                return pairA - pairB;
-            });
-        });
-        
-        return days;
-    }
-
     createDayCard(dateStr, lessons) {
         const dayCard = document.createElement('div');
         dayCard.className = 'day-card';
@@ -1,4 +1,4 @@
-import os, asyncio, re, json, shutil
+import os, sys, asyncio, re, json, shutil, time
 from types import SimpleNamespace
 
 
@@ -7,13 +7,44 @@ def setup_test_db():
     os.makedirs('./data', exist_ok=True)
     os.environ['DATABASE_URL'] = 'sqlite:///./data/test_schedule.db'
     # Чистим предыдущий файл БД, если был
+    # Кэш версий из прошлой БД не должен пережить её пересоздание
+    if 'cache' in sys.modules:
+        sys.modules['cache'].clear()
     try:
-        if os.path.exists('./data/test_schedule.db'):
-            os.remove('./data/test_schedule.db')
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists('./data/test_schedule.db' + suffix):
+                os.remove('./data/test_schedule.db' + suffix)
     except Exception:
         pass
 
 
+def use_test_db():
+    # Тестовую БД подключаем до первого импорта db (engine создаётся при импорте)
+    if 'db' not in sys.modules:
+        setup_test_db()
+    from db import init_db
+    init_db()
+
+
+SAMPLE_HTML = '''
+    <table>
+      <tr><th>29.09.2025 Пн-1</th><th>1</th><th>ОС (Лек) 301 Белоусова М.В.</th></tr>
+      <tr><td> </td><td>2</td><td>ФЛП (Практич.) 319 Елтунова И.Б.</td></tr>
+      <tr><td> </td><td>5</td><td>ТСВПС (Практич.) 308 Извеков Я.О.</td></tr>
+      <tr><td>30.09.2025 Вт-1</td><td>2</td><td>ОС (Лаб) 308 Семёнов В.А.</td></tr>
+      <tr><td>3</td><td>МДК 01.01 (Пр) ЦМИТ Протасов А.Е.</td></tr>
+    </table>
+'''
+
+
+def fake_page(html, etag=None, not_modified=False):
+    import hashlib
+    content = b"" if not_modified else html.encode('utf-8')
+    return {"not_modified": not_modified, "content": content,
+            "raw_hash": None if not_modified else hashlib.sha256(content).hexdigest(),
+            "etag": etag, "last_modified": None}
+
+
 def test_scraper_no_duplicates():
     # Минимальный HTML, имитирующий структуру страницы
     html = '''
@@ -76,13 +107,1108 @@ async def test_group_rate_limit():
     assert dm_allowed, 'В личке запросы не должны ограничиваться'
 
 
+def test_rate_limit_atomic():
+    # Одновременные запросы не проходят сверх лимита; выбравших лимит отсекает кэш без БД
+    use_test_db()
+    from concurrent.futures import ThreadPoolExecutor
+    import db, notifier
+    with ThreadPoolExecutor(8) as pool:
+        results = list(pool.map(lambda _: db.consume_user_daily_limit(-100013, 1, '2025-09-29', 3), range(16)))
+    assert sorted(r for r in results if r is not None) == [1, 2, 3], results
+    assert db.get_user_daily_count(-100013, 1, '2025-09-29') == 3
+
+    message = SimpleNamespace(chat=SimpleNamespace(id=-100013, type='group'), from_user=SimpleNamespace(id=2))
+    calls = []
+    orig = db.consume_user_daily_limit_async
+    async def counting(*args):
+        calls.append(args)
+        return await orig(*args)
+    db.consume_user_daily_limit_async = counting
+    try:
+        allowed = [asyncio.run(notifier._check_and_increment_limit(message, limit=2)) for _ in range(5)]
+    finally:
+        db.consume_user_daily_limit_async = orig
+    assert allowed == [True, True, False, False, False], allowed
+    assert len(calls) == 2, calls
+
+
+def test_lesson_payload_formats():
+    # Записи v2 с явной датой; старые payload v1 читаются в те же записи
+    from datetime import date
+    from lessons import dump_payload, load_payload
+    from scraper import normalize_schedule, parse_schedule, schedule_hash
+    lessons = parse_schedule(SAMPLE_HTML)
+    first = lessons[0]
+    assert (first.date, first.weekday, first.week_no, first.pair) == (date(2025, 9, 29), 'Пн', 1, 1)
+    assert (first.start, first.end, first.subject, first.kind) == ('08:30', '10:00', 'ОС (Лек)', 'Лекция')
+    assert (first.room, first.teacher) == ('301', 'Белоусова М.В.')
+    assert not hasattr(first, '__dict__')
+
+    legacy = normalize_schedule(SAMPLE_HTML)
+    assert load_payload(json.dumps(legacy, ensure_ascii=False)) == lessons
+    assert load_payload(dump_payload(lessons)) == lessons
+    assert len(dump_payload(lessons)) < len(json.dumps(legacy, ensure_ascii=False))
+    # Хэш не меняется при смене формата — иначе после обновления была бы ложная «новая версия»
+    assert schedule_hash(lessons) == schedule_hash(legacy)
+
+
+def test_lesson_rows_by_date():
+    # Выборки по дате идут по строкам LessonRow; по умолчанию — последняя версия группы
+    use_test_db()
+    from datetime import date
+    from sqlmodel import Session
+    import app, cache, db, messages
+    from scraper import normalize_schedule, parse_schedule
+    lessons = parse_schedule(SAMPLE_HTML)
+    first = db.save_version("t011", "2025-09-29", "h1", lessons)
+    assert db.lesson_dates("t011") == [date(2025, 9, 29), date(2025, 9, 30)]
+    assert db.lessons_on_date("t011", date(2025, 9, 30)) == [l for l in lessons if l.date == date(2025, 9, 30)]
+    assert db.lessons_in_range("t011", date(2025, 9, 1), date(2025, 9, 29)) == lessons[:3]
+    assert db.lessons_on_date("t011", date(2025, 10, 1)) == []
+
+    # Новая версия заменяет старую в выборках по умолчанию; строки прежней остаются под её id
+    ver = db.save_version("t011", "2025-09-29", "h2", lessons[:1])
+    assert db.lesson_dates("t011") == [date(2025, 9, 29)]
+    assert db.lessons_on_date("t011", date(2025, 9, 29)) == lessons[:1]
+    assert db.lesson_dates("t011", first.id) == [date(2025, 9, 29), date(2025, 9, 30)]
+    assert db.lessons_on_date("t011", date(2025, 9, 30), first.id) == [l for l in lessons if l.date == date(2025, 9, 30)]
+
+    # Бот при холодном кэше берёт даты и один день из строк, версия догружается в фоне
+    cache.clear()
+
+    async def cold_bot():
+        try:
+            view = await cache.day_async("t011", date(2025, 9, 28), nearest=True)
+            assert view.dates == [date(2025, 9, 29)]
+            assert view.day_texts == {date(2025, 9, 29): messages.render_lessons(lessons[:1])}
+            assert date(2025, 9, 30) not in (await cache.day_async("t011", date(2025, 9, 30))).day_texts
+            assert await cache.day_async("t011-none", date(2025, 9, 29)) is None
+            for _ in range(200):
+                if "t011" not in cache._warming:
+                    break
+                await asyncio.sleep(0.01)
+            assert (await cache.day_async("t011", date(2025, 9, 29))).id == ver.id
+        finally:
+            await db.dispose_async_engine()
+    asyncio.run(cold_bot())
+
+    # API: диапазон дат версии, которой нет в памяти, — из строк, без загрузки версии
+    cache.clear()
+    part = app.api_schedule(fake_request(), first.id, "2025-09-30", None)
+    assert json.loads(part.body) == [l.to_legacy() for l in lessons if l.date == date(2025, 9, 30)]
+    assert cache.peek(first.id) is None
+
+    # Версия, записанная до появления таблицы (payload v1, без строк), раскладывается в init_db
+    with Session(db.engine) as s:
+        old = db.ScheduleVersion(group_code="t011-old", week_start="2025-09-29", hash="h",
+                                 payload=json.dumps(normalize_schedule(SAMPLE_HTML), ensure_ascii=False))
+        s.add(old); s.commit()
+    assert db.lesson_dates("t011-old") == []
+    db.init_db()
+    assert db.lessons_in_range("t011-old", date.min, date.max) == lessons
+    assert db.lessons_on_date("t011", date(2025, 9, 29), ver.id) == lessons[:1]
+
+
+def test_sqlite_profile_and_async():
+    # Соединения получают прагмы профиля; асинхронные выборки совпадают с синхронными
+    use_test_db()
+    from datetime import date
+    from sqlalchemy import text
+    import db
+    from scraper import parse_schedule
+    with db.engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert conn.execute(text("PRAGMA synchronous")).scalar() == 1
+    lessons = parse_schedule(SAMPLE_HTML)
+    db.save_version("t014", "2025-09-29", "h", lessons)
+
+    async def scenario():
+        try:
+            assert db.get_async_engine() is not None
+            day = date(2025, 9, 29)
+            assert await db.lessons_on_date_async("t014", day) == db.lessons_on_date("t014", day)
+            assert await db.lesson_dates_async("t014") == db.lesson_dates("t014")
+            assert [v.id for v in await db.list_versions_async("t014", 5)] == [v.id for v in db.list_versions("t014", 5)]
+            counts = await asyncio.gather(*(db.consume_user_daily_limit_async(-100014, 1, '2025-09-29', 3)
+                                            for _ in range(6)))
+            assert sorted(c for c in counts if c is not None) == [1, 2, 3], counts
+        finally:
+            await db.dispose_async_engine()
+    asyncio.run(scenario())
+
+
+def test_payload_blobs():
+    # Одинаковые payload хранятся одним сжатым блобом; чтение распаковывает прозрачно
+    use_test_db()
+    from sqlmodel import Session, select
+    import db
+    from scraper import normalize_schedule, parse_schedule
+    lessons = parse_schedule(SAMPLE_HTML)
+    first = db.save_version("t015", "2025-09-29", "h1", lessons)
+    db.save_version("t015", "2025-09-29", "h2", lessons[:2])
+    reverted = db.save_version("t015", "2025-09-29", "h1", lessons)
+    assert first.blob_hash == reverted.blob_hash and not first.payload
+    with Session(db.engine) as s:
+        blob = s.get(db.PayloadBlob, first.blob_hash)
+        assert len(blob.data) < blob.size
+        assert len(s.exec(select(db.PayloadBlob.hash).where(
+            db.PayloadBlob.hash.in_([first.blob_hash, reverted.blob_hash]))).all()) == 1
+    assert db.version_lessons(first) == lessons
+    assert db.version_lessons(reverted) == lessons
+
+    # Версия со старым payload прямо в строке переносится в блоб
+    with Session(db.engine) as s:
+        old = db.ScheduleVersion(group_code="t015-old", week_start="2025-09-29", hash="h",
+                                 payload=json.dumps(normalize_schedule(SAMPLE_HTML), ensure_ascii=False))
+        s.add(old); s.commit(); s.refresh(old)
+    db.init_db()
+    old = db.list_versions("t015-old", 1)[0]
+    assert old.blob_hash == first.blob_hash and not old.payload
+    assert db.version_lessons(old) == lessons
+
+    # Переносить нечего: одна выборка по частичному индексу, без VACUUM
+    from sqlalchemy import event, text
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+    event.listen(db.engine, "before_cursor_execute", record)
+    try:
+        db.migrate_payloads_to_blobs()
+    finally:
+        event.remove(db.engine, "before_cursor_execute", record)
+    assert len(statements) == 1 and "VACUUM" not in statements[0], statements
+    with db.engine.connect() as conn:
+        conn.execute(text("SELECT 1 FROM scheduleversion LIMIT 1")).fetchall()
+        plan = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statements[0], (1, 0)).fetchall()
+    assert "ix_scheduleversion_inline" in str(plan), plan
+
+
+def test_payload_deltas():
+    # Режим delta: версии — изменения к предыдущей, полная копия раз в DELTA_SNAPSHOT_EVERY
+    use_test_db()
+    from lessons import Lesson
+    import cache, db
+    from scraper import parse_schedule
+    base = parse_schedule(SAMPLE_HTML + SAMPLE_HTML.replace('29.09.2025', '06.10.2025'))
+    history = []
+    for n in range(7):
+        lessons = [Lesson.from_row(l.to_row()) for l in base]
+        lessons[n].room = f"R{n}"
+        history.append(lessons if n % 3 else lessons[:-1])
+    orig = db.PAYLOAD_STORAGE, db.DELTA_SNAPSHOT_EVERY
+    db.PAYLOAD_STORAGE, db.DELTA_SNAPSHOT_EVERY = "delta", 3
+    try:
+        versions = [db.save_version("t016", "2025-09-29", f"h{n}", lessons) for n, lessons in enumerate(history)]
+        reverted = db.save_version("t016", "2025-09-29", "h0", history[0])
+    finally:
+        db.PAYLOAD_STORAGE, db.DELTA_SNAPSHOT_EVERY = orig
+    parents = [v.parent_id for v in versions]
+    ids = [v.id for v in versions]
+    assert parents == [None, ids[0], ids[1], None, ids[3], ids[4], None], parents
+    # Откат к payload, уже лежащему полной копией, — ссылка на тот же блоб
+    assert reverted.parent_id is None and reverted.blob_hash == versions[0].blob_hash
+
+    # Цепочка восстанавливается через LRU версий cache.py: родитель разбирается один раз
+    cache.clear()
+    for ver, lessons in zip(versions, history):
+        assert db.version_lessons_by_id(ver.id) == lessons, ver.id
+    misses = cache.CACHE_STATS["misses"]
+    assert db.version_lessons_by_id(versions[5].id) == history[5]
+    assert cache.CACHE_STATS["misses"] == misses
+    assert db.version_lessons_by_id(10 ** 9) is None
+    assert len(db._blob_text(versions[1].blob_hash)) * 2 < len(db._blob_text(versions[0].blob_hash))
+
+
+def test_index_migration():
+    # Старый файл БД без индексов доводится до схемы, задвоенные счётчики сливаются
+    use_test_db()
+    from sqlalchemy import inspect, text
+    import db
+    with db.engine.begin() as conn:
+        for name in ("ix_scheduleversion_group_week_created", "ix_scheduleversion_group_created",
+                     "ux_userdailyusage_chat_user_date"):
+            conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+        conn.execute(text("INSERT INTO userdailyusage (chat_id, user_id, date_ymd, count, updated_at) "
+                          "VALUES (1, 2, '2025-09-29', 1, '2025-09-29'), (1, 2, '2025-09-29', 2, '2025-09-29')"))
+    db.init_db()
+    names = {i["name"] for i in inspect(db.engine).get_indexes("scheduleversion")}
+    assert {"ix_scheduleversion_group_week_created", "ix_scheduleversion_group_created"} <= names, names
+    assert db.get_user_daily_count(1, 2, '2025-09-29') == 3
+    with db.engine.connect() as conn:
+        # EXPLAIN не сверяет версию схемы: соединение из пула могло загрузить её между
+        # DROP и пересозданием индекса. Обычное чтение перечитывает схему
+        conn.execute(text("SELECT 1 FROM scheduleversion LIMIT 1")).fetchall()
+        plan = conn.execute(text("EXPLAIN QUERY PLAN SELECT * FROM scheduleversion WHERE group_code = 'a' "
+                                 "AND week_start = 'b' ORDER BY created_at DESC")).fetchall()
+        assert "ix_scheduleversion_group_week_created" in str(plan), plan
+        try:
+            conn.execute(text("INSERT INTO userdailyusage (chat_id, user_id, date_ymd, count, updated_at) "
+                              "VALUES (1, 2, '2025-09-29', 1, '2025-09-29')"))
+            assert False, "Уникальный индекс счётчиков не создан"
+        except Exception as e:
+            assert "UNIQUE" in str(e), e
+
+
+def test_parser_backends_identical():
+    # Все бэкенды разбора дают один и тот же результат
+    import parsers
+    from scraper import normalize_schedule
+    reference = normalize_schedule(SAMPLE_HTML, "html.parser")
+    assert reference
+    for name in parsers.BACKENDS:
+        assert normalize_schedule(SAMPLE_HTML, name) == reference, name
+
+
+def test_encoding_fast_path():
+    # Кодировка берётся из объявлений и кэша хоста; определение по телу — запасной путь
+    import http_client, scraper
+    body = SAMPLE_HTML.replace('<table>', "<meta charset='windows-1251'><table>")
+    before = dict(scraper.ENCODING_STATS)
+    page = {"content": body.encode('cp1251'), "url": "http://enc.test/a.htm", "content_type": "text/html"}
+    assert scraper.page_html(page) == body
+    page = {"content": SAMPLE_HTML.encode('cp1251'), "url": "http://enc.test/b.htm", "content_type": None}
+    assert scraper.page_html(page) == SAMPLE_HTML
+    page = {"content": SAMPLE_HTML.encode('cp1251'), "url": "http://other.test/c.htm",
+            "content_type": "text/html; charset=utf-8"}
+    assert scraper.page_html(page) == SAMPLE_HTML
+    delta = {k: scraper.ENCODING_STATS[k] - before[k] for k in before}
+    assert delta == {"header": 0, "meta": 1, "cache": 1, "detect": 1}, delta
+
+    # Хост с кэшированной cp1251 перешёл на UTF-8 без объявления: строгий UTF-8 раньше cp1251
+    page = {"content": SAMPLE_HTML.encode('utf-8'), "url": "http://enc.test/d.htm", "content_type": None}
+    assert scraper.page_html(page) == SAMPLE_HTML
+    assert scraper._host_encodings["enc.test"] == "utf-8"
+    scraper._host_encodings["enc.test"] = "windows-1251"
+    response = SimpleNamespace(
+        status_code=200, headers={}, raise_for_status=lambda: None, close=lambda: None,
+        iter_content=lambda size: iter([SAMPLE_HTML.encode('utf-8')[:101], SAMPLE_HTML.encode('utf-8')[101:]]))
+    orig = http_client.get
+    http_client.get = lambda url, headers=None, stream=False: response
+    try:
+        assert "".join(scraper.fetch_page_stream("http://enc.test/e.htm")["chunks"]) == SAMPLE_HTML
+    finally:
+        http_client.get = orig
+    assert scraper._host_encodings["enc.test"] == "utf-8"
+    # А настоящая cp1251 по-прежнему берётся из кэша
+    scraper._host_encodings["enc.test"] = "windows-1251"
+    before = dict(scraper.ENCODING_STATS)
+    page = {"content": SAMPLE_HTML.encode('cp1251'), "url": "http://enc.test/f.htm", "content_type": None}
+    assert scraper.page_html(page) == SAMPLE_HTML
+    assert scraper.ENCODING_STATS["cache"] == before["cache"] + 1
+    assert scraper._host_encodings["enc.test"] == "windows-1251"
+
+
+def test_streaming_parse_matches_dom():
+    # Потоковый разбор даёт то же, что и разбор целого документа, при любой нарезке
+    import hashlib
+    import http_client, parsers, scraper
+    html = SAMPLE_HTML + SAMPLE_HTML.replace('29.09.2025', '06.10.2025')
+    reference = scraper.parse_schedule(html)
+    for name in parsers.STREAM_BACKENDS:
+        for size in (1, 13, len(html)):
+            chunks = [html[i:i + size] for i in range(0, len(html), size)]
+            assert list(scraper.iter_schedule(chunks, name)) == reference, (name, size)
+        # Пустое тело ответа — ни одного куска — разбирается в пустое расписание, как и DOM
+        assert list(scraper.iter_schedule([], name)) == scraper.parse_schedule("", name) == [], name
+
+    body = ("<meta charset='windows-1251'>" + html).encode('cp1251')
+    response = SimpleNamespace(
+        status_code=200, headers={"ETag": '"s"'}, raise_for_status=lambda: None, close=lambda: None,
+        iter_content=lambda size: (body[i:i + 100] for i in range(0, len(body), 100)))
+    orig = http_client.get
+    http_client.get = lambda url, headers=None, stream=False: response
+    try:
+        page = scraper.fetch_page_stream("http://stream.test/a.htm")
+        items, h = scraper.parse_page(page)
+    finally:
+        http_client.get = orig
+    assert items == reference and h == scraper.schedule_hash(reference)
+    assert page["raw_hash"] == hashlib.sha256(body).hexdigest()
+
+
+def test_parse_pool_roundtrip():
+    # Разбор в пуле процессов возвращает те же записи, что и в своём процессе
+    import parse_pool
+    from scraper import parse_schedule
+    html = SAMPLE_HTML + "<ul><li>10:00-11.30 Консультация</li></ul>"
+    orig = parse_pool.PARSE_WORKERS
+    parse_pool.PARSE_WORKERS = 1
+    try:
+        assert parse_pool.parse(html) == parse_schedule(html)
+        assert parse_pool.parse("<ul><li>10:00-11.30 Консультация</li></ul>") == \
+            parse_schedule("<ul><li>10:00-11.30 Консультация</li></ul>")
+    finally:
+        parse_pool.shutdown()
+        parse_pool.PARSE_WORKERS = orig
+
+
+def test_scrape_all_concurrent():
+    # Страницы групп скачиваются параллельно: обход длится как самая медленная страница
+    use_test_db()
+    import diff
+    from engine import scrape_all
+
+    def slow_fetch(url, etag=None, last_modified=None):
+        time.sleep(0.3)
+        return fake_page(SAMPLE_HTML)
+
+    orig = diff.fetch_page
+    diff.fetch_page = slow_fetch
+    try:
+        groups = {f"t001-{n}": f"http://example.test/{n}.htm" for n in range(4)}
+        started = time.monotonic()
+        results = asyncio.run(scrape_all(groups, concurrency=4))
+        elapsed = time.monotonic() - started
+    finally:
+        diff.fetch_page = orig
+    assert set(results) == set(groups)
+    assert all(r and r['changed'] for r in results.values()), results
+    assert elapsed < 0.9, f"Обход шёл последовательно: {elapsed:.2f} c"
+
+    # concurrency больше SCRAPE_CONCURRENCY не упирается в размер пула потоков
+    import engine
+    count = engine.SCRAPE_CONCURRENCY * 3
+    diff.fetch_page = slow_fetch
+    try:
+        groups = {f"t001-wide-{n}": f"http://example.test/w{n}.htm" for n in range(count)}
+        started = time.monotonic()
+        results = asyncio.run(scrape_all(groups, concurrency=count))
+        elapsed = time.monotonic() - started
+    finally:
+        diff.fetch_page = orig
+    assert all(r and r['changed'] for r in results.values()), results
+    assert engine._executor_size >= count and elapsed < 0.8, f"Пул потоков ограничил параллельность: {elapsed:.2f} c"
+
+
+def test_run_job_single_flight():
+    # Одновременные запуски присоединяются к уже идущей проверке
+    import app
+    calls = []
+
+    async def fake_scrape_all(groups=None, concurrency=None):
+        calls.append(1)
+        await asyncio.sleep(0.2)
+        return {}
+
+    async def scenario():
+        await asyncio.gather(app.run_job(), app.run_job(), app.run_job())
+        await app.run_job()
+
+    orig = app.scrape_all
+    app.scrape_all = fake_scrape_all
+    before = dict(app.RUN_STATS)
+    try:
+        asyncio.run(scenario())
+    finally:
+        app.scrape_all = orig
+    assert len(calls) == 2, calls
+    assert app.RUN_STATS["coalesced"] - before["coalesced"] == 2
+    assert app.run_stats()["waiting"] == 0 and not app.run_stats()["in_progress"]
+
+
+def test_structural_diff():
+    # Изменения классифицируются по ключу (дата, пара) и сохраняются вместе с версией
+    from datetime import date
+    from lessons import Lesson
+    import diff
+    from scraper import parse_schedule
+    old = parse_schedule(SAMPLE_HTML)
+    new = [Lesson.from_row(l.to_row()) for l in old]
+    new[0].room = "302"                                   # правка аудитории
+    new[1].pair, new[1].date = 4, date(2025, 9, 30)       # перенос
+    removed = new.pop(2)                                  # удалено
+    new.append(Lesson(date(2025, 10, 1), "Ср", 1, 1, "08:30", "10:00", "Право (Зач)", "Зачет", "214", ""))
+    changes = diff.diff_lessons(old, new)
+    assert changes["changed"] == [{"date": "2025-09-29", "pair": 1, "subject": old[0].subject,
+                                   "fields": {"room": ["301", "302"]}}], changes
+    assert [(m["from"], m["to"]) for m in changes["moved"]] == [
+        ({"date": "2025-09-29", "pair": 2}, {"date": "2025-09-30", "pair": 4})]
+    assert [(r["date"], r["pair"], r["subject"]) for r in changes["removed"]] == [("2025-09-29", 5, removed.subject)]
+    assert [a["subject"] for a in changes["added"]] == ["Право (Зач)"]
+    assert diff.count_changes(diff.diff_lessons(old, old)) == 0
+    text = diff.format_changes(changes)
+    assert "ауд. 301 → 302" in text and "29.09 2 пара → 30.09 4 пара" in text, text
+    assert diff.format_changes(changes, limit=2).endswith("… и ещё 2")
+
+    use_test_db()
+    import db
+    responses = [fake_page(SAMPLE_HTML), fake_page(SAMPLE_HTML.replace("301", "302"))]
+    orig = diff.fetch_page
+    diff.fetch_page = lambda url, etag=None, last_modified=None: responses.pop(0)
+    try:
+        first = diff.check_and_store("t017", "http://example.test/t017.htm")
+        second = diff.check_and_store("t017", "http://example.test/t017.htm")
+    finally:
+        diff.fetch_page = orig
+    assert first["changes"] is None
+    assert [c["fields"] for c in second["changes"]["changed"]] == [{"room": ["301", "302"]}]
+    assert db.version_changes(db.list_versions("t017", 1)[0]) == second["changes"]
+
+
+def test_latest_version_cache():
+    # Чтения последней версии идут из памяти; save_version заменяет запись группы
+    use_test_db()
+    from datetime import date
+    import cache, db
+    from scraper import parse_schedule
+    lessons = parse_schedule(SAMPLE_HTML)
+    first = db.save_version("t018", "2025-09-29", "h1", lessons)
+    before = dict(cache.CACHE_STATS)
+    entry = cache.latest("t018")
+    assert entry.id == first.id and list(entry.lessons) == lessons
+    assert entry.on_date(date(2025, 9, 30)) == db.lessons_on_date("t018", date(2025, 9, 30))
+    assert entry.in_range(date(2025, 9, 1), date(2025, 9, 29)) == lessons[:3]
+
+    calls = []
+    orig = db.list_versions
+    db.list_versions = lambda *a: calls.append(a) or orig(*a)
+    try:
+        for _ in range(5):
+            assert cache.latest("t018") is entry
+        assert asyncio.run(cache.latest_async("t018")) is entry
+    finally:
+        db.list_versions = orig
+    assert calls == []
+    # save_version сам кладёт новую версию в кэш — промахов нет
+    assert cache.CACHE_STATS["hits"] - before["hits"] == 7
+    assert cache.CACHE_STATS["misses"] - before["misses"] == 0
+
+    second = db.save_version("t018", "2025-09-29", "h2", lessons[:2])
+    assert cache.latest("t018").id == second.id and len(cache.latest("t018").lessons) == 2
+    # Прежняя версия остаётся в LRU истории
+    assert cache.version(first.id) is entry
+    assert cache.version(10 ** 9) is None
+    assert "hit_ratio" in cache.stats()
+    # Тексты для бота готовы заранее только у последней версии; версия из истории,
+    # загруженная для API, рендерит их лишь при обращении
+    assert cache.latest("t018")._day_texts is not None
+    cache.clear()
+    old = cache.version(first.id)
+    assert old._day_texts is None
+    assert old.day_texts[date(2025, 9, 29)] and old._day_texts is not None
+
+
+def test_day_messages():
+    # Тексты дней готовятся при сохранении версии; обработчики только выбирают и склеивают
+    use_test_db()
+    from datetime import date
+    import cache, db, messages
+    from lessons import Lesson
+    lessons = [
+        Lesson(date(2025, 9, 29), "Пн", 1, 2, "10:10", "11:40", "ОС (Лаб)", "Лабораторная", "204", ""),
+        Lesson(date(2025, 9, 29), "Пн", 1, 1, "08:30", "10:00", "ФЛП (Практич.) Иванов", "", "", ""),
+        Lesson(date(2025, 10, 2), "Чт", 1, 3, "12:20", "13:50", "ОС (Лек)", "Лекция", "", "Семёнов В.А."),
+    ]
+    db.save_version("t019", "2025-09-29", "h1", lessons)
+    calls = []
+    orig = db.list_versions
+    db.list_versions = lambda *a: calls.append(a) or orig(*a)
+    try:
+        entry = cache.latest("t019")
+        day = messages.date_message(entry, date(2025, 9, 29), "http://x")
+        sched = messages.schedule_message(entry, date(2025, 9, 29), "сегодня", "http://x")
+        nearest = messages.schedule_message(entry, date(2025, 9, 30), "завтра", "http://x")
+        none_left = messages.schedule_message(entry, date(2025, 10, 3), "завтра", "http://x")
+    finally:
+        db.list_versions = orig
+    assert calls == []
+    # Пары по порядку, лабораторная не превращается в практику, преподаватель из названия
+    assert day.index("**1 пара** 08:30-10:00") < day.index("**2 пара** 10:10-11:40")
+    assert "*ОС* *(Лабораторная)* | 📍 *204*" in day
+    assert "*ФЛП* *(Практика)* | 👨‍🏫 *Иванов И.И.*" in day
+    assert day.startswith("📅 РАСПИСАНИЕ НА 29.09.2025\n🗓 ПОНЕДЕЛЬНИК")
+    # /schedule и /date показывают один и тот же блок пар
+    assert entry.day_texts[date(2025, 9, 29)] in day and entry.day_texts[date(2025, 9, 29)] in sched
+    assert sched.startswith("📅 РАСПИСАНИЕ НА СЕГОДНЯ (29.09.2025)")
+    assert "Ближайшее расписание: 02.10.2025 (ЧЕТВЕРГ)" in nearest and "Семёнов В.А." in nearest
+    assert "Доступные даты: 29.09.2025, 02.10.2025" in none_left
+    assert "Доступные даты" in messages.date_message(entry, date(2025, 9, 30), "http://x")
+
+
+def fake_request(**headers):
+    from starlette.requests import Request
+    return Request({"type": "http", "method": "GET", "path": "/",
+                    "headers": [(k.replace('_', '-').encode(), v.encode()) for k, v in headers.items()]})
+
+
+def test_api_http_caching():
+    # ETag по id версии: повтор с If-None-Match — 304 без сборки тела; тело сжимается один раз
+    use_test_db()
+    import gzip, json
+    import app, db, http_cache
+    from scraper import normalize_schedule, parse_schedule
+    http_cache.clear()
+    lessons = parse_schedule(SAMPLE_HTML) * 4
+    ver = db.save_version(app.GROUP_CODE, "2025-09-29", "h020", lessons)
+    r = app.api_schedule(fake_request(accept_encoding="gzip, deflate"), ver.id, None, None)
+    assert r.status_code == 200 and r.headers["content-encoding"] == "gzip"
+    assert "immutable" in r.headers["cache-control"] and r.headers["vary"] == "Accept-Encoding"
+    assert json.loads(gzip.decompress(r.body)) == [l.to_legacy() for l in lessons]
+
+    before = dict(http_cache.HTTP_STATS)
+    again = app.api_schedule(fake_request(accept_encoding="gzip"), ver.id, None, None)
+    assert again.body == r.body
+    plain = app.api_schedule(fake_request(), ver.id, None, None)
+    assert json.loads(plain.body) == json.loads(gzip.decompress(r.body))
+    for tag in (r.headers["etag"], plain.headers["etag"], "W/" + plain.headers["etag"]):
+        nm = app.api_schedule(fake_request(if_none_match=tag), ver.id, None, None)
+        assert nm.status_code == 304 and nm.headers["etag"] == tag.removeprefix("W/")
+    assert http_cache.HTTP_STATS["built"] == before["built"]
+    assert http_cache.HTTP_STATS["compressed"] == before["compressed"]
+    assert http_cache.HTTP_STATS["not_modified"] - before["not_modified"] == 3
+    # Счётчики меняются под замком: обработчики идут параллельно в пуле потоков
+    from concurrent.futures import ThreadPoolExecutor
+    count = http_cache.HTTP_STATS["not_modified"]
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(lambda _: app.api_schedule(fake_request(if_none_match=tag), ver.id, None, None),
+                      range(400)))
+    assert http_cache.HTTP_STATS["not_modified"] - count == 400
+    # Диапазон — отдельное тело со своим ETag
+    part = app.api_schedule(fake_request(), ver.id, "2025-09-30", None)
+    assert part.headers["etag"] != plain.headers["etag"] and len(json.loads(part.body)) == 4
+    # По умолчанию — прежние словари v1 (дата в subject), без raw; ?format=v2 — явные поля
+    legacy = [{k: v for k, v in item.items() if k != "raw"} for item in normalize_schedule(SAMPLE_HTML)]
+    assert json.loads(plain.body) == legacy * 4
+    v2 = app.api_schedule(fake_request(), ver.id, None, None, "v2")
+    assert json.loads(v2.body) == [l.to_dict() for l in lessons] and v2.headers["etag"] != plain.headers["etag"]
+
+    # Список версий сверяется по ETag и меняется с новой версией
+    listed = app.api_versions(fake_request())
+    assert app.api_versions(fake_request(if_none_match=listed.headers["etag"])).status_code == 304
+    db.save_version(app.GROUP_CODE, "2025-09-29", "h020b", lessons[:2])
+    fresh = app.api_versions(fake_request(if_none_match=listed.headers["etag"]))
+    assert fresh.status_code == 200 and json.loads(fresh.body)[0]["id"] != ver.id
+    status = app.api_status(fake_request())
+    assert status.status_code == 200 and status.headers["cache-control"] == "no-cache"
+
+
+def test_versions_pagination():
+    # Любая версия по id; история постранично по курсору before, выборкой по индексу
+    use_test_db()
+    import json
+    from sqlalchemy import text
+    import app, db
+    from scraper import parse_schedule
+    lessons = parse_schedule(SAMPLE_HTML)
+    ids = [db.save_version("t021", "2025-09-29", f"h{n}", lessons[:1 + n % 4]).id for n in range(7)]
+    db.save_version("t021b", "2025-09-29", "x", lessons)
+    oldest = app.api_schedule(fake_request(), ids[0], None, None)
+    assert oldest.status_code == 200 and len(json.loads(oldest.body)) == 1
+    assert app.api_schedule(fake_request(), 10 ** 9, None, None).status_code == 404
+
+    seen, before, pages = [], None, 0
+    while True:
+        r = app.api_group_versions(fake_request(), "t021", before, 3)
+        seen += [v["id"] for v in json.loads(r.body)]
+        pages += 1
+        before = r.headers.get("x-next-before")
+        if before is None:
+            break
+        before = int(before)
+    assert seen == ids[::-1] and pages == 3
+    # ETag первой страницы — по max(id), сама версия в кэш не поднимается
+    import cache
+    cache.clear()
+    misses = cache.CACHE_STATS["misses"]
+    first = app.api_group_versions(fake_request(), "t021", None, 3)
+    assert f"-{ids[-1]}-" in first.headers["etag"] and cache.CACHE_STATS["misses"] == misses
+    assert cache.peek(ids[-1]) is None
+    assert db.latest_version_id("t021") == ids[-1] and db.latest_version_id("none") is None
+    assert [v.id for v in db.list_versions("t021", 2, ids[3])] == [ids[2], ids[1]]
+    with db.engine.connect() as conn:
+        plan = conn.execute(text("EXPLAIN QUERY PLAN SELECT * FROM scheduleversion WHERE group_code = 'a' "
+                                 "AND id < 5 ORDER BY id DESC LIMIT 20")).fetchall()
+    assert "ix_scheduleversion_group_id" in str(plan) and "TEMP B-TREE" not in str(plan), plan
+
+
+def test_group_latest_endpoint():
+    # Первый экран одним запросом: версия и занятия по дням, из кэша, с ETag
+    use_test_db()
+    import json
+    import app, db
+    from scraper import parse_schedule
+    lessons = parse_schedule(SAMPLE_HTML)
+    ver = db.save_version("t022", "2025-09-29", "h1", lessons)
+    calls = []
+    orig = db.list_versions
+    db.list_versions = lambda *a: calls.append(a) or orig(*a)
+    try:
+        r = app.api_group_latest(fake_request(), "t022", None, None)
+        body = json.loads(r.body)
+        assert body["id"] == ver.id and body["week"] == "2025-09-29" and body["group"] == "t022"
+        assert [d["date"] for d in body["days"]] == ["2025-09-29", "2025-09-30"]
+        assert [l["pair"] for l in body["days"][0]["lessons"]] == [1, 2, 5]
+        assert body["days"][1]["lessons"] == [lessons[3].to_dict()]
+        part = json.loads(app.api_group_latest(fake_request(), "t022", "2025-09-30", "2025-09-30").body)
+        assert [d["date"] for d in part["days"]] == ["2025-09-30"]
+        assert app.api_group_latest(fake_request(if_none_match=r.headers["etag"]), "t022", None, None).status_code == 304
+    finally:
+        db.list_versions = orig
+    assert calls == []
+    assert app.api_group_latest(fake_request(), "t022", "30.09.2025", None).status_code == 400
+    assert app.api_group_latest(fake_request(), "t022-none", None, None).status_code == 404
+    db.save_version("t022", "2025-09-29", "h2", lessons[:1])
+    fresh = app.api_group_latest(fake_request(if_none_match=r.headers["etag"]), "t022", None, None)
+    assert fresh.status_code == 200 and len(json.loads(fresh.body)["days"]) == 1
+
+
+def test_sse_events():
+    # Новая версия из run_job раздаётся подписчикам группы; по Last-Event-ID — пропущенное
+    use_test_db()
+    import json
+    import app, db, events
+    from scraper import parse_schedule
+    ver = db.save_version("t023", "2025-09-29", "h1", parse_schedule(SAMPLE_HTML))
+
+    async def fake_scrape_all(groups=None, concurrency=None):
+        return {"t023": {"changed": True, "count": 4, "week": "2025-09-29", "version_id": ver.id,
+                         "changes": {"added": [], "removed": [], "moved": [], "changed": []}}}
+
+    async def scenario():
+        listening = events.stream("t023")
+        assert (await listening.__anext__()).startswith("retry:")
+        other = events.stream("t023-other")
+        await other.__anext__()
+        assert events.subscribers("t023") == 1 and events.subscribers() == 2
+        orig = app.scrape_all
+        app.scrape_all = fake_scrape_all
+        try:
+            await app._check_groups()
+        finally:
+            app.scrape_all = orig
+        frame = await asyncio.wait_for(listening.__anext__(), 1)
+        assert frame.startswith(f"id: {ver.id}\nevent: version\n")
+        data = json.loads(frame.split("data: ", 1)[1])
+        assert data["version_id"] == ver.id and data["changes"]["added"] == []
+        # Подписчики другой группы событие не получают
+        assert all(q.empty() for q in events._subscribers["t023-other"])
+        # Медленный клиент не копит кадры бесконечно
+        before = events.EVENT_STATS["dropped"]
+        for _ in range(events.SSE_QUEUE_SIZE + 3):
+            events.publish("t023", "version", {})
+        assert events.EVENT_STATS["dropped"] - before == 3
+        await listening.aclose()
+        await other.aclose()
+        assert events.subscribers() == 0
+
+        # Переподключение с Last-Event-ID старше последней версии — сразу событие
+        r = await app.api_group_events(fake_request(last_event_id=str(ver.id - 1)), "t023")
+        first = await r.body_iterator.__anext__()
+        assert f"id: {ver.id}" in first and "event: version" in first
+        await r.body_iterator.aclose()
+        r = await app.api_group_events(fake_request(last_event_id=str(ver.id)), "t023")
+        assert "event:" not in await r.body_iterator.__anext__()
+        await r.body_iterator.aclose()
+        assert events.subscribers() == 0
+
+    asyncio.run(scenario())
+
+
+def test_adaptive_polling():
+    # Интервал по истории изменений в пределах [min, max], старты вразброс, тик берёт только «созревшие»
+    from datetime import datetime, timedelta
+    import app, polling
+    noon = datetime(2025, 9, 29, 4, 0)      # 12:00 по Иркутску
+    night = datetime(2025, 9, 29, 17, 0)    # 01:00
+    assert polling.is_working_hours(noon) and not polling.is_working_hours(night)
+    weekly = [noon - timedelta(days=7 * n, hours=5) for n in range(5)]
+    busy = [noon - timedelta(hours=4 + 4 * n) for n in range(5)]
+    assert polling.interval_for([], noon, True) == polling.POLL_BASE_MINUTES
+    assert polling.interval_for([noon - timedelta(minutes=30)] + weekly, noon, True) == polling.POLL_MIN_MINUTES
+    weekly_interval = polling.POLL_BASE_MINUTES * (168 / polling.POLL_REFERENCE_GAP_HOURS) ** 0.5
+    assert abs(polling.interval_for(weekly, noon, True) - weekly_interval) < 1e-9
+    assert polling.interval_for(weekly, night, False) == polling.POLL_MAX_MINUTES
+    # Меняется в 12 раз чаще эталонной группы — интервал меньше базового в sqrt(12) раз
+    busy_interval = polling.POLL_BASE_MINUTES * (4 / polling.POLL_REFERENCE_GAP_HOURS) ** 0.5
+    assert abs(polling.interval_for(busy, noon, True) - busy_interval) < 1e-9
+    assert abs(polling.interval_for(busy, night, False) - busy_interval * polling.POLL_OFF_HOURS_FACTOR) < 1e-9
+
+    groups = {f"p{n}": f"http://example.test/p{n}.htm" for n in range(40)}
+    polling._random.seed(1)
+    polling.setup(groups, history={"p0": busy, "p1": weekly}, now=noon)
+    starts = [g.next_due for g in polling._groups.values()]
+    assert len(set(starts)) == len(starts) and max(starts) <= noon + timedelta(minutes=polling.POLL_BASE_MINUTES)
+    later = noon + timedelta(minutes=polling.POLL_BASE_MINUTES)
+    assert set(polling.due(later)) == set(groups) and not polling.due(noon)
+
+    polling.record("p0", True, later)
+    polling.record("p1", False, later)
+    p0, p1 = polling._groups["p0"], polling._groups["p1"]
+    assert p0.history[0] == later and p0.interval == polling.POLL_MIN_MINUTES
+    assert abs((p0.next_due - later).total_seconds() / 60 - p0.interval) <= p0.interval * polling.POLL_JITTER
+    assert abs(p1.interval - weekly_interval) < 1e-9 and "p1" not in polling.due(later + timedelta(minutes=25))
+    polling.mark_all_due(now=later)
+    assert "p1" in polling.due(later + timedelta(minutes=polling.POLL_MIN_MINUTES))
+
+    # Тик проверяет только группы, которым пора
+    checked = []
+
+    async def fake_scrape_all(groups=None, concurrency=None):
+        checked.append(sorted(groups))
+        return {code: None for code in groups}
+
+    polling.setup(groups, history={}, now=datetime.utcnow() - timedelta(days=1))
+    for code in list(groups)[5:]:
+        polling._groups[code].next_due = datetime.utcnow() + timedelta(hours=1)
+    orig = app.scrape_all
+    app.scrape_all = fake_scrape_all
+    try:
+        asyncio.run(app.poll_tick())
+        asyncio.run(app.poll_tick())
+    finally:
+        app.scrape_all = orig
+    assert checked == [sorted(list(groups)[:5])], checked
+    assert all(polling._groups[c].fetches == 1 for c in list(groups)[:5])
+    polling.setup({}, history={})
+
+
+def test_scrape_leases():
+    # Реплики делят общую очередь: группу берёт одна, истёкшую аренду — другая
+    use_test_db()
+    import threading
+    from datetime import datetime, timedelta
+    import app, db, polling
+    now = datetime.utcnow()
+    groups = {f"l{n}": f"http://example.test/l{n}.htm" for n in range(30)}
+    db.sync_jobs(groups, {code: now - timedelta(minutes=1) for code in groups})
+    # Повторный старт (вторая реплика) строк не дублирует и сроки не сбивает
+    db.sync_jobs({**groups, "l0": "http://example.test/new.htm"}, {code: now + timedelta(days=1) for code in groups})
+    jobs = {j.group_code: j for j in db.list_jobs() if j.group_code in groups}
+    assert len(jobs) == 30 and jobs["l0"].url.endswith("new.htm")
+    assert all(j.next_due_at < now for j in jobs.values())
+
+    # Четыре реплики одновременно: каждая группа досталась ровно одной
+    claimed = {}
+    def worker(name):
+        claimed[name] = db.claim_jobs(name, now, 300, 10)
+    threads = [threading.Thread(target=worker, args=(f"w{n}",)) for n in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    codes = [code for got in claimed.values() for code in got]
+    assert sorted(codes) == sorted(groups) and all(len(got) <= 10 for got in claimed.values()), claimed
+    assert not db.claim_jobs("w9", now, 300, 10)
+
+    # Продление — только своих; завершает только владелец
+    code, owner = next((c, w) for w, got in claimed.items() for c in got)
+    assert db.heartbeat_jobs("w9", [code], now, 300) == 0
+    assert db.heartbeat_jobs(owner, [code], now + timedelta(minutes=4), 300) == 1
+    # Реплики пропали: истёкшие аренды берёт другая, продлённую — только после её срока
+    taken = db.claim_jobs("w9", now + timedelta(minutes=6), 300, 50)
+    assert len(taken) == 29 and code not in taken
+    later = now + timedelta(minutes=10)
+    assert list(db.claim_jobs("w9", later, 300, 50)) == [code]
+    assert not db.complete_job(owner, code, later, 20, later)
+    assert db.complete_job("w9", code, later + timedelta(minutes=20), 20, later)
+    job = next(j for j in db.list_jobs() if j.group_code == code)
+    assert job.owner is None and job.runs == 1 and job.next_due_at > later
+    assert db.release_jobs("w9") == 29
+    # Срок сдвигается только на более ранний
+    db.advance_jobs({code: later + timedelta(hours=1)})
+    assert code not in db.claim_jobs("w8", later, 300, 50)
+    db.advance_jobs({code: later})
+    assert list(db.claim_jobs("w8", later, 300, 50)) == [code]
+
+    # Тик в режиме аренды проверяет только доставшиеся группы и завершает их
+    checked = []
+
+    async def fake_scrape_all(groups=None, concurrency=None):
+        checked.append(sorted(groups))
+        return {code: None for code in groups}
+
+    db.release_jobs("w8")
+    with db.engine.begin() as conn:
+        conn.execute(db.update(db.ScrapeJob.__table__).values(next_due_at=now + timedelta(days=1)))
+        conn.execute(db.update(db.ScrapeJob.__table__)
+                     .where(db.ScrapeJob.__table__.c.group_code.in_(["l1", "l2"])).values(next_due_at=now))
+    orig = app.scrape_all, app.SCRAPE_LEASES
+    app.scrape_all, app.SCRAPE_LEASES = fake_scrape_all, True
+    try:
+        asyncio.run(app.poll_tick())
+        asyncio.run(app.poll_tick())
+    finally:
+        app.scrape_all, app.SCRAPE_LEASES = orig
+    assert checked == [["l1", "l2"]], checked
+    done = {j.group_code: j for j in db.list_jobs() if j.group_code in ("l1", "l2")}
+    assert all(j.owner is None and j.next_due_at > now for j in done.values())
+
+
+def test_sse_relay_between_replicas():
+    # Версию сохранила другая реплика: подписчики этой узнают о ней на ближайшем тике
+    use_test_db()
+    import app, db, events
+    from scraper import parse_schedule
+    lessons = parse_schedule(SAMPLE_HTML)
+    first = db.save_version("t026", "2025-09-29", "h1", lessons)
+
+    async def scenario():
+        # Клиент показал first и подписался без Last-Event-ID; «другая реплика» пишет
+        # версию раньше ближайшего тика — она всё равно приходит
+        body = (await app.api_group_events(fake_request(), "t026")).body_iterator
+        assert (await anext(body)).startswith("retry:")
+        assert events.last_id("t026") == first.id
+        ver = db.save_version("t026", "2025-09-29", "h2", lessons[:2])
+        await app.relay_versions()
+        frame = await asyncio.wait_for(anext(body), 1)
+        assert frame.startswith(f"id: {ver.id}\nevent: version\n"), frame
+        assert json.loads(frame.split("data: ", 1)[1])["count"] == 2
+        # Повтор — ни от пересылки, ни от собственного сканера
+        await app.relay_versions()
+        assert events.publish_frame("t026", app._version_event("t026", ver.id, None, 2, None), ver.id) == 0
+        await body.aclose()
+        assert events.last_id("t026") is None
+
+        # Новый первый подписчик видел только first (?after=): пропущенное — сразу,
+        # следующая запись другой реплики — на тике
+        body = (await app.api_group_events(fake_request(), "t026", first.id)).body_iterator
+        assert f"id: {ver.id}\nevent: version\n" in await anext(body)
+        newest = db.save_version("t026", "2025-09-29", "h3", lessons[:1])
+        await app.relay_versions()
+        assert (await asyncio.wait_for(anext(body), 1)).startswith(f"id: {newest.id}\n")
+        await body.aclose()
+
+    asyncio.run(scenario())
+
+
+def test_invalid_day_date_kept():
+    # Заголовок с несуществующей датой: пары дня остаются — без даты, с заголовком в subject
+    from lessons import dump_payload, load_payload
+    from scraper import iter_schedule, normalize_schedule, parse_schedule, schedule_hash
+    html = SAMPLE_HTML.replace("30.09.2025 Вт-1", "31.02.2025 Вт-1")
+    lessons, good = parse_schedule(html), parse_schedule(SAMPLE_HTML)
+    assert len(lessons) == len(good) and lessons[:3] == good[:3]
+    bad, ok = lessons[3], good[3]
+    assert bad.date is None and bad.subject == f"31.02.2025 Вт-1 | {ok.subject}"
+    assert (bad.pair, bad.time, bad.room, bad.teacher) == (ok.pair, ok.time, ok.room, ok.teacher)
+    # Как в v1: subject с датой, хэш тот же, форматы читаются в те же записи
+    legacy = normalize_schedule(html)
+    assert legacy[3]["subject"] == bad.subject
+    assert load_payload(json.dumps(legacy, ensure_ascii=False)) == lessons
+    assert load_payload(dump_payload(lessons)) == lessons
+    assert schedule_hash(lessons) == schedule_hash(legacy)
+    assert list(iter_schedule([html])) == lessons
+
+
+def test_conditional_fetch_short_circuit():
+    # 304 и неизменное тело страницы не доходят до разбора
+    use_test_db()
+    import db, diff
+    calls = {"parse": 0}
+    sent = []
+    responses = [fake_page(SAMPLE_HTML, etag='"a"'), fake_page(SAMPLE_HTML, etag='"b"'),
+                 fake_page('', not_modified=True)]
+
+    def fetch(url, etag=None, last_modified=None):
+        sent.append(etag)
+        return responses.pop(0)
+
+    orig_fetch, orig_parse = diff.fetch_page, diff.parse_page
+    def counting_parse(page):
+        calls["parse"] += 1
+        return orig_parse(page)
+    diff.fetch_page, diff.parse_page = fetch, counting_parse
+    try:
+        url = "http://example.test/t002.htm"
+        assert diff.check_and_store("t002", url)['changed']
+        assert diff.check_and_store("t002", url) is None
+        assert diff.check_and_store("t002", url) is None
+    finally:
+        diff.fetch_page, diff.parse_page = orig_fetch, orig_parse
+    assert calls["parse"] == 1, calls
+    assert sent == [None, '"a"', '"b"'], sent
+
+    # Та же страница у другой группы: свои валидаторы и своя первая версия
+    responses[:] = [fake_page(SAMPLE_HTML, etag='"b"')]
+    diff.fetch_page = fetch
+    try:
+        assert diff.check_and_store("t002b", url)['changed']
+    finally:
+        diff.fetch_page = orig_fetch
+    assert sent[-1] is None and db.last_version("t002b", db.get_page_state("t002b", url).week_start)
+    assert db.get_page_state("t002", url).etag == '"b"'
+
+    # Старая таблица с ключом по url пересоздаётся с ключом (group_code, url)
+    from sqlalchemy import inspect, text
+    with db.engine.begin() as conn:
+        conn.execute(text("DROP TABLE pagestate"))
+        conn.execute(text("CREATE TABLE pagestate (url VARCHAR PRIMARY KEY, etag VARCHAR, "
+                          "last_modified VARCHAR, raw_hash VARCHAR, week_start VARCHAR, updated_at DATETIME)"))
+        conn.execute(text("INSERT INTO pagestate (url, etag) VALUES (:u, 'old')"), {"u": url})
+    db.init_db()
+    assert inspect(db.engine).get_pk_constraint("pagestate")["constrained_columns"] == ["group_code", "url"]
+    assert db.get_page_state("t002", url) is None
+
+
+def test_http_client_retries_5xx():
+    # Временная 503 повторяется клиентом, а соединение переиспользуется
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    import http_client
+    hits = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        def do_GET(self):
+            hits.append(self.client_address[1])
+            status = 503 if len(hits) == 1 else 200
+            body = SAMPLE_HTML.encode('utf-8')
+            self.send_response(status)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        url = f"http://127.0.0.1:{server.server_port}/page.htm"
+        r = http_client.get(url)
+        assert r.status_code == 200 and len(hits) == 2, hits
+        http_client.get(url)
+        assert len(set(hits)) == 1, f"Соединение не переиспользовано: {hits}"
+    finally:
+        server.shutdown()
+
+
+def test_http_client_limits():
+    # Retry-After сервера ограничен сверху; свободное соединение ждём не бесконечно
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    import requests
+    import http_client
+    hits = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        def do_GET(self):
+            hits.append(self.path)
+            body = SAMPLE_HTML.encode('utf-8')
+            self.send_response(503 if self.path == "/busy" and len(hits) == 1 else 200)
+            self.send_header("Retry-After", "3600")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    orig = http_client.HTTP_RETRY_AFTER_MAX, http_client.HTTP_POOL_TIMEOUT
+    http_client.HTTP_RETRY_AFTER_MAX, http_client.HTTP_POOL_TIMEOUT = 0.2, 0.3
+    held = []
+    try:
+        base = f"http://127.0.0.1:{server.server_port}"
+        started = time.monotonic()
+        assert http_client.get(base + "/busy").status_code == 200 and len(hits) == 2
+        assert time.monotonic() - started < 5
+        # Все соединения к хосту заняты недочитанными ответами
+        held = [http_client.get(base + "/page.htm", stream=True) for _ in range(http_client.HTTP_POOL_PER_HOST)]
+        started = time.monotonic()
+        try:
+            http_client.get(base + "/page.htm")
+            assert False, "пул не исчерпан"
+        except requests.ConnectionError:
+            pass
+        assert time.monotonic() - started < 5
+    finally:
+        for r in held:
+            r.content
+        http_client.HTTP_RETRY_AFTER_MAX, http_client.HTTP_POOL_TIMEOUT = orig
+        http_client.close()
+        server.shutdown()
+
+
 def main():
     print('== Тест парсера: дубликаты и мусорные строки ==')
     test_scraper_no_duplicates()
     print('OK')
+    print('== Тест формата записей занятий ==')
+    test_lesson_payload_formats()
+    print('OK')
+    print('== Тест бэкендов парсера ==')
+    test_parser_backends_identical()
+    print('OK')
+    print('== Тест выбора кодировки ==')
+    test_encoding_fast_path()
+    print('OK')
+    print('== Тест потокового разбора ==')
+    test_streaming_parse_matches_dom()
+    print('OK')
+    print('== Тест пула процессов разбора ==')
+    test_parse_pool_roundtrip()
+    print('OK')
     print('== Тест лимита запросов в группе ==')
     asyncio.run(test_group_rate_limit())
     print('OK')
+    print('== Тест атомарного счётчика лимита ==')
+    test_rate_limit_atomic()
+    print('OK')
+    print('== Тест профиля SQLite и асинхронного доступа ==')
+    test_sqlite_profile_and_async()
+    print('OK')
+    print('== Тест сжатых блобов payload ==')
+    test_payload_blobs()
+    print('OK')
+    print('== Тест дельт версий ==')
+    test_payload_deltas()
+    print('OK')
+    print('== Тест миграции индексов ==')
+    test_index_migration()
+    print('OK')
+    print('== Тест выборок занятий по дате ==')
+    test_lesson_rows_by_date()
+    print('OK')
+    print('== Тест параллельного обхода групп ==')
+    test_scrape_all_concurrent()
+    print('OK')
+    print('== Тест объединения запусков проверки ==')
+    test_run_job_single_flight()
+    print('OK')
+    print('== Тест структурного сравнения версий ==')
+    test_structural_diff()
+    print('OK')
+    print('== Тест кэша последней версии ==')
+    test_latest_version_cache()
+    print('OK')
+    print('== Тест готовых сообщений бота ==')
+    test_day_messages()
+    print('OK')
+    print('== Тест HTTP-кэширования API ==')
+    test_api_http_caching()
+    print('OK')
+    print('== Тест истории версий по курсору ==')
+    test_versions_pagination()
+    print('OK')
+    print('== Тест последней версии одним запросом ==')
+    test_group_latest_endpoint()
+    print('OK')
+    print('== Тест событий SSE ==')
+    test_sse_events()
+    print('OK')
+    print('== Тест адаптивного опроса ==')
+    test_adaptive_polling()
+    print('OK')
+    print('== Тест общей очереди опроса с арендой ==')
+    test_scrape_leases()
+    print('OK')
+    print('== Тест пересылки SSE между репликами ==')
+    test_sse_relay_between_replicas()
+    print('OK')
+    print('== Тест заголовка дня с несуществующей датой ==')
+    test_invalid_day_date_kept()
+    print('OK')
+    print('== Тест условного GET ==')
+    test_conditional_fetch_short_circuit()
+    print('OK')
+    print('== Тест повторов HTTP-клиента ==')
+    test_http_client_retries_5xx()
+    print('OK')
+    print('== Тест пределов HTTP-клиента ==')
+    test_http_client_limits()
+    print('OK')
     print('Все мини-тесты прошли успешно')
 
 